@@ -0,0 +1,4 @@
+# coding=utf-8
+"""Microbenchmarks comparing vectorized code paths with the scalar ones they
+replace. Run a module directly, e.g. python -m larkin.benchmarks.wet_bulb
+"""
@@ -0,0 +1,105 @@
+# coding=utf-8
+"""Benchmark the vectorized _dtype_conv against the row-wise conversion it
+replaced
+
+Inputs mimic a raw Weather Underground history pull: string entries with
+'N/A' and -999/-9999 sentinels, over several years of half-hourly
+observations by default.
+"""
+import argparse
+import timeit
+
+import numpy as np
+import pandas as pd
+
+from larkin.model_config import model_config
+from larkin.weather.wund import _dtype_conv, stringcols
+
+conds_mapping_ = model_config["weather"]["conds_mapping"]
+wdire_mapping_ = model_config["weather"]["wdire_mapping"]
+floatcols_ = ['temp', 'dewpt', 'hum', 'pressure', 'vis', 'wspd', 'wgust',
+              'windchill', 'heatindex', 'precip', 'wdird', 'fog', 'rain',
+              'snow', 'hail', 'thunder', 'tornado']
+
+
+def _dtype_conv_rowwise(df, conds_mapping=conds_mapping_,
+                        wdire_mapping=wdire_mapping_):
+    # the conversion _dtype_conv used to do, one element at a time
+    floatcols = df.columns[df.columns.isin(stringcols) == False]
+    for stringcol in stringcols:
+        if stringcol in df.columns:
+            df[stringcol] = df[stringcol].apply(
+                lambda x: str(x) if x != 'N/A' else np.nan)
+    for floatcol in floatcols:
+        if floatcol in df.columns:
+            df[floatcol] = df[floatcol].apply(
+                lambda x: float(x) if x != 'N/A' and float(
+                    x) > -999 else np.nan)
+    if 'conds' in df.columns:
+        df['conds'] = df['conds'].apply(
+            lambda x: conds_mapping[x] if x in conds_mapping.keys()
+            else np.nan)
+    if 'wdire' in df.columns:
+        df['wdire'] = df['wdire'].apply(
+            lambda x: wdire_mapping[x] if x in wdire_mapping.keys()
+            else np.nan)
+        df[['conds', 'wdire']] = df[['conds', 'wdire']].fillna(method="bfill")
+    return df
+
+
+def _history_frame(years, seed=0):
+    rng = np.random.RandomState(seed)
+    index = pd.date_range('2012-01-01', periods=years * 365 * 48,
+                          freq='30min', tz='UTC')
+    size = len(index)
+    columns = {}
+    for col in floatcols_:
+        values = np.round(rng.uniform(-20, 100, size), 1).astype(str)
+        values = values.astype(object)
+        values[rng.rand(size) < 0.02] = '-9999'
+        values[rng.rand(size) < 0.02] = '-999.0'
+        values[rng.rand(size) < 0.02] = 'N/A'
+        columns[col] = values
+    for col, mapping in [('conds', conds_mapping_),
+                         ('wdire', wdire_mapping_)]:
+        labels = np.array(sorted(mapping) + ['Unknown Label', 'N/A'],
+                          dtype=object)
+        columns[col] = labels[rng.randint(0, len(labels), size)]
+    return pd.DataFrame(columns, index=index)
+
+
+def run(years=4, repeat=3):
+    """Time both conversions on the same frame, and check they agree
+
+    :param years: int
+        years of half-hourly history to convert
+    :param repeat: int
+        number of timings to take the best of
+
+    :return: dict
+        best timings in seconds, and whether the outputs are identical
+    """
+    frame = _history_frame(years)
+
+    def rowwise():
+        return _dtype_conv_rowwise(frame.copy())
+
+    def vectorized():
+        return _dtype_conv(frame.copy())
+
+    return {
+        'rowwise': min(timeit.repeat(rowwise, number=1, repeat=repeat)),
+        'vectorized': min(timeit.repeat(vectorized, number=1,
+                                        repeat=repeat)),
+        'identical': rowwise().equals(vectorized())}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--years", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    result = run(args.years, args.repeat)
+    print("rowwise: {rowwise:.3f}s, vectorized: {vectorized:.3f}s "
+          "({speedup:.0f}x), identical output: {identical}".format(
+            speedup=result['rowwise'] / result['vectorized'], **result))
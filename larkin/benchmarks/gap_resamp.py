@@ -0,0 +1,114 @@
+# coding=utf-8
+"""Benchmark the direct gap_resamp against the resampling through a series
+at accuracy it replaced
+
+Inputs mimic a raw meter series: readings every few minutes on whole
+minutes, with short and long (over gap_threshold) outages, over several
+years by default.
+"""
+import argparse
+import datetime
+import timeit
+
+import numpy as np
+import pandas as pd
+
+from larkin.model_config import model_config
+from larkin.ts_proc.munge import gap_resamp
+
+try:
+    import tracemalloc
+except ImportError:  # python 2, peak memory isn't measured
+    tracemalloc = None
+
+nary_thresh_ = model_config["sampling"]["nary_thresh"]
+gap_threshold_ = model_config["sampling"]["gap_threshold"]
+accuracy_ = model_config["sampling"]["accuracy"]
+gran_ = model_config["sampling"]["granularity"]
+
+
+def _gap_resamp_upsampled(ts, gap_threshold=gap_threshold_,
+                          accuracy=accuracy_, gran=gran_):
+    # the continuous resampling gap_resamp used to do, through a series
+    # with one row per accuracy step
+    longest_allowed_gap = datetime.timedelta(hours=gap_threshold)
+    bool_arr = (ts.reset_index()['index'] - ts.reset_index()['index'].shift()
+                ) <= longest_allowed_gap
+    bool_arr[0] = True
+    dates_less_thresh = ts.index[bool_arr.values]
+    dates_le_resamp = pd.Series(np.nan, index=dates_less_thresh).resample(
+            accuracy).mean().index
+    ts_thresh = ts.resample(accuracy).mean().interpolate()[dates_le_resamp]
+    return ts_thresh.resample(gran).first().interpolate()
+
+
+def _meter_series(years, seed=0):
+    rng = np.random.RandomState(seed)
+    minutes = np.cumsum(rng.choice([1, 5, 15], size=years * 365 * 24 * 8))
+    # outages: a few readings dropped here and there, and a few days' long
+    # gaps
+    keep = rng.rand(len(minutes)) > 0.05
+    for outage in rng.randint(0, len(minutes), size=years * 4):
+        keep[outage:outage + rng.randint(10, 500)] = False
+    index = pd.Timestamp('2012-01-01', tz='UTC') + pd.to_timedelta(
+            minutes[keep], unit='m')
+    values = 100 + 50 * np.sin(np.arange(keep.sum()) / 96.) + \
+        rng.rand(keep.sum())
+    return pd.Series(values, index=index, name='electric')
+
+
+def _peak_memory(func):
+    if tracemalloc is None:
+        return None
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run(years=4, repeat=3):
+    """Time both resamplings on the same series, and check they agree
+
+    :param years: int
+        years of readings to resample
+    :param repeat: int
+        number of timings to take the best of
+
+    :return: dict
+        best timings in seconds, peak memory in bytes (None on python 2),
+        and whether the outputs agree
+    """
+    ts = _meter_series(years)
+
+    def upsampled():
+        return _gap_resamp_upsampled(ts)
+
+    def direct():
+        return gap_resamp(ts, nary_thresh_, gap_threshold_, accuracy_, gran_,
+                          discrete=False, check_gaps=False)
+
+    expected, result = upsampled(), direct()
+    return {
+        'upsampled': min(timeit.repeat(upsampled, number=1, repeat=repeat)),
+        'direct': min(timeit.repeat(direct, number=1, repeat=repeat)),
+        'upsampled_memory': _peak_memory(upsampled),
+        'direct_memory': _peak_memory(direct),
+        'identical': expected.index.equals(result.index) and np.allclose(
+                expected.values, result.values, equal_nan=True)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--years", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    result = run(args.years, args.repeat)
+    print("upsampled: {upsampled:.3f}s, direct: {direct:.3f}s "
+          "({speedup:.0f}x), identical output: {identical}".format(
+            speedup=result['upsampled'] / result['direct'], **result))
+    if result['direct_memory'] is not None:
+        print("peak memory upsampled: {:.1f}MB, direct: {:.1f}MB".format(
+                result['upsampled_memory'] / 1e6,
+                result['direct_memory'] / 1e6))
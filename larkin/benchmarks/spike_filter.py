@@ -0,0 +1,52 @@
+# coding=utf-8
+"""Benchmark the rolling spike filters, alongside the weekly filter_three_std
+grouping electricity munging once applied
+
+Inputs mimic a raw meter series over several years by default, see
+larkin.benchmarks.gap_resamp. Timings should grow linearly with --years.
+"""
+import argparse
+import timeit
+
+from larkin.benchmarks.gap_resamp import _meter_series
+from larkin.ts_proc.munge import filter_three_std, spike_filter
+
+
+def _weekly_three_std(ts):
+    # the filter electricity munging used to apply, per week of year
+    filtered = ts.groupby(ts.index.dayofyear // 7).apply(filter_three_std)
+    return filtered.reset_index(level=0, drop=True)
+
+
+def run(years=4, repeat=3):
+    """Time the spike filters and the weekly grouping on the same series
+
+    :param years: int
+        years of readings to filter
+    :param repeat: int
+        number of timings to take the best of
+
+    :return: dict
+        best timings in seconds, and the number of readings filtered
+    """
+    ts = _meter_series(years)
+    timings = {}
+    for name, func in [
+            ('weekly', lambda: _weekly_three_std(ts)),
+            ('mad', lambda: spike_filter(ts, 'mad', min_periods=96)),
+            ('quantile', lambda: spike_filter(ts, 'quantile', threshold=3,
+                                              min_periods=96))]:
+        timings[name] = min(timeit.repeat(func, number=1, repeat=repeat))
+    timings['readings'] = len(ts)
+    return timings
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--years", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    result = run(args.years, args.repeat)
+    print("{readings} readings. weekly filter_three_std: {weekly:.3f}s, "
+          "rolling mad: {mad:.3f}s, rolling quantile: {quantile:.3f}s".format(
+            **result))
@@ -0,0 +1,58 @@
+# coding=utf-8
+"""Benchmark compute_bulb_array against row-wise compute_bulb
+
+Inputs cover the range of New York weather history: four years of
+15-minute readings by default.
+"""
+import argparse
+import timeit
+
+import numpy as np
+
+from larkin.weather.wet_bulb import compute_bulb, compute_bulb_array
+
+
+def _inputs(size, seed=0):
+    rng = np.random.RandomState(seed)
+    temp = rng.uniform(-10, 105, size)
+    dewpt = temp - rng.uniform(0, 40, size)
+    pressure = rng.uniform(29, 31, size)
+    return temp, dewpt, pressure
+
+
+def run(size=4 * 365 * 96, repeat=3):
+    """Time both paths on the same inputs, and check they agree
+
+    :param size: int
+        number of (temp, dewpt, pressure) triples
+    :param repeat: int
+        number of timings to take the best of
+
+    :return: dict
+        best timings in seconds, and largest absolute difference in results
+    """
+    temp, dewpt, pressure = _inputs(size)
+
+    def scalar():
+        return np.array([compute_bulb(t, d, p)
+                         for t, d, p in zip(temp, dewpt, pressure)])
+
+    def vectorized():
+        return compute_bulb_array(temp, dewpt, pressure)
+
+    return {
+        'scalar': min(timeit.repeat(scalar, number=1, repeat=repeat)),
+        'vectorized': min(timeit.repeat(vectorized, number=1,
+                                        repeat=repeat)),
+        'max_abs_diff': np.abs(scalar() - vectorized()).max()}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=4 * 365 * 96)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    result = run(args.size, args.repeat)
+    print("scalar: {scalar:.3f}s, vectorized: {vectorized:.3f}s "
+          "({speedup:.0f}x), max abs diff: {max_abs_diff:.2g}".format(
+            speedup=result['scalar'] / result['vectorized'], **result))
@@ -0,0 +1,78 @@
+# coding=utf-8
+import logging
+import threading
+
+import pymongo
+
+from larkin.user_config import user_config
+
+logger = logging.getLogger("root")
+pool_cfg = user_config["building_dbs"]["mongo_pool"]
+
+# one client per credential set, shared by every fetcher in the process.
+# MongoClient is thread-safe and keeps its own connection pool
+_clients = {}
+_lock = threading.Lock()
+
+
+def get_client(host, port, username, password, source):
+    """Return the shared, authenticated client for a credential set
+
+    The client is created and authenticated on first use, then reused for
+    the lifetime of the process, so that repeated fetches don't pay for a
+    TCP handshake and an authentication round-trip each time. Pool size and
+    timeouts are read from user_config["building_dbs"]["mongo_pool"].
+
+    :param host: string
+        database server name or IP-address
+    :param port: int
+        database port number
+    :param username: string
+        database username
+    :param password: string
+        database password
+    :param source: string
+        source database for authentication
+
+    :return: pymongo.MongoClient
+    """
+    key = (host, port, username, password, source)
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            client = pymongo.MongoClient(
+                    host=host, port=port,
+                    maxPoolSize=pool_cfg["max_pool_size"],
+                    connectTimeoutMS=pool_cfg["connect_timeout_ms"],
+                    socketTimeoutMS=pool_cfg["socket_timeout_ms"],
+                    serverSelectionTimeoutMS=pool_cfg[
+                        "server_selection_timeout_ms"])
+            client[source].authenticate(username, password, source=source)
+            _clients[key] = client
+    return client
+
+
+def get_collection(host, port, username, password, source, db_name,
+                   collection_name):
+    """Collection handle backed by the shared client for a credential set
+
+    :param db_name: string
+        name of the database on server
+    :param collection_name: string
+        collection name to use
+
+    :return: pymongo.collection.Collection
+    """
+    client = get_client(host, port, username, password, source)
+    return client[db_name][collection_name]
+
+
+def close_all():
+    """Close every shared client. Clients are recreated on next use"""
+    with _lock:
+        for client in _clients.values():
+            client.close()
+        if len(_clients):
+            logger.info("Closed {} database connection pool(s).".format(
+                    len(_clients)))
+        _clients.clear()
@@ -0,0 +1,87 @@
+# coding=utf-8
+import numpy as np
+import pandas as pd
+
+
+def to_arrays(ts_list, val_list):
+    """Convert lists of timestamps and values to numpy arrays
+
+    Numeric readings are converted to float64, with missing values as NaN;
+    anything else (for example 'active'/'inactive' fan statuses) is kept as
+    strings, or as objects if types are mixed.
+
+    :param ts_list: list
+        timestamps. Missing timestamps become NaT
+    :param val_list: list
+        values corresponding to ts_list
+
+    :return: tuple of numpy arrays
+        datetime64[ns] timestamps and values
+    """
+    times = np.array(ts_list, dtype='datetime64[ns]')
+    try:
+        values = np.array(val_list, dtype='float64')
+    except (TypeError, ValueError):
+        values = np.array(val_list)
+        if values.dtype.kind not in 'US':
+            values = np.array(val_list, dtype=object)
+    return times, values
+
+
+def concat_values(pieces):
+    """Concatenate value arrays, falling back to object if dtypes disagree
+
+    :param pieces: list of numpy arrays
+    :return: numpy array
+    """
+    pieces = [piece for piece in pieces if len(piece)]
+    if not len(pieces):
+        return np.array([], dtype='float64')
+    kinds = set(piece.dtype.kind for piece in pieces)
+    if len(kinds) == 1 or kinds <= set('iuf'):
+        return np.concatenate(pieces)
+    return np.concatenate([piece.astype(object) for piece in pieces])
+
+
+def readings_to_arrays(readings):
+    """Decode a document's readings array into columns
+
+    Times and values are collected into columns that numpy converts in a
+    single call each, instead of building an intermediate (time, value)
+    tuple per reading. Readings without a time or a value are dropped.
+
+    :param readings: list of dict
+        readings array of a building time series document
+
+    :return: tuple of numpy arrays
+        datetime64[ns] timestamps and values
+    """
+    readings = [reading for reading in readings
+                if reading.get('time') is not None and
+                reading.get('value') is not None]
+    return to_arrays([reading['time'] for reading in readings],
+                     [reading['value'] for reading in readings])
+
+
+def readings_to_frame(docs, index='time'):
+    """Flatten the readings arrays of several documents into one DataFrame
+
+    The readings are handed to pandas as a single list of dictionaries,
+    whose constructor is faster and lighter than gathering the columns in
+    Python first. Fields missing from some readings are filled with NaN.
+
+    :param docs: iterable of dict
+        documents holding a 'readings' array of flat dictionaries
+    :param index: string
+        reading field to use as a (datetime) index
+
+    :return: pandas DataFrame, sorted by index. Empty if there are no
+    readings
+    """
+    readings = [reading for doc in docs for reading in doc['readings']]
+    if not len(readings):
+        return pd.DataFrame()
+
+    frame = pd.DataFrame(readings)
+    frame.set_index(index, inplace=True)
+    return frame.sort_index()
@@ -0,0 +1,210 @@
+# coding=utf-8
+"""Index provisioning and query plan checks for the larkin collections
+
+Run as ``python -m larkin.db.maintenance`` to create the indexes backing the
+queries issued by larkin, and to report how many documents each of these
+queries examines compared with how many it returns. A query examining many
+more documents than it returns is scanning the collection, and will slow
+down the hourly runs as the collections grow.
+"""
+import argparse
+import logging
+import logging.config
+
+import pandas as pd
+import pymongo
+
+import larkin.db.connection
+import larkin.ts_proc.utils
+import larkin.weather.mongo
+from larkin.logging_config import config as log_cfg
+from larkin.user_config import user_config
+
+logger = logging.getLogger("root")
+dbs = user_config["building_dbs"]
+
+# indexes backing the query shapes of larkin, keyed by the collection
+# location in user_config["building_dbs"]. Equality fields come first.
+indexes_ = {
+    'building_ts_loc': [
+        [('building', pymongo.ASCENDING), ('device', pymongo.ASCENDING),
+         ('system', pymongo.ASCENDING), ('floor', pymongo.ASCENDING),
+         ('quadrant', pymongo.ASCENDING)]],
+    'weather_history_loc': [
+        [('date', pymongo.ASCENDING)]],
+    'weather_history_munged_loc': [
+        [('granularity', pymongo.ASCENDING), ('date', pymongo.ASCENDING)]],
+    'weather_forecast_loc': [
+        [('date', pymongo.ASCENDING)]]
+}
+
+
+def _collection(location):
+    return larkin.db.connection.get_collection(
+            dbs["mongo_cred"]["host"], dbs["mongo_cred"]["port"],
+            dbs["mongo_cred"]["username"], dbs["mongo_cred"]["password"],
+            dbs["mongo_cred"]["source"], dbs[location]["db_name"],
+            dbs[location]["collection_name"])
+
+
+def create_indexes():
+    """Create the indexes of indexes_ that don't exist yet
+
+    Indexes are built in the background, so that the collections stay
+    available while they are built.
+
+    :return: dict
+        location-indexed lists of index names
+    """
+    created = {}
+    for location, specs in indexes_.iteritems():
+        collection = _collection(location)
+        created[location] = [collection.create_index(spec, background=True)
+                             for spec in specs]
+        for name in created[location]:
+            logger.info("Index {} present on {}.{}".format(
+                    name, dbs[location]["db_name"],
+                    dbs[location]["collection_name"]))
+    return created
+
+
+def _plan_stages(plan):
+    # stages of a (possibly nested) winning plan, outermost first
+    stages = [plan['stage']] if 'stage' in plan else []
+    children = plan.get('inputStages', [])
+    if 'inputStage' in plan:
+        children = [plan['inputStage']] + children
+    for child in children:
+        stages.extend(_plan_stages(child))
+    return stages
+
+
+def explain_stats(cursor):
+    """Summarize the query plan of a cursor
+
+    :param cursor: pymongo.cursor.Cursor
+    :return: dict
+        documents examined, index keys examined, documents returned and the
+        stages of the winning plan
+    """
+    explanation = cursor.explain()
+    if 'executionStats' in explanation:
+        stats = explanation['executionStats']
+        return {
+            'docs_examined': stats['totalDocsExamined'],
+            'keys_examined': stats['totalKeysExamined'],
+            'returned': stats['nReturned'],
+            'stages': _plan_stages(
+                    explanation['queryPlanner']['winningPlan'])}
+    # servers before 3.0 report the legacy explain format
+    return {'docs_examined': explanation['nscannedObjects'],
+            'keys_examined': explanation['nscanned'],
+            'returned': explanation['n'],
+            'stages': [explanation['cursor']]}
+
+
+def _device_queries(buildings, date):
+    # the queries get_device_ts_new_schema issues for each prediction kind
+    utils = larkin.ts_proc.utils
+    queries = []
+    for building in buildings:
+        building_cfg = user_config["default"].get(building, {})
+        electric = utils._electric_devices(
+                building_cfg.get("electric_meter_count", 6))[0]
+        water = utils._water_devices(
+                building_cfg.get("water_meter_count", 2))[0]
+        fans = utils._fan_devices(building_cfg.get("supply_fans") or
+                                  utils.default_fans_)
+        specs = [('electric', electric, 'Electric_Utility'),
+                 ('water', water, 'Water_Demand'),
+                 ('occupancy', 'Occupancy', 'Occupancy'),
+                 ('startup', fans[0], fans[1])]
+        for kind, devices, systems in specs:
+            bounds = utils._reading_time_bounds(
+                    start=utils._default_start(kind, date), end=date)
+            queries.append((
+                "{} {}".format(building, kind),
+                utils._device_query([building], devices, systems,
+                                    bounds=bounds)))
+    return queries
+
+
+def explain_queries(buildings, date):
+    """Explain the queries issued by get_device_ts_new_schema, get_history
+    and get_forecast
+
+    :param buildings: iterable
+        buildings whose time series queries are explained
+    :param date: pd.Timestamp
+        prediction date the queries are built for
+
+    :return: list of dict
+        one report per query, see explain_stats, with an added 'name'
+    """
+    cursors = [
+        (name, _collection('building_ts_loc').find(
+                query, larkin.ts_proc.utils.device_projection_))
+        for name, query in _device_queries(buildings, date)]
+    cursors.append(('weather history', _collection(
+            'weather_history_loc').find(
+            larkin.weather.mongo._history_query(),
+            larkin.weather.mongo.history_projection_)))
+    cursors.append(('weather forecast', _collection(
+            'weather_forecast_loc').find(
+            larkin.weather.mongo._forecast_query(date)).sort(
+            "date", pymongo.ASCENDING).limit(1)))
+
+    reports = []
+    for name, cursor in cursors:
+        report = explain_stats(cursor)
+        report['name'] = name
+        reports.append(report)
+    return reports
+
+
+def log_reports(reports):
+    """Log docs examined vs returned, warning when a query examines more than
+    twice the documents it returns
+
+    :param reports: list of dict
+        as returned by explain_queries
+    """
+    for report in reports:
+        message = ("{name}: {docs_examined} docs examined, "
+                   "{keys_examined} keys examined, {returned} returned "
+                   "({plan})").format(plan=" <- ".join(report['stages']),
+                                      **report)
+        # a scan is expected when a query returns the whole collection, as
+        # the weather history query does
+        if report['docs_examined'] > 2 * max(report['returned'], 1):
+            logger.warn(message)
+        else:
+            logger.info(message)
+
+
+def main(buildings, date, explain_only=False):
+    if not explain_only:
+        create_indexes()
+    reports = explain_queries(buildings, date)
+    log_reports(reports)
+    return reports
+
+
+if __name__ == '__main__':
+    logging.config.dictConfig(log_cfg)
+    parser = argparse.ArgumentParser(
+            description="Create the indexes of the larkin collections, and"
+                        " report the query plans of the larkin queries.")
+    parser.add_argument("--buildings", type=str, nargs='*',
+                        default=user_config["default"]["buildings"],
+                        help="Buildings whose time series queries are"
+                             " explained.")
+    parser.add_argument("--date", type=str, default=pd.Timestamp.utcnow(),
+                        help="UTC datetime the queries are built for."
+                             " Defaults to time of execution.")
+    parser.add_argument("--explain-only", action='store_true',
+                        help="Only report query plans, without creating"
+                             " indexes.")
+    args = parser.parse_args()
+    main(args.buildings, pd.to_datetime(args.date, utc=True),
+         args.explain_only)
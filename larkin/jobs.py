@@ -5,6 +5,7 @@ import time
 
 import schedule
 
+import larkin.db.connection
 import larkin.predictions.run as master_run
 from larkin.logging_config import config as log_cfg
 
@@ -40,9 +41,13 @@ def main():
     schedule.every().hour.do(master_run.main)
     schedule.every().hour.do(sleeping)
 
-    while True:
-        schedule.run_pending()
-        time.sleep(1)
+    try:
+        while True:
+            schedule.run_pending()
+            time.sleep(1)
+    finally:
+        # release the shared database connection pools on shutdown
+        larkin.db.connection.close_all()
 
 
 if __name__ == 'main':
@@ -3,6 +3,8 @@
 gran_int = 15
 gran_string = str(15) + "min"
 seasonality = 60 / gran_int * 24
+import os
+
 import numpy as np
 
 model_config = dict(
@@ -11,7 +13,20 @@ model_config = dict(
             'granularity': "15min",
             'nary_thresh': 5,
             'accuracy': '1min',
-            'gap_threshold': 2},
+            'gap_threshold': 2,
+            # rolling spike filters of the kinds munged, see
+            # larkin.ts_proc.munge.spike_filter. Readings outside of
+            # threshold spreads (MADs, or inter-quantile ranges, or standard
+            # deviations where those are 0) around the readings of the
+            # trailing window are dropped
+            'spike_filter': {
+                'electric': {'enabled': False, 'method': 'mad',
+                             'window': '7D', 'threshold': 6,
+                             'min_periods': 96},
+                'occupancy': {'enabled': False, 'method': 'quantile',
+                              'window': '7D', 'threshold': 3,
+                              'quantiles': [0.25, 0.75],
+                              'min_periods': 96}}},
         svr={
             'param_search': {
                 'cv': 3,
@@ -90,6 +105,8 @@ model_config = dict(
                 'Snow': 12,
                 'Unknown': 10},
             'cov': ['wetbulb'],
+            # granularities munged weather history is stored at, on ingest
+            'munged_granularities': ['15min'],
             'seasons': {
                 'fall': [9, 12],
                 'spring': [3, 6],
@@ -140,6 +157,24 @@ model_config = dict(
                 'verbose': False
             }
         },
+        lookback={
+            # days of history pulled for each prediction kind. None pulls
+            # all available data
+            'electric': 1461,
+            'occupancy': 1461,
+            'startup': 1461,
+            'water': 1461
+        },
+        db={
+            # unwind and filter device readings on the mongo server, grouped
+            # by device and month. Readings are sorted on the client
+            'aggregation_pipeline': False
+        },
+        cache={
+            # local on-disk caches of data pulled from mongo
+            'enabled': True,
+            'directory': os.path.expanduser('~') + "/.larkin/cache/"
+        },
     default={
         'debug': False
         }
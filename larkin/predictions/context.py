@@ -0,0 +1,108 @@
+# coding=utf-8
+import logging
+
+import larkin.weather.mongo
+import larkin.weather.wund
+from larkin.user_config import user_config
+
+logger = logging.getLogger("root")
+
+
+class RunContext(object):
+    """Data shared by every building and prediction kind of a scheduled run
+
+    larkin.predictions.run.main creates one context per run and passes it to
+    the main of each prediction kind. Weather history and forecasts are the
+    same for every building and kind, so they are pulled and munged once,
+    on first use, and kept until invalidate is called at the end of the run.
+    """
+
+    def __init__(self, dbs=user_config["building_dbs"]):
+        """
+        :param dbs: dict
+            database locations and credentials, in the format of
+            user_config["building_dbs"]
+        """
+        self.dbs = dbs
+        self._memo = {}
+
+    def memoize(self, key, func, *args, **kwargs):
+        """Result of func(*args, **kwargs), computed once per run
+
+        :param key: hashable
+            identifies the result within the run
+        :param func: callable
+        :return: func(*args, **kwargs)
+        """
+        if key not in self._memo:
+            self._memo[key] = func(*args, **kwargs)
+        return self._memo[key]
+
+    def invalidate(self):
+        """Drop everything memoized, so that the next run pulls fresh data"""
+        if len(self._memo):
+            logger.debug("Dropping {} memoized run item(s).".format(
+                    len(self._memo)))
+        self._memo.clear()
+
+    def _weather_args(self, location):
+        return dict(host=self.dbs["mongo_cred"]["host"],
+                    port=self.dbs["mongo_cred"]["port"],
+                    source=self.dbs["mongo_cred"]["source"],
+                    username=self.dbs["mongo_cred"]["username"],
+                    password=self.dbs["mongo_cred"]["password"],
+                    db_name=self.dbs[location]["db_name"],
+                    collection_name=self.dbs[location]["collection_name"])
+
+    def weather_history(self):
+        """Raw weather history, see larkin.weather.mongo.get_history"""
+        return self.memoize(('weather_history',),
+                            larkin.weather.mongo.get_history,
+                            **self._weather_args("weather_history_loc"))
+
+    def munged_weather_history(self, gran):
+        """Munged weather history, see larkin.weather.mongo.get_munged_history
+
+        :param gran: string
+            resampling granularity
+        """
+        return self.memoize(
+                ('munged_weather_history', gran),
+                larkin.weather.mongo.get_munged_history,
+                gran=gran,
+                history_collection_name=self.dbs["weather_history_loc"][
+                    "collection_name"],
+                **self._weather_args("weather_history_munged_loc"))
+
+    def weather_forecast(self, date):
+        """Raw weather forecast, see larkin.weather.mongo.get_forecast
+
+        :param date: pd.Timestamp
+            prediction date
+        """
+        return self.memoize(('weather_forecast', date),
+                            larkin.weather.mongo.get_forecast,
+                            date=date,
+                            **self._weather_args("weather_forecast_loc"))
+
+    def munged_weather_forecast(self, date, gran):
+        """Weather forecast munged at gran, continuing the munged history
+
+        The forecast is munged when it is pushed, see
+        larkin.weather.mongo.forecast_update, so only the gap to the end of
+        the history is filled in here.
+
+        :param date: pd.Timestamp
+            prediction date
+        :param gran: string
+            resampling granularity
+        """
+        forecast = self.memoize(('munged_weather_forecast_frame', date, gran),
+                                larkin.weather.mongo.get_forecast, date=date,
+                                gran=gran,
+                                **self._weather_args("weather_forecast_loc"))
+        return self.memoize(('munged_weather_forecast', date, gran),
+                            larkin.weather.wund.forecast_continue,
+                            df=forecast, gran=gran,
+                            weather_history_munged=self.munged_weather_history(
+                                    gran))
@@ -3,15 +3,18 @@
 import logging
 import logging.config
 
+import pandas as pd
+
+import larkin.predictions.context
 import larkin.random_forest.model
 import larkin.sarima.model
 import larkin.svm.model
+import larkin.ts_proc.munge
 from larkin.logging_config import config as log_cfg
 from larkin.model_config import model_config
 from larkin.predictions.utils import pred_json_conv
 from larkin.ts_proc.utils import get_electric_ts
 from larkin.user_config import user_config
-from larkin.weather.mongo import get_history, get_forecast
 
 dbs = user_config["building_dbs"]
 buildings = user_config["default"]["buildings"]
@@ -19,47 +22,37 @@ logging.config.dictConfig(log_cfg)
 logger = logging.getLogger("root")
 
 
-def main():
+def main(date=None, debug=False, buildings=buildings, context=None):
     logger.info("Running electricity prediction:")
     building_preds = {}
-    for building in buildings:
-        endog = get_electric_ts(host=dbs["mongo_cred"]["host"],
-                                port=dbs["mongo_cred"]["port"],
-                                database=dbs["building_ts_loc"][
-                                    "db_name"],
-                                username=dbs["mongo_cred"][
-                                    "username"],
-                                password=dbs["mongo_cred"]["password"],
-                                source=dbs["mongo_cred"]["source"],
-                                collection_name=dbs["building_ts_loc"][
-                                    "collection_name"],
-                                building=building,
-                                meter_count=6
-                                )
+    if date is None:
+        date = pd.Timestamp.utcnow()
+    if context is None:
+        context = larkin.predictions.context.RunContext()
+    # weather is the same for every building, and pulled once per run
+    weather_history = context.munged_weather_history(
+            model_config["sampling"]["granularity"])
+    weather_forecast = context.munged_weather_forecast(
+            date, model_config["sampling"]["granularity"])
 
-        weather_history = get_history(host=dbs["mongo_cred"]["host"],
-                                      port=dbs["mongo_cred"]["port"],
-                                      source=dbs["mongo_cred"]["source"],
-                                      username=dbs["mongo_cred"][
-                                          "username"],
-                                      password=dbs["mongo_cred"]["password"],
-                                      db_name=dbs["weather_history_loc"][
-                                          "db_name"],
-                                      collection_name=
-                                      dbs["weather_history_loc"][
-                                          "collection_name"])
-
-        weather_forecast = get_forecast(host=dbs["mongo_cred"]["host"],
-                                        port=dbs["mongo_cred"]["port"],
-                                        source=dbs["mongo_cred"]["source"],
-                                        username=dbs["mongo_cred"][
-                                            "username"],
-                                        password=dbs["mongo_cred"]["password"],
-                                        db_name=dbs["weather_forecast_loc"][
-                                            "db_name"],
-                                        collection_name=
-                                        dbs["weather_forecast_loc"][
-                                            "collection_name"])
+    # single batched query for all buildings
+    endogs = get_electric_ts(host=dbs["mongo_cred"]["host"],
+                             port=dbs["mongo_cred"]["port"],
+                             database=dbs["building_ts_loc"][
+                                 "db_name"],
+                             username=dbs["mongo_cred"][
+                                 "username"],
+                             password=dbs["mongo_cred"]["password"],
+                             source=dbs["mongo_cred"]["source"],
+                             collection_name=dbs["building_ts_loc"][
+                                 "collection_name"],
+                             building=buildings,
+                             meter_count=6
+                             )
+    for building in buildings:
+        # only readings new since the last run are munged
+        endog = larkin.ts_proc.munge.munge_incremental(endogs[building],
+                                                       building)
 
         cov = model_config["weather"]["cov"]
         gran = model_config["sampling"]["granularity"]
@@ -75,11 +68,13 @@ def main():
 
         pred_forest = larkin.random_forest.model.predict(endog, weather_history,
                                                          weather_forecast, cov,
-                                                         gran, params_rfr)
+                                                         gran, params_rfr,
+                                                         munged=True)
         pred_svr = larkin.svm.model.predict(endog, weather_history,
                                             weather_forecast, cov, gran,
                                             params_svr, param_grid, cv,
-                                            threshold, n_jobs, has_bin_search)
+                                            threshold, n_jobs, has_bin_search,
+                                            munged=True)
 
         # pred_sarima = larkin.sarima.model.predict(endog, weather_history,
         #                                           weather_forecast, order,
@@ -98,7 +93,8 @@ def main():
         "Now printing all building predictions: {}".format(
             building_preds))
     logger.info("Finished electricity prediction run successfully.")
-    pred_json_conv(building_preds, "electricity")
+    if debug is False:
+        pred_json_conv(building_preds, "electricity")
     return building_preds
 
 
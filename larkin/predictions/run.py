@@ -5,6 +5,7 @@ import traceback
 
 import pandas as pd
 
+import larkin.predictions.context
 import larkin.predictions.electric.run as erun
 import larkin.predictions.occupancy.run as orun
 import larkin.predictions.startup.run as srun
@@ -43,12 +44,19 @@ def main(date, debug, buildings, kinds):
     #     logger.critical("Weather update failed. Predictions"
     #                     " may end up being very off due to usage"
     #                     " of non-current weather data")
-    for kind in kinds:
-        try:
-            select_prediction(kind)(date, debug, buildings)
-        except (RuntimeError, TypeError, NameError):
-            logger.error(traceback.format_exc())
-            logger.critical(string.capwords(kind) + " prediction failed.")
+    # weather and other data common to all buildings and kinds is pulled
+    # once, and dropped at the end of the run
+    context = larkin.predictions.context.RunContext()
+    try:
+        for kind in kinds:
+            try:
+                select_prediction(kind)(date, debug, buildings,
+                                        context=context)
+            except (RuntimeError, TypeError, NameError):
+                logger.error(traceback.format_exc())
+                logger.critical(string.capwords(kind) + " prediction failed.")
+    finally:
+        context.invalidate()
 
 
 if __name__ == "__main__":
@@ -1,19 +1,23 @@
 # coding=utf-8
 
+import datetime
 import logging
 import logging.config
 
+import numpy as np
 import pandas as pd
 from joblib import Parallel, delayed
 
+import larkin.predictions.context
 import larkin.random_forest.model
 import larkin.svm.model
+import larkin.ts_proc.munge
 from larkin.logging_config import config as log_cfg
 from larkin.model_config import model_config
 from larkin.predictions.utils import pred_json_conv
+from larkin.ts_proc.day_matrix import DayMatrix
 from larkin.ts_proc.utils import get_startup_ts
 from larkin.user_config import user_config
-from larkin.weather.mongo import get_history, get_forecast
 
 dbs = user_config["building_dbs"]
 all_buildings = user_config["default"]["buildings"]
@@ -37,63 +41,52 @@ logger = logging.getLogger("root")
 
 
 def start_time_comp(ts):
-    lag_ts_pred = ts - ts.shift(1)
-    jumps = lag_ts_pred[lag_ts_pred == 1]
-    if len(jumps) == 0:
+    days = DayMatrix.from_series(ts, gran)
+    # jumps from off to on, between consecutive slots (across midnight too)
+    jumps = np.zeros(days.values.shape, dtype=bool)
+    jumps.ravel()[1:] = np.diff(days.values.ravel()) == 1
+    if not jumps.any():
         raise Exception("The prediction is uniform, indicating an error"
                         "with the model, the data pull, or the db internals.")
-    start_time = jumps.between_time('9:00', '15:00').index[0]
+    first = days.slot(datetime.time(9))
+    rows, slots = np.nonzero(jumps[:, first:days.slot(datetime.time(15)) + 1])
+    start_time = days.time(rows[0], first + slots[0])
     return start_time
 
 
-def main(date, debug, buildings):
+def main(date, debug, buildings, context=None):
     logger.info("Running startup prediction:")
     all_buildings_preds = {}
+    if context is None:
+        context = larkin.predictions.context.RunContext()
+    # weather is the same for every building, and pulled once per run
+    weather_history = context.munged_weather_history(gran)
+    weather_forecast = context.munged_weather_forecast(date, gran)
+    # single batched query for all buildings
+    all_endogs = get_startup_ts(
+            host=dbs["mongo_cred"]["host"],
+            port=dbs["mongo_cred"]["port"],
+            db_name=dbs["building_ts_loc"][
+                "db_name"],
+            username=dbs["mongo_cred"][
+                "username"],
+            password=dbs["mongo_cred"][
+                "password"],
+            source=dbs["mongo_cred"]["source"],
+            collection_name=
+            dbs["building_ts_loc"][
+                "collection_name"],
+            building=buildings,
+            fans={building: user_config["default"].get(building, {}).get(
+                    "supply_fans") for building in buildings},
+            end=date
+    )
     for building in buildings:
         all_building_preds = {}
-        weather_history = get_history(
-                host=dbs["mongo_cred"]["host"],
-                port=dbs["mongo_cred"]["port"],
-                source=dbs["mongo_cred"]["source"],
-                username=dbs["mongo_cred"][
-                    "username"],
-                password=dbs["mongo_cred"][
-                    "password"],
-                db_name=dbs["weather_history_loc"][
-                    "db_name"],
-                collection_name=
-                dbs["weather_history_loc"][
-                    "collection_name"])
-        weather_forecast = get_forecast(
-                host=dbs["mongo_cred"]["host"],
-                port=dbs["mongo_cred"]["port"],
-                source=dbs["mongo_cred"]["source"],
-                username=dbs["mongo_cred"][
-                    "username"],
-                password=dbs["mongo_cred"][
-                    "password"],
-                db_name=dbs["weather_forecast_loc"][
-                    "db_name"],
-                collection_name=dbs["weather_forecast_loc"][
-                    "collection_name"],
-                date=date)
-        endogs = get_startup_ts(
-                host=dbs["mongo_cred"]["host"],
-                port=dbs["mongo_cred"]["port"],
-                db_name=dbs["building_ts_loc"][
-                    "db_name"],
-                username=dbs["mongo_cred"][
-                    "username"],
-                password=dbs["mongo_cred"][
-                    "password"],
-                source=dbs["mongo_cred"]["source"],
-                collection_name=
-                dbs["building_ts_loc"][
-                    "collection_name"],
-                building=building
-        )
-        for key in endogs.keys():
-            endogs[key] = endogs[key][endogs[key].index <= date]
+        # only readings new since the last run are munged
+        endogs = {device: larkin.ts_proc.munge.munge_incremental(
+                endog, building, series=device)
+            for device, endog in all_endogs[building].iteritems()}
 
         pred_svm = Parallel()(delayed(larkin.svm.model.predict)(
                 endog,
@@ -105,14 +98,16 @@ def main(date, debug, buildings):
                 cv,
                 threshold,
                 n_jobs,
-                has_bin_search) for endog in endogs.values())
+                has_bin_search,
+                munged=True) for endog in endogs.values())
 
         pred_forest = Parallel()(delayed(larkin.random_forest.model.predict)(
                 endog,
                 weather_history,
                 weather_forecast,
                 cov, gran,
-                params_rfc) for endog in endogs.values())
+                params_rfc,
+                munged=True) for endog in endogs.values())
 
         for model_name, pred in zip(["svm", "random_forest"],
                                     [pred_svm, pred_forest]):
@@ -16,9 +16,10 @@ __author__ = 'David Karapetyan'
 nary_thresh = model_config["sampling"]["nary_thresh"]
 
 
-def _build(endog, weather_history, weather_forecast, cov, gran, params):
+def _build(endog, weather_history, weather_forecast, cov, gran, params,
+           munged=False):
     covars = get_covars(endog, weather_history, weather_forecast,
-                        cov, gran, "random_forest")
+                        cov, gran, "random_forest", munged=munged)
 
     discrete = is_discrete(endog, nary_thresh)
     if discrete is True:
@@ -32,9 +33,10 @@ def _build(endog, weather_history, weather_forecast, cov, gran, params):
     return {"fit": fit, "covars": covars}
 
 
-def predict(endog, weather_history, weather_forecast, cov, gran, params):
+def predict(endog, weather_history, weather_forecast, cov, gran, params,
+            munged=False):
     model_items = _build(endog, weather_history, weather_forecast, cov, gran,
-                         params)
+                         params, munged)
     fit = model_items["fit"]
     covars = model_items["covars"]
 
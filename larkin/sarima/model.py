@@ -1,12 +1,15 @@
 # coding=utf-8
+import datetime
+
+import numpy as np
 import pandas as pd
 import statsmodels.tsa.arima_model
 import statsmodels.tsa.stattools
 from dateutil.relativedelta import relativedelta
 from statsmodels.tsa.statespace.sarimax import SARIMAX
 
-import larkin.ts_proc.munge
 from larkin.ts_proc.covar_build import get_covars
+from larkin.ts_proc.day_matrix import DayMatrix
 
 
 # from rpy2.robjects.packages import importr
@@ -60,22 +63,23 @@ def _benchmark_ts(ts, date_time):
     :return: pandas.core.series.Series
     # """
 
-    ts_filt = larkin.ts_proc.munge.filter_day_season(ts, day=date_time.weekday,
-                                                     month=date_time.month)
+    days = DayMatrix.from_series(ts).day_season(date_time.weekday(),
+                                                date_time.month)
     # check that we have a complete time series
-    if len(ts_filt.at_time('00:00:00')) != 0:
+    if np.isfinite(days.column(datetime.time(0))).any():
         raise ValueError("Start of day time missing. Complete benchmark Time"
                          "Series could not be found")
 
-    if len(ts_filt) == 0:
+    if not np.isfinite(days.values).any():
         raise ValueError("Complete benchmark Time Series could not be found for"
                          " indicated temperature ranges")
 
     # filter by benchmark day given by taking min over
     #  all values at input time
 
-    benchmark_date = ts_filt.at_time(date_time.time()).argmin().date()
-    return ts_filt[ts_filt.index.date == benchmark_date]
+    benchmark_date = days.dates[np.nanargmin(days.column(date_time.time()))]
+    return ts[benchmark_date:benchmark_date + pd.Timedelta(days=1) -
+              pd.Timedelta(1)]
 
 
 def start_time(ts, h5file_name, history_name, forecast_name, order,
@@ -209,12 +213,12 @@ def start_time(ts, h5file_name, history_name, forecast_name, order,
 
 
 def _build(endog, weather_history, weather_forecast, order, seasonal_order,
-           cov, gran):
+           cov, gran, munged=False):
     # if freq is None:
     #     raise ValueError("Time Series is missing frequency attribute")
 
     covars = get_covars(endog, weather_history, weather_forecast,
-                        cov, gran, "sarima")
+                        cov, gran, "sarima", munged=munged)
 
     fit = SARIMAX(
             endog=covars["y_train"],
@@ -226,9 +230,9 @@ def _build(endog, weather_history, weather_forecast, order, seasonal_order,
 
 
 def predict(endog, weather_history, weather_forecast, order, seasonal_order,
-            cov, gran):
+            cov, gran, munged=False):
     model_items = _build(endog, weather_history, weather_forecast,
-                         order, seasonal_order, cov, gran)
+                         order, seasonal_order, cov, gran, munged)
 
     fit = model_items["fit"]
     covars = model_items["covars"]
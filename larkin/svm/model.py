@@ -19,7 +19,7 @@ nary_thresh = model_config["sampling"]["nary_thresh"]
 
 
 def _build(endog, weather_history, weather_forecast, cov, gran, params,
-           param_grid, cv, threshold, n_jobs, bin_search):
+           param_grid, cv, threshold, n_jobs, bin_search, munged=False):
     """SVM Model Instantiation and Training
 
     :param params: Dictionary of SVM model parameters
@@ -38,7 +38,7 @@ def _build(endog, weather_history, weather_forecast, cov, gran, params,
     """
 
     covars = get_covars(endog, weather_history, weather_forecast,
-                        cov, gran, "svm")
+                        cov, gran, "svm", munged=munged)
 
     discrete = is_discrete(endog, nary_thresh)
     if discrete is True:
@@ -206,7 +206,7 @@ def _best_params(endog, features, estimator, param_grid, cv, n_jobs, threshold):
 
 
 def predict(endog, weather_history, weather_forecast, cov, gran, params,
-            param_grid, cv, threshold, n_jobs, has_bin_search):
+            param_grid, cv, threshold, n_jobs, has_bin_search, munged=False):
     """Time Series Prediciton Using SVM
 
     :param params: Dictionary of SVM model parameters
@@ -219,11 +219,12 @@ def predict(endog, weather_history, weather_forecast, cov, gran, params,
     is discrete or takes a continuum of values
     :param has_bin_search: Boolean. Whether or not to use binary search along
     gamma grid for each fixed C
+    :param munged: Boolean. Whether endog is already munged
     :return: Series
     """
     model_items = _build(endog, weather_history, weather_forecast, cov, gran,
                          params, param_grid, cv, threshold, n_jobs,
-                         has_bin_search)
+                         has_bin_search, munged)
     fit = model_items["fit"]
     covars = model_items["covars"]
 
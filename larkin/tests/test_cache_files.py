@@ -0,0 +1,60 @@
+# coding=utf-8
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import larkin.ts_proc.cache_files
+
+
+class TestCacheFiles(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_key_path(self):
+        cache_files = larkin.ts_proc.cache_files
+        path = cache_files.key_path(self.cache_dir, ['A', 'fan1', None],
+                                    '.pkl')
+        self.assertEqual(os.path.dirname(path), self.cache_dir)
+        self.assertTrue(path.endswith('.pkl'))
+        self.assertEqual(path, cache_files.key_path(
+                self.cache_dir, ['A', 'fan1', None], '.pkl'))
+        self.assertNotEqual(path, cache_files.key_path(
+                self.cache_dir, ['A', 'fan2', None], '.pkl'))
+
+    def test_write_file(self):
+        cache_files = larkin.ts_proc.cache_files
+        path = os.path.join(self.cache_dir, 'a', 'b', 'times.npy')
+        cache_files.write_file(path, lambda tmp: np.save(tmp, np.arange(3)))
+        np.testing.assert_array_equal(np.load(path), np.arange(3))
+        self.assertEqual(os.listdir(os.path.dirname(path)), ['times.npy'])
+
+        path = os.path.join(self.cache_dir, '20160601')
+        cache_files.write_bytes(path, b'first')
+        cache_files.write_bytes(path, b'second')
+        with open(path, 'rb') as fp:
+            self.assertEqual(fp.read(), b'second')
+
+    def test_interrupted_write_keeps_previous_file(self):
+        cache_files = larkin.ts_proc.cache_files
+        path = os.path.join(self.cache_dir, 'meta.json')
+        cache_files.write_bytes(path, b'{}')
+
+        def write(tmp):
+            with open(tmp, 'wb') as fp:
+                fp.write(b'{"half')
+            raise KeyboardInterrupt
+
+        with self.assertRaises(KeyboardInterrupt):
+            cache_files.write_file(path, write)
+        with open(path, 'rb') as fp:
+            self.assertEqual(fp.read(), b'{}')
+
+
+if __name__ == '__main__':
+    unittest.main()
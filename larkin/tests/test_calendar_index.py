@@ -0,0 +1,97 @@
+# coding=utf-8
+import datetime
+import unittest
+
+import numpy as np
+import pandas as pd
+
+import larkin.ts_proc.calendar_index
+import larkin.ts_proc.munge
+from larkin.model_config import model_config
+
+
+def _munged_series(days=730, seed=0):
+    # a series on the slots of the default granularity, missing slots and
+    # whole days here and there
+    rng = np.random.RandomState(seed)
+    index = pd.date_range('2015-01-01', periods=days * 96, freq='15min',
+                          tz='UTC')
+    keep = rng.rand(len(index)) > 0.1
+    for day in rng.randint(0, days, size=days // 20):
+        keep[day * 96:(day + 1) * 96] = False
+    return pd.Series(rng.rand(keep.sum()), index=index[keep])
+
+
+def _day_season_masked(ts, day, month, seasons):
+    # filter_day_season as it was, with boolean masks over the whole index
+    month_range = (0, 0)
+    for value in seasons.values():
+        if value[0] % 12 < month <= value[1] % 12:
+            month_range = value
+    return ts[((ts.index.weekday == day) &
+               (ts.index.month > month_range[0] % 12) &
+               (ts.index.month <= month_range[1] % 12))]
+
+
+def _day_pos_reindexed(ts, day, time, start, end, freq):
+    # ts_day_pos as it was: the grid of date_range(start, end, freq), with
+    # nan where the series has no value
+    temp = ts.reindex(pd.date_range(start=start, end=end, freq=freq))
+    temp = temp[temp.index.weekday == day]
+    if time is None:
+        return temp
+    return temp.at_time(time)
+
+
+class TestCalendarIndex(unittest.TestCase):
+    def test_day_season_matches_masks(self):
+        ts = _munged_series()
+        seasons = model_config["weather"]["seasons"]
+        for day in range(7):
+            for month in range(1, 13):
+                expected = _day_season_masked(ts, day, month, seasons)
+                result = larkin.ts_proc.munge.filter_day_season(ts, day,
+                                                                month)
+                self.assertTrue(result.index.equals(expected.index))
+
+    def test_months_in_no_season_select_nothing(self):
+        ts = _munged_series()
+        seasons = {'summer': [6, 9], 'fall': [9, 12]}
+        calendar = larkin.ts_proc.calendar_index.CalendarIndex(
+                ts.index, seasons=seasons)
+        for month in range(1, 13):
+            positions = calendar.day_season(2, month)
+            expected = _day_season_masked(ts, 2, month, seasons)
+            self.assertTrue(ts.index[positions].equals(expected.index))
+            self.assertEqual(len(positions) == 0, not 6 < month <= 9)
+
+    def test_day_time_matches_masks(self):
+        ts = _munged_series(days=120)
+        start = pd.Timestamp('2015-01-10 00:15', tz='UTC')
+        end = pd.Timestamp('2015-04-01 12:00', tz='UTC')
+        for freq in ['15min', '1h', '1D']:
+            for time in [None, datetime.time(0, 15), datetime.time(9, 30),
+                         datetime.time(9, 31)]:
+                for day in range(7):
+                    expected = _day_pos_reindexed(ts, day, time, start, end,
+                                                  freq)
+                    result = larkin.ts_proc.munge.ts_day_pos(
+                            ts, day, time, start, end, freq)
+                    # grid points missing from the series are left out,
+                    # rather than returned as nan
+                    self.assertTrue(result.index.equals(
+                            expected.dropna().index))
+                    np.testing.assert_array_equal(result.values,
+                                                  expected.dropna().values)
+
+    def test_calendars_are_shared(self):
+        index = _munged_series(days=30).index
+        calendar = larkin.ts_proc.calendar_index.calendar_index(index)
+        self.assertIs(larkin.ts_proc.calendar_index.calendar_index(
+                index.copy()), calendar)
+        self.assertIsNot(larkin.ts_proc.calendar_index.calendar_index(
+                index[1:]), calendar)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+# coding=utf-8
+import datetime
+import unittest
+
+import numpy as np
+import pandas as pd
+
+import larkin.predictions.startup.run
+import larkin.sarima.model
+import larkin.ts_proc.munge
+from larkin.ts_proc.day_matrix import DayMatrix
+from larkin.tests.test_calendar_index import _munged_series
+
+
+def _start_time_shifted(ts):
+    # start_time_comp as it was, on the series shifted by one reading
+    lag_ts_pred = ts - ts.shift(1)
+    jumps = lag_ts_pred[lag_ts_pred == 1]
+    if len(jumps) == 0:
+        raise Exception("The prediction is uniform")
+    return jumps.between_time('9:00', '15:00').index[0]
+
+
+def _benchmark_ts_filtered(ts, date_time):
+    # _benchmark_ts as it was, through filter_day_season
+    ts_filt = larkin.ts_proc.munge.filter_day_season(
+            ts, day=date_time.weekday(), month=date_time.month)
+    if len(ts_filt.at_time('00:00:00')) != 0:
+        raise ValueError("Start of day time missing")
+    if len(ts_filt) == 0:
+        raise ValueError("Complete benchmark Time Series could not be found")
+    benchmark_date = ts_filt.at_time(date_time.time()).idxmin().date()
+    return ts_filt[ts_filt.index.date == benchmark_date]
+
+
+def _predictions(days, seed):
+    # on/off startup predictions at the default granularity
+    rng = np.random.RandomState(seed)
+    index = pd.date_range('2016-03-23', periods=days * 96, freq='15min',
+                          tz='UTC')
+    runs = np.cumsum(rng.randint(1, 40, size=len(index)))
+    values = (np.searchsorted(runs, np.arange(len(index)), side='right') %
+              2).astype(float)
+    return pd.Series(values, index=index)
+
+
+class TestDayMatrix(unittest.TestCase):
+    def test_round_trip(self):
+        for seed in range(5):
+            ts = _munged_series(days=60, seed=seed)
+            days = DayMatrix.from_series(ts, dtype='float64')
+            result = days.to_series()
+            self.assertTrue(result.index.equals(ts.index))
+            np.testing.assert_array_equal(result.values, ts.values)
+
+            # a row per day, all nan on days missing from the series
+            self.assertTrue(days.dates.equals(pd.date_range(
+                    ts.index[0].normalize(), ts.index[-1].normalize(),
+                    freq='D')))
+            missing = ~days.dates.isin(ts.index.normalize())
+            self.assertTrue(missing.any())
+            self.assertTrue(np.isnan(days.values[missing]).all())
+
+            # float32 by default
+            result = DayMatrix.from_series(ts).to_series()
+            self.assertTrue(result.index.equals(ts.index))
+            np.testing.assert_allclose(result.values, ts.values, rtol=1e-6)
+
+    def test_empty_series(self):
+        ts = pd.Series([], index=pd.DatetimeIndex([], tz='UTC'),
+                       dtype='float64')
+        days = DayMatrix.from_series(ts)
+        self.assertEqual(days.values.shape, (0, 96))
+        self.assertEqual(len(days.to_series()), 0)
+
+    def test_rows_and_columns(self):
+        ts = _munged_series(days=30)
+        days = DayMatrix.from_series(ts, dtype='float64')
+        row = days.row('2015-01-05 13:00')
+        expected = ts['2015-01-05'].reindex(pd.date_range(
+                '2015-01-05', periods=96, freq='15min', tz='UTC'))
+        np.testing.assert_array_equal(row, expected.values)
+        column = days.column(datetime.time(9, 15))
+        expected = ts.reindex(days.dates + pd.Timedelta('9h15min'))
+        np.testing.assert_array_equal(column, expected.values)
+        with self.assertRaises(ValueError):
+            days.column(datetime.time(9, 20))
+
+    def test_day_season_matches_filter(self):
+        ts = _munged_series()
+        days = DayMatrix.from_series(ts, dtype='float64')
+        for day in range(7):
+            for month in range(1, 13):
+                expected = larkin.ts_proc.munge.filter_day_season(ts, day,
+                                                                  month)
+                result = days.day_season(day, month).to_series()
+                self.assertTrue(result.index.equals(expected.index))
+
+
+class TestStartTimeComp(unittest.TestCase):
+    def test_matches_shifted_series(self):
+        for seed in range(20):
+            ts = _predictions(3, seed)
+            self.assertEqual(
+                    larkin.predictions.startup.run.start_time_comp(ts),
+                    _start_time_shifted(ts))
+
+    def test_uniform_prediction(self):
+        ts = pd.Series(1., index=pd.date_range(
+                '2016-03-23', periods=96, freq='15min', tz='UTC'))
+        with self.assertRaises(Exception):
+            larkin.predictions.startup.run.start_time_comp(ts)
+
+
+class TestBenchmarkTs(unittest.TestCase):
+    def test_matches_filtered_series(self):
+        ts = _munged_series()
+        # without readings at midnight, which _benchmark_ts rejects
+        ts = ts[(ts.index.hour != 0) | (ts.index.minute != 0)]
+        for seed in range(20):
+            rng = np.random.RandomState(seed)
+            date_time = datetime.datetime(
+                    2016, rng.randint(1, 10), rng.randint(1, 28),
+                    rng.randint(1, 24), 15 * rng.randint(4))
+            expected = _benchmark_ts_filtered(ts, date_time)
+            result = larkin.sarima.model._benchmark_ts(ts, date_time)
+            self.assertTrue(result.index.equals(expected.index))
+            np.testing.assert_array_equal(result.values, expected.values)
+
+    def test_errors(self):
+        ts = _munged_series()
+        date_time = datetime.datetime(2016, 5, 4, 12)
+        # readings at midnight, and a month in no season
+        for series, when in [(ts, date_time),
+                             (ts[ts.index.hour != 0],
+                              date_time.replace(month=11))]:
+            with self.assertRaises(ValueError):
+                _benchmark_ts_filtered(series, when)
+            with self.assertRaises(ValueError):
+                larkin.sarima.model._benchmark_ts(series, when)
+
+
+if __name__ == '__main__':
+    unittest.main()
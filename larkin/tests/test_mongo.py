@@ -0,0 +1,88 @@
+# coding=utf-8
+import unittest
+
+import numpy as np
+import pandas as pd
+
+import larkin.weather.mongo
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+
+def _history(days):
+    index = pd.date_range('2016-06-01', periods=24 * days, freq='h',
+                          tz='UTC')
+    return pd.DataFrame({'tempi': np.arange(24. * days),
+                         'hum': np.ones(24 * days)}, index=index)
+
+
+@unittest.skipIf(mongomock is None, "mongomock is not installed")
+class TestUpsertDays(unittest.TestCase):
+    def setUp(self):
+        self.collection = mongomock.MongoClient()['db']['history']
+        self.saved = larkin.weather.mongo.max_batch_ops_
+        self.batches = []
+        bulk_write = self.collection.bulk_write
+
+        def spy(requests, *args, **kwargs):
+            self.batches.append(len(requests))
+            return bulk_write(requests, *args, **kwargs)
+
+        self.collection.bulk_write = spy
+
+    def tearDown(self):
+        larkin.weather.mongo.max_batch_ops_ = self.saved
+
+    def upsert(self, df, **kwargs):
+        self.batches = []
+        return larkin.weather.mongo._upsert_days(self.collection, df,
+                                                 **kwargs)
+
+    def test_one_document_per_day(self):
+        df = _history(5)
+        written = self.upsert(df.sample(frac=1, random_state=0),
+                              fields={'units': 'us'})
+        self.assertEqual(written['documents'], 5)
+        self.assertTrue(written['bytes'] > 0)
+        docs = list(self.collection.find().sort('date'))
+        self.assertEqual([doc['date'].day for doc in docs], [1, 2, 3, 4, 5])
+        for doc in docs:
+            self.assertEqual(doc['units'], 'us')
+            self.assertEqual(len(doc['readings']), 24)
+            times = [reading['time'] for reading in doc['readings']]
+            self.assertEqual(times, sorted(times))
+
+    def test_unchanged_days_are_skipped(self):
+        df = _history(5)
+        self.upsert(df)
+        self.assertEqual(self.upsert(df), {'documents': 0, 'bytes': 0})
+        self.assertEqual(self.batches, [])
+
+        df.loc['2016-06-03 05:00', 'tempi'] = -1.
+        self.assertEqual(self.upsert(df)['documents'], 1)
+        self.assertEqual(len(list(self.collection.find())), 5)
+        doc = self.collection.find_one({'date': pd.Timestamp(
+                '2016-06-03').to_pydatetime()})
+        self.assertEqual(doc['readings'][5]['tempi'], -1.)
+
+    def test_keys_are_stored_apart(self):
+        df = _history(3)
+        for gran in ['15min', '1h']:
+            self.assertEqual(
+                    self.upsert(df, key={'granularity': gran})['documents'],
+                    3)
+        self.assertEqual(len(list(self.collection.find(
+                {'granularity': '1h'}))), 3)
+        self.assertEqual(len(list(self.collection.find())), 6)
+
+    def test_batches_are_bounded(self):
+        larkin.weather.mongo.max_batch_ops_ = 2
+        self.assertEqual(self.upsert(_history(5))['documents'], 5)
+        self.assertEqual(self.batches, [2, 2, 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,226 @@
+# coding=utf-8
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+import larkin.ts_proc.munge
+import larkin.ts_proc.munge_cache
+from larkin.benchmarks.gap_resamp import _gap_resamp_upsampled
+
+
+def _raw_series(kind, seed, size=2000, seconds=False):
+    # readings a few minutes apart, with gaps longer than gap_threshold here
+    # and there, and missing values for water
+    rng = np.random.RandomState(seed)
+    steps = rng.choice([60, 300, 900, 3 * 3600, 7 * 3600], size=size,
+                       p=[.3, .3, .3, .06, .04])
+    offsets = np.cumsum(steps)
+    if seconds:
+        offsets = offsets + rng.randint(0, 59, size=size)
+    index = pd.Timestamp('2020-01-01', tz='UTC') + pd.to_timedelta(
+            offsets, unit='s')
+    values = rng.rand(size) * 100 + 1
+    if kind == 'water':
+        values[rng.rand(size) < .2] = np.nan
+    return pd.Series(values, index=index, name=kind)
+
+
+def _chunks(ts, freq):
+    bounds = pd.date_range(ts.index[0].floor('D'),
+                           ts.index[-1] + pd.Timedelta('3D'), freq=freq)
+    return [ts[(ts.index >= start) & (ts.index < end)]
+            for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+class TestGapResamp(unittest.TestCase):
+    def test_matches_resampling_at_accuracy(self):
+        munge = larkin.ts_proc.munge
+        for seed in range(10):
+            # readings on and off whole minutes, with gaps longer than
+            # gap_threshold, missing values and leading missing values
+            for kind, seconds in [('electric', False), ('electric', True),
+                                  ('water', True)]:
+                ts = _raw_series(kind, seed, size=500, seconds=seconds)
+                if kind == 'water':
+                    ts.iloc[:3] = np.nan
+                expected = _gap_resamp_upsampled(ts)
+                result = munge.gap_resamp(
+                        ts, munge.nary_thresh_, munge.gap_threshold_,
+                        munge.accuracy_, munge.gran_, discrete=False,
+                        check_gaps=False)
+                self.assertTrue(result.index.equals(expected.index))
+                np.testing.assert_allclose(result.values, expected.values,
+                                           equal_nan=True)
+
+    def test_last_reading_after_a_long_gap_is_cut(self):
+        munge = larkin.ts_proc.munge
+        index = pd.Timestamp('2020-01-01', tz='UTC') + pd.to_timedelta(
+                [0, 7, 20, 31, 44, 300], unit='m')
+        ts = pd.Series(np.arange(6.) + 1, index=index, name='electric')
+        expected = _gap_resamp_upsampled(ts, gap_threshold=2)
+        result = munge.gap_resamp(ts, munge.nary_thresh_, 2, munge.accuracy_,
+                                  munge.gran_, discrete=False)
+        self.assertEqual(result.index[-1], index[0] + pd.Timedelta('30min'))
+        self.assertTrue(result.index.equals(expected.index))
+        np.testing.assert_allclose(result.values, expected.values)
+
+
+def _occupancy_series(weeks=4, seed=0):
+    # counts every 15 minutes, idle at night and on weekends
+    rng = np.random.RandomState(seed)
+    index = pd.date_range('2020-01-06', periods=weeks * 7 * 96, freq='15min',
+                          tz='UTC')
+    busy = (index.dayofweek < 5) & (index.hour >= 8) & (index.hour < 18)
+    values = np.where(busy, rng.randint(300, 351, size=len(index)), 0.)
+    return pd.Series(values, index=index, name='occupancy')
+
+
+class TestSpikeFilter(unittest.TestCase):
+    def test_mostly_constant_series_is_kept(self):
+        ts = _occupancy_series()
+        for method, threshold in [('mad', 6), ('quantile', 3)]:
+            filtered = larkin.ts_proc.munge.spike_filter(
+                    ts, method, threshold=threshold, min_periods=96)
+            self.assertEqual(len(filtered), len(ts))
+            # short windows of the first day may still drop readings
+            filtered = larkin.ts_proc.munge.spike_filter(
+                    ts, method, threshold=threshold)
+            self.assertTrue(ts.index[7 * 96:].isin(filtered.index).all())
+
+    def test_single_spike_is_dropped(self):
+        ts = _occupancy_series()
+        flat = pd.Series(100., index=ts.index, name='electric')
+        noisy = _raw_series('electric', 0)
+        for series in [ts, flat, noisy]:
+            series = series.copy()
+            spike = series.index[len(series) * 3 // 4]
+            series[spike] = 5000.
+            for method, threshold in [('mad', 6), ('quantile', 3)]:
+                filtered = larkin.ts_proc.munge.spike_filter(
+                        series, method, threshold=threshold,
+                        min_periods=96)
+                self.assertTrue(filtered.index.equals(series.index.drop(
+                        spike)))
+
+    def test_context_matches_whole_series(self):
+        munge = larkin.ts_proc.munge
+        saved = munge.spike_filters_
+        munge.spike_filters_ = {'electric': {
+            'enabled': True, 'method': 'mad', 'window': '1D',
+            'threshold': 3, 'min_periods': 10}}
+        try:
+            ts = _raw_series('electric', 1)
+            ts[ts.index[1500]] = 5000.
+            expected = munge._clean(ts, 'electric')
+            self.assertTrue(len(expected) < len(ts))
+            new = ts.index >= ts.index[1400]
+            context = ts[~new]
+            context = context[context.index >=
+                              ts.index[1400] - munge._spike_context(
+                                      'electric')]
+            result = munge._clean(ts[new], 'electric', context)
+            self.assertTrue(result.index.equals(
+                    expected[expected.index >= ts.index[1400]].index))
+        finally:
+            munge.spike_filters_ = saved
+
+
+class TestMungeChunks(unittest.TestCase):
+    def assert_series_equal(self, result, expected):
+        self.assertTrue(result.index.equals(expected.index))
+        np.testing.assert_allclose(result.values, expected.values)
+
+    def test_chunks_match_full_munge(self):
+        for seed in range(10):
+            ts = _raw_series('electric', seed)
+            expected = larkin.ts_proc.munge.electricity_spike_munge(ts)
+            result = pd.concat(list(larkin.ts_proc.munge.munge_chunks(
+                    _chunks(ts, '3D'), 'electric')))
+            self.assert_series_equal(result, expected)
+
+    def test_chunks_with_missing_values_match_full_munge(self):
+        munge = larkin.ts_proc.munge
+        for seed in range(10):
+            ts = _raw_series('water', seed, seconds=True)
+            expected = munge.gap_resamp(
+                    munge._filters['water'](ts), munge.nary_thresh_,
+                    munge.gap_threshold_, munge.accuracy_, munge.gran_)
+            # chunks long enough for the first to be decided continuous
+            for freq in ['1D', '3D']:
+                result = pd.concat(list(munge.munge_chunks(
+                        _chunks(ts, freq), 'water')))
+                self.assertTrue(result.index.equals(expected.index))
+                np.testing.assert_allclose(result.values, expected.values,
+                                           equal_nan=True)
+
+    def test_too_many_gaps(self):
+        index = pd.Timestamp('2020-01-01', tz='UTC') + pd.to_timedelta(
+                np.arange(20) * 5, unit='h')
+        ts = pd.Series(np.arange(20.) + 1, index=index, name='electric')
+        with self.assertRaises(ValueError):
+            list(larkin.ts_proc.munge.munge_chunks(_chunks(ts, '1D'),
+                                                   'electric'))
+
+
+class TestMungeIncremental(unittest.TestCase):
+    def setUp(self):
+        munge = larkin.ts_proc.munge
+        self.cache_dir = tempfile.mkdtemp()
+        self.saved = (larkin.ts_proc.munge_cache.cache_dir_,
+                      munge._munge_state)
+        self.full_munges = 0
+
+        def munge_state(*args, **kwargs):
+            self.full_munges += 1
+            return self.saved[1](*args, **kwargs)
+
+        larkin.ts_proc.munge_cache.cache_dir_ = self.cache_dir
+        munge._munge_state = munge_state
+
+    def tearDown(self):
+        (larkin.ts_proc.munge_cache.cache_dir_,
+         larkin.ts_proc.munge._munge_state) = self.saved
+        shutil.rmtree(self.cache_dir)
+
+    def assert_munged_as_full(self, ts, building):
+        munge = larkin.ts_proc.munge
+        expected = self.saved[1](ts, ts.name, munge.nary_thresh_,
+                                 munge.gap_threshold_, munge.accuracy_,
+                                 munge.gran_)['munged']
+        result = munge.munge_incremental(ts, building)
+        self.assertTrue(result.index.equals(expected.index))
+        np.testing.assert_allclose(result.values, expected.values,
+                                   equal_nan=True)
+
+    def test_new_readings_match_full_munge(self):
+        for seed, kind in enumerate(['electric', 'water', 'occupancy']):
+            self.full_munges = 0
+            ts = _raw_series(kind, seed, seconds=True)
+            for end in [1200, 1201, 1500, 1800, len(ts)]:
+                self.assert_munged_as_full(ts.iloc[:end], kind)
+            self.assertEqual(self.full_munges, 1)
+
+    def test_moving_lookback_is_trimmed(self):
+        # hourly runs over a lookback window moving forward
+        for seed, kind in enumerate(['electric', 'water', 'occupancy']):
+            self.full_munges = 0
+            ts = _raw_series(kind, seed, seconds=True)
+            first = ts.index[0] + pd.Timedelta('1D')
+            for hour in range(10):
+                start = first + pd.Timedelta(hours=hour)
+                self.assert_munged_as_full(
+                        ts[start:start + pd.Timedelta('6D')], kind)
+            self.assertEqual(self.full_munges, 1)
+
+    def test_earlier_start_munges_from_scratch(self):
+        ts = _raw_series('electric', 0)
+        self.assert_munged_as_full(ts.iloc[100:1500], 'electric')
+        self.assert_munged_as_full(ts.iloc[50:1600], 'electric')
+        self.assertEqual(self.full_munges, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+# coding=utf-8
+import datetime
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import larkin.db.connection
+import larkin.ts_proc.ts_cache
+import larkin.ts_proc.utils
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+start_ = datetime.datetime(2016, 1, 1)
+db_args_ = ('localhost', 27017, 'db', 'user', 'password', 'admin', 'ts')
+
+
+@unittest.skipIf(mongomock is None, "mongomock is not installed")
+class TestBuildingsDeviceTsCached(unittest.TestCase):
+    def setUp(self):
+        self.collection = mongomock.MongoClient()['db']['ts']
+        self.cache_dir = tempfile.mkdtemp()
+        self.pulls = []
+        utils = larkin.ts_proc.utils
+        self.saved = (larkin.db.connection.get_collection,
+                      larkin.ts_proc.ts_cache.cache_dir_,
+                      utils.get_buildings_device_ts)
+
+        def pull(*args, **kwargs):
+            self.pulls.append({'buildings': list(args[7]),
+                               'devices': list(args[8]),
+                               'after': kwargs.get('after'),
+                               'start': kwargs.get('start')})
+            return self.saved[2](*args, **kwargs)
+
+        larkin.db.connection.get_collection = \
+            lambda *args: self.collection
+        larkin.ts_proc.ts_cache.cache_dir_ = self.cache_dir
+        utils.get_buildings_device_ts = pull
+
+    def tearDown(self):
+        (larkin.db.connection.get_collection,
+         larkin.ts_proc.ts_cache.cache_dir_,
+         larkin.ts_proc.utils.get_buildings_device_ts) = self.saved
+        shutil.rmtree(self.cache_dir)
+
+    def add(self, building, device, first, count):
+        self.collection.insert_one({
+            'building': building, 'device': device,
+            'readings': [{'time': first + datetime.timedelta(minutes=15 * i),
+                          'value': float(i)} for i in range(count)]})
+
+    def fetch(self, devices, start=start_):
+        self.pulls = []
+        return larkin.ts_proc.utils.get_buildings_device_ts_cached(
+                *db_args_, buildings=['A', 'B'], devices=devices,
+                start=start)
+
+    def assert_matches_db(self, data, devices, start=start_):
+        expected = self.saved[2](*db_args_, buildings=['A', 'B'],
+                                 devices=devices, start=start)
+        for building in ['A', 'B']:
+            for device in devices:
+                np.testing.assert_array_equal(data[building][device][0],
+                                              expected[building][device][0])
+                np.testing.assert_array_equal(data[building][device][1],
+                                              expected[building][device][1])
+
+    def test_series_without_readings_are_pulled_incrementally(self):
+        # each building has only one of the requested naming schemes
+        devices = ['Elec-M1', 'Electric_Meter_1^Avg_Rate']
+        self.add('A', 'Elec-M1', start_, 100)
+        self.add('B', 'Electric_Meter_1^Avg_Rate', start_, 50)
+        self.fetch(devices)
+        self.assertEqual([pull['start'] for pull in self.pulls], [start_])
+
+        for day in range(2, 5):
+            self.add('A', 'Elec-M1', start_ + datetime.timedelta(days=day), 4)
+            data = self.fetch(devices)
+            self.assertEqual(len(self.pulls), 1)
+            self.assertIsNone(self.pulls[0]['start'])
+            self.assertEqual(self.pulls[0]['after'],
+                             start_ + datetime.timedelta(minutes=15 * 49))
+            self.assert_matches_db(data, devices)
+
+    def test_new_series_are_pulled_from_start(self):
+        self.add('A', 'fan1', start_, 10)
+        self.add('B', 'fan2', start_, 10)
+        self.fetch(['fan1'])
+        data = self.fetch(['fan1', 'fan2'])
+        self.assertEqual(sorted(pull['devices'] for pull in self.pulls),
+                         [['fan1'], ['fan2']])
+        for pull in self.pulls:
+            self.assertEqual(pull['start'] is None,
+                             pull['devices'] == ['fan1'])
+        self.assert_matches_db(data, ['fan1', 'fan2'])
+
+    def test_earlier_start_repopulates(self):
+        self.add('A', 'fan1', start_, 10)
+        self.fetch(['fan1'])
+        earlier = start_ - datetime.timedelta(days=2)
+        self.add('A', 'fan1', earlier, 10)
+        data = self.fetch(['fan1'], start=earlier)
+        self.assertEqual([pull['start'] for pull in self.pulls], [earlier])
+        self.assert_matches_db(data, ['fan1'], start=earlier)
+
+    def test_update_records_queried_mark(self):
+        times, values = larkin.ts_proc.ts_cache.load('A', 'fan1')
+        mark = np.datetime64('2016-01-02T00:00:00')
+        larkin.ts_proc.ts_cache.update('A', 'fan1', None, None, None, times,
+                                       values, [], [], start=start_,
+                                       queried=mark)
+        self.assertEqual(larkin.ts_proc.ts_cache.queried_mark('A', 'fan1'),
+                         mark)
+        self.assertTrue(larkin.ts_proc.ts_cache.covers(
+                'A', 'fan1', start=start_))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+# coding=utf-8
+import datetime
+import unittest
+
+import numpy as np
+import pandas as pd
+
+import larkin.db.connection
+import larkin.ts_proc.utils
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+start_ = datetime.datetime(2016, 1, 1)
+db_args_ = ('localhost', 27017, 'db', 'user', 'password', 'admin', 'ts')
+
+
+def _join_device_sum(ts_lists, value_lists):
+    # meter summation as it was done with one outer join per meter group
+    master_df = pd.DataFrame()
+    for i, ts_list in enumerate(ts_lists):
+        master_df = master_df.join(pd.DataFrame(data=value_lists[i],
+                                                index=ts_list,
+                                                columns=[str(i + 1)]).dropna(),
+                                   how='outer')
+    return master_df.sum(axis=1).reset_index().drop_duplicates(
+            subset='index').set_index('index').sort_index()[0]
+
+
+class TestConstructDeviceSumTs(unittest.TestCase):
+    def test_matches_join(self):
+        rng = np.random.RandomState(0)
+        stamps = [start_ + datetime.timedelta(minutes=15 * i)
+                  for i in range(200)]
+        for _ in range(50):
+            ts_lists, value_lists = [], []
+            for group in range(rng.randint(1, 5)):
+                # meters with no readings, or only missing ones
+                size = rng.choice([0, 5, 50, 150])
+                times = [stamps[i] for i in rng.choice(200, size=size,
+                                                       replace=False)]
+                values = list(rng.rand(size) * 100)
+                if group == 3:
+                    values = [np.nan] * size
+                for i in rng.choice(size, size=size // 5, replace=False):
+                    values[i] = np.nan
+                # a reading repeated within a meter
+                if size:
+                    times.append(times[0])
+                    values.append(values[0])
+                ts_lists.append(times)
+                value_lists.append(values)
+            if not sum(np.isfinite(value_list).sum()
+                       for value_list in value_lists):
+                continue
+
+            expected = _join_device_sum(ts_lists, value_lists)
+            result = larkin.ts_proc.utils._construct_device_sum_ts(
+                    ts_lists, value_lists)
+            self.assertEqual(result.dtype, np.float64)
+            np.testing.assert_array_equal(
+                    result.index.values.astype('datetime64[ns]'),
+                    expected.index.values.astype('datetime64[ns]'))
+            np.testing.assert_allclose(result.values,
+                                       expected.values.astype('float64'))
+
+    def test_no_readings(self):
+        for ts_lists, value_lists in [([], []), ([[], []], [[], []]),
+                                      ([[start_]], [[np.nan]])]:
+            result = larkin.ts_proc.utils._construct_device_sum_ts(
+                    ts_lists, value_lists)
+            self.assertEqual(len(result), 0)
+            self.assertEqual(result.dtype, np.float64)
+
+
+@unittest.skipIf(mongomock is None, "mongomock is not installed")
+class TestBuildingsDeviceTs(unittest.TestCase):
+    def setUp(self):
+        self.collection = mongomock.MongoClient()['db']['ts']
+        self.saved = larkin.db.connection.get_collection
+        larkin.db.connection.get_collection = \
+            lambda *args: self.collection
+
+        rng = np.random.RandomState(0)
+        for building in ['A', 'B']:
+            for device in ['fan1', 'fan2']:
+                # documents of a month of readings each, stored out of order
+                for month in [3, 1, 2]:
+                    first = datetime.datetime(2016, month, 1)
+                    readings = [
+                        {'time': first + datetime.timedelta(hours=i),
+                         'value': float(i)} for i in range(48)]
+                    for i in rng.randint(0, 48, size=5):
+                        readings[i]['value'] = None
+                    del readings[rng.randint(0, 48)]['value']
+                    rng.shuffle(readings)
+                    self.collection.insert_one({
+                        'building': building, 'device': device,
+                        'readings': readings})
+
+    def tearDown(self):
+        larkin.db.connection.get_collection = self.saved
+
+    def fetch(self, pipeline, **bounds):
+        return larkin.ts_proc.utils.get_buildings_device_ts(
+                *db_args_, buildings=['A', 'B'], devices=['fan1', 'fan2'],
+                pipeline=pipeline, **bounds)
+
+    def test_pipeline_matches_find(self):
+        for bounds in [{}, {'start': datetime.datetime(2016, 1, 15),
+                            'end': datetime.datetime(2016, 2, 2)}]:
+            found = self.fetch(False, **bounds)
+            aggregated = self.fetch(True, **bounds)
+            for building in ['A', 'B']:
+                for device in ['fan1', 'fan2']:
+                    times, values = aggregated[building][device]
+                    self.assertTrue(len(times))
+                    self.assertFalse(np.isnan(values).any())
+                    order = np.argsort(found[building][device][0],
+                                       kind='mergesort')
+                    np.testing.assert_array_equal(
+                            times, found[building][device][0][order])
+                    np.testing.assert_array_equal(
+                            values, found[building][device][1][order])
+
+
+if __name__ == '__main__':
+    unittest.main()
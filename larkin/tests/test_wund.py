@@ -0,0 +1,244 @@
+# coding=utf-8
+import collections
+import datetime
+import json
+import re
+import threading
+import unittest
+
+import numpy as np
+import pandas as pd
+
+import larkin.weather.wund
+import larkin.weather.wet_bulb
+from larkin.benchmarks.dtype_conv import _dtype_conv_rowwise, _history_frame
+from larkin.model_config import model_config
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+except ImportError:  # python 3
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+days_ = [datetime.datetime(2016, 6, 1) + datetime.timedelta(days=i)
+         for i in range(7)]
+
+
+class TestDtypeConv(unittest.TestCase):
+    def assert_frame_equal(self, result, expected):
+        self.assertEqual(list(result.columns), list(expected.columns))
+        for col in expected.columns:
+            self.assertEqual(result[col].dtype, np.float64)
+            np.testing.assert_array_equal(result[col].values,
+                                          expected[col].values)
+
+    def test_matches_rowwise_conversion(self):
+        # 'N/A' entries, -999 and -9999 sentinels, and conds and wdire
+        # labels missing from the mappings
+        for seed in range(5):
+            df = _history_frame(1, seed).iloc[:2000]
+            self.assert_frame_equal(
+                    larkin.weather.wund._dtype_conv(df.copy()),
+                    _dtype_conv_rowwise(df.copy()))
+
+    def test_none_entries_are_missing(self):
+        df = pd.DataFrame({
+            'tempi': pd.Series(['61.0', None, 'N/A', '-9999'], dtype=object),
+            'hum': pd.Series([None, '80', '81', '82'], dtype=object),
+            'conds': pd.Series(['Clear', None, 'N/A', 'Bogus'], dtype=object),
+            'wdire': pd.Series(['North', None, 'East', 'N/A'],
+                               dtype=object)})
+        with self.assertRaises(TypeError):
+            _dtype_conv_rowwise(df.copy())
+        result = larkin.weather.wund._dtype_conv(df.copy())
+        np.testing.assert_array_equal(result['tempi'].values,
+                                      [61., np.nan, np.nan, np.nan])
+        np.testing.assert_array_equal(result['hum'].values,
+                                      [np.nan, 80., 81., 82.])
+
+        # string columns treat None as the row-wise conversion did
+        del df['tempi'], df['hum']
+        self.assert_frame_equal(larkin.weather.wund._dtype_conv(df.copy()),
+                                _dtype_conv_rowwise(df.copy()))
+
+
+def _forecast_pull(hours=36, seed=0):
+    # an hourly forecast as forecast_pull returns it
+    rng = np.random.RandomState(seed)
+    conds = sorted(model_config["weather"]["conds_mapping"])
+    wdire = sorted(model_config["weather"]["wdire_mapping"])
+
+    def english(value):
+        return {'english': str(value), 'metric': str(value / 2.)}
+
+    rows = []
+    for hour in range(hours):
+        temp = round(rng.uniform(50, 90), 1)
+        rows.append({
+            'FCTTIME': {'epoch': str(1464786000 + 3600 * hour)},
+            'temp': english(temp), 'dewpoint': english(temp - 10),
+            'windchill': english(-9999 if hour % 3 else temp - 3),
+            'heatindex': english(temp + 2),
+            'feelslike': english(temp + 1), 'wspd': english(rng.randint(20)),
+            'qpf': english(0.0), 'snow': english(0.0),
+            'mslp': english(round(rng.uniform(29.5, 30.5), 2)),
+            'wdir': {'dir': wdire[rng.randint(len(wdire))],
+                     'degrees': str(rng.randint(360))},
+            'condition': 'Clear', 'wx': conds[rng.randint(len(conds))],
+            'humidity': str(rng.randint(30, 90)), 'pop': str(rng.randint(100)),
+            'icon': 'clear', 'icon_url': 'http://localhost/clear.gif',
+            'sky': str(rng.randint(100)), 'uvi': str(rng.randint(10))})
+    df = pd.DataFrame.from_dict(rows)
+    return df.set_index(pd.DatetimeIndex(
+            [pd.Timestamp(int(row['FCTTIME']['epoch']), unit='s', tz='UTC')
+             for row in rows]))
+
+
+def _forecast_munge_appended(df, gran, weather_history_munged):
+    # forecast_munge as it was, flattening fields with per-element applies
+    # and filling the gap to the history through Series.append
+    wund = larkin.weather.wund
+    df_new = df.copy()
+    for column in wund.english_cols_:
+        df_new[column] = df_new[column].apply(lambda x: x['english'])
+    df_new['wdird'] = df_new['wdir'].apply(lambda x: x['degrees'])
+    df_new['wdire'] = df_new['wdir'].apply(lambda x: x['dir'])
+    df_new = df_new.rename(columns={
+        'condition': 'conds', 'humidity': 'hum', 'mslp': 'pressure',
+        'pop': 'rain', 'dewpoint': 'dewpt'})
+    df_new['conds'] = df_new['wx']
+    df_new = df_new.drop(['wx', 'wdir', 'FCTTIME', 'icon', 'icon_url'], axis=1)
+    df_new = wund._dtype_conv(df_new)
+    df_new = df_new.resample(gran).last().bfill()
+    df_new['wetbulb'] = [larkin.weather.wet_bulb.compute_bulb(
+            temp, dewpt, pressure) for temp, dewpt, pressure in zip(
+            df_new['temp'], df_new['dewpt'], df_new['pressure'])]
+
+    end_history = weather_history_munged.index[-1]
+    normal_gap = pd.Timedelta(gran)
+    if df_new.index[0] - end_history == normal_gap:
+        return df_new
+    gap = pd.Series(np.nan, index=pd.date_range(
+            start=end_history + normal_gap,
+            end=df_new.index[0] - normal_gap, freq=gran))
+    # appending the frame to an empty series left an all-nan column 0
+    return pd.concat([gap, df_new]).bfill()
+
+
+class TestForecastMunge(unittest.TestCase):
+    def test_matches_appended_gap_fill(self):
+        gran = '15min'
+        df = _forecast_pull()
+        frame = larkin.weather.wund.forecast_frame(df, gran)
+        begin = df.index[0]
+        # history ending right before the forecast, on the forecast grid,
+        # and off it
+        for end in [begin - pd.Timedelta('15min'),
+                    begin - pd.Timedelta('2h'),
+                    begin - pd.Timedelta('97min')]:
+            history = pd.DataFrame(
+                    {'temp': 60.}, index=pd.date_range(
+                            end - pd.Timedelta('1D'), end, freq=gran))
+            result = larkin.weather.wund.forecast_munge(df, gran, history)
+            expected = _forecast_munge_appended(df, gran, history)
+            self.assertNotIn(0, result.columns)
+            self.assertFalse(result.isnull().all().any())
+            self.assertEqual(list(result.columns), list(frame.columns))
+            self.assertEqual(result.index[0], end + pd.Timedelta(gran))
+            self.assertTrue(result.index.equals(expected.index))
+            self.assertEqual(0 in expected.columns,
+                             len(result) > len(frame))
+            expected = expected[result.columns]
+            for col in result.columns:
+                np.testing.assert_allclose(
+                        result[col].values.astype('float64'),
+                        expected[col].values.astype('float64'))
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    # answers history requests like weather underground does, failing the
+    # days the server is told to, as many times as it is told to
+
+    def do_GET(self):
+        date = re.search(r'history_(\d{8})', self.path).group(1)
+        self.server.requests[date] += 1
+        if self.server.failures[date] != 0:
+            self.server.failures[date] -= 1
+            if self.server.quota_error:
+                body = {'response': {'error': {'type': 'invalidkey'}}}
+            else:
+                self.send_error(500)
+                return
+        else:
+            body = {'history': {'observations': [{
+                'utcdate': {'pretty': '{}-{}-{} {:02d}:00'.format(
+                        date[:4], date[4:6], date[6:], hour)},
+                'tempi': str(60 + hour)} for hour in range(24)]}}
+        content = json.dumps(body).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestHistoryBackfill(unittest.TestCase):
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), _StubHandler)
+        self.server.requests = collections.Counter()
+        self.server.failures = collections.Counter()
+        self.server.quota_error = False
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = 'http://127.0.0.1:{}/'.format(self.server.server_port)
+        self.commits = []
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def backfill(self, **kwargs):
+        options = dict(max_workers=3, requests_per_minute=None, retries=2,
+                       backoff=0, commit_days=3, use_cache=False)
+        options.update(kwargs)
+        return larkin.weather.wund.history_backfill(
+                'Boston', 'MA', self.url, days_, self.commits.append,
+                **options)
+
+    def committed_days(self):
+        return [frame.index[0].date() for batch in self.commits
+                for frame in batch]
+
+    def test_days_are_committed_in_order(self):
+        self.assertEqual(self.backfill(), len(days_))
+        self.assertEqual([len(batch) for batch in self.commits], [3, 3, 1])
+        self.assertEqual(self.committed_days(),
+                         [day.date() for day in days_])
+        self.assertEqual(sum(self.server.requests.values()), len(days_))
+
+    def test_failed_pulls_are_retried(self):
+        for quota_error in [False, True]:
+            self.commits = []
+            self.server.requests.clear()
+            self.server.quota_error = quota_error
+            self.server.failures['20160603'] = 2
+            self.assertEqual(self.backfill(), len(days_))
+            self.assertEqual(self.server.requests['20160603'], 3)
+            self.assertEqual(self.committed_days(),
+                             [day.date() for day in days_])
+
+    def test_days_before_a_failing_day_are_committed(self):
+        self.server.failures['20160605'] = -1
+        with self.assertRaises(Exception):
+            self.backfill()
+        self.assertEqual(self.server.requests['20160605'], 3)
+        self.assertEqual(self.committed_days(),
+                         [day.date() for day in days_[:4]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+# coding=utf-8
+import datetime
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import larkin.weather.wund
+import larkin.weather.wund_cache
+
+day_ = datetime.datetime(2016, 6, 1)
+
+
+def _response(date, temp):
+    return json.dumps({'history': {'observations': [{
+        'utcdate': {'pretty': date.strftime('%Y-%m-%d 12:00')},
+        'tempi': str(temp)}]}}).encode('utf-8')
+
+
+class TestWundCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.saved = larkin.weather.wund_cache.cache_dir_
+        larkin.weather.wund_cache.cache_dir_ = self.cache_dir
+
+    def tearDown(self):
+        larkin.weather.wund_cache.cache_dir_ = self.saved
+        shutil.rmtree(self.cache_dir)
+
+    def objects(self):
+        return sorted(name for _, _, names in os.walk(
+                os.path.join(self.cache_dir, 'objects')) for name in names)
+
+    def test_partial_response_is_not_served_as_final(self):
+        cache = larkin.weather.wund_cache
+        cache.store('Boston', 'MA', day_, _response(day_, 60),
+                    fetched=day_ + datetime.timedelta(hours=12))
+        self.assertIsNone(cache.load('Boston', 'MA', day_))
+        self.assertIsNotNone(cache.load('Boston', 'MA', day_,
+                                        finalized_only=False))
+
+        cache.store('Boston', 'MA', day_, _response(day_, 61),
+                    fetched=day_ + datetime.timedelta(days=3))
+        parsed_json = cache.load('Boston', 'MA', day_)
+        self.assertEqual(
+                parsed_json['history']['observations'][0]['tempi'], '61')
+
+    def test_replaced_responses_are_removed(self):
+        cache = larkin.weather.wund_cache
+        for hour in range(5):
+            cache.store('Boston', 'MA', day_, _response(day_, hour),
+                        fetched=day_ + datetime.timedelta(hours=hour))
+        cache.store('Boston', 'MA', day_ + datetime.timedelta(days=1),
+                    _response(day_ + datetime.timedelta(days=1), 0))
+        self.assertEqual(len(self.objects()), 2)
+
+    def test_backfill_serves_final_days_without_waiting(self):
+        cache = larkin.weather.wund_cache
+        days = [day_ + datetime.timedelta(days=i) for i in range(5)]
+        for date in days:
+            cache.store('Boston', 'MA', date, _response(date, 60),
+                        fetched=date + datetime.timedelta(days=2))
+
+        wund = larkin.weather.wund
+        saved = wund.RateLimiter.wait, wund.urlopen
+        waits = []
+        wund.RateLimiter.wait = lambda limiter: waits.append(1)
+
+        def urlopen(*args, **kwargs):
+            raise AssertionError("requested a cached day")
+
+        wund.urlopen = urlopen
+        try:
+            committed = []
+            wund.history_backfill('Boston', 'MA', 'http://localhost/', days,
+                                  committed.extend, max_workers=2,
+                                  requests_per_minute=1, use_cache=True)
+        finally:
+            wund.RateLimiter.wait, wund.urlopen = saved
+        self.assertEqual(len(committed), 5)
+        self.assertEqual(waits, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
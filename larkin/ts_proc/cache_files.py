@@ -0,0 +1,54 @@
+# coding=utf-8
+import hashlib
+import json
+import os
+
+
+def key_path(directory, key, suffix=''):
+    """Path of a cache file (or directory) named after a key
+
+    :param directory: string
+    :param key: list
+        json encodable fields identifying the cached item
+    :param suffix: string
+        e.g. a file extension
+
+    :return: string
+        path under directory, named by the sha1 of the json encoded key
+    """
+    digest = hashlib.sha1(json.dumps(key).encode('utf-8')).hexdigest()
+    return os.path.join(directory, digest + suffix)
+
+
+def write_file(path, write):
+    """Write a cache file atomically
+
+    The file is written under a temporary name and renamed into place, so
+    that an interrupted run never leaves a half written file behind.
+    Missing directories are created.
+
+    :param path: string
+    :param write: callable
+        writes the content, given the temporary path. The temporary path
+        keeps the extension of path, e.g. for numpy.save
+    """
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    root, ext = os.path.splitext(path)
+    tmp = root + '.tmp' + ext
+    write(tmp)
+    os.rename(tmp, path)
+
+
+def write_bytes(path, content):
+    """Write content to a cache file atomically, see write_file
+
+    :param path: string
+    :param content: bytes
+    """
+    def write(tmp):
+        with open(tmp, 'wb') as fp:
+            fp.write(content)
+
+    write_file(path, write)
@@ -0,0 +1,145 @@
+# coding=utf-8
+import collections
+
+import numpy as np
+import pandas as pd
+
+from larkin.model_config import model_config
+
+gran_ = model_config["sampling"]["granularity"]
+seasons_ = model_config["weather"]["seasons"]
+# calendars of the most recently used indexes, see calendar_index
+calendar_cache_size_ = 16
+_calendars = collections.OrderedDict()
+
+
+def season_table(seasons=seasons_):
+    """Season of each month, as filter_day_season has always matched them
+
+    A season [start, end] holds the months m with start % 12 < m <= end % 12.
+
+    :param seasons: dict
+        season-indexed month ranges, as in model_config["weather"]["seasons"]
+    :return: numpy array
+        season number (position in sorted(seasons)) of each month, indexed
+        by month, with -1 for months in no season (and at position 0)
+    """
+    table = np.full(13, -1, dtype='int8')
+    for number, name in enumerate(sorted(seasons)):
+        start, end = seasons[name]
+        for month in range(1, 13):
+            if start % 12 < month <= end % 12:
+                table[month] = number
+    return table
+
+
+class CalendarIndex(object):
+    """Calendar fields of a DatetimeIndex, computed once
+
+    Positions are grouped by weekday and season, and by weekday and minute
+    of day, so that selections cost in proportion to the number of
+    positions selected, rather than to the length of the index.
+    """
+
+    def __init__(self, index, gran=gran_, seasons=seasons_):
+        """
+        :param index: pd.DatetimeIndex
+            sorted index of a time series
+        :param gran: string
+            length of the slots of day
+        :param seasons: dict
+            see season_table
+        """
+        self.index = index
+        self._seasons = season_table(seasons)
+        self.weekday = np.asarray(index.weekday, dtype='int8')
+        self.month = np.asarray(index.month, dtype='int8')
+        self.season = self._seasons[self.month]
+        self.date = index.normalize()
+        self.minute = (np.asarray(index.hour, dtype='int16') * 60 +
+                       np.asarray(index.minute, dtype='int16'))
+        self.slot = self.minute // int(pd.Timedelta(gran).total_seconds()
+                                       // 60)
+        self._day_season = self._groups(
+                self.weekday.astype('int32') * 16 + (self.season + 1), 7 * 16)
+        self._day_minute = None
+
+    @staticmethod
+    def _groups(keys, size):
+        # positions sorted by key (in index order within a key), and where
+        # the positions of each key start
+        order = np.argsort(keys, kind='mergesort')
+        bounds = np.searchsorted(keys[order], np.arange(size + 1))
+        return order, bounds
+
+    @staticmethod
+    def _group(groups, key):
+        order, bounds = groups
+        if not 0 <= key < len(bounds) - 1:
+            return order[:0]
+        return order[bounds[key]:bounds[key + 1]]
+
+    def day_season(self, day, month):
+        """Positions on a weekday, in the season of a month
+
+        :param day: int
+            day of week, Monday being 0
+        :param month: int
+        :return: numpy array of int, in index order
+        """
+        season = self._seasons[month]
+        if season < 0:
+            return np.array([], dtype='int64')
+        return self._group(self._day_season, day * 16 + (season + 1))
+
+    def day_time(self, day, time=None, start=None, end=None):
+        """Positions on a weekday, at a time of day, between start and end
+
+        :param day: int
+            day of week, Monday being 0
+        :param time: datetime.time
+            time of day. All times of day if None
+        :param start: datetime.datetime
+        :param end: datetime.datetime
+            bounds, inclusive. Unbounded if None
+        :return: numpy array of int, in index order
+        """
+        if time is None:
+            positions = np.concatenate([
+                self._group(self._day_season, day * 16 + season)
+                for season in range(16)])
+            positions.sort()
+        else:
+            if self._day_minute is None:
+                self._day_minute = self._groups(
+                        self.weekday.astype('int32') * 1440 + self.minute,
+                        7 * 1440)
+            positions = self._group(self._day_minute,
+                                    day * 1440 + time.hour * 60 + time.minute)
+            times = self.index[positions]
+            positions = positions[(times.second == time.second) &
+                                  (times.microsecond == time.microsecond)]
+        if start is not None:
+            positions = positions[self.index[positions] >= start]
+        if end is not None:
+            positions = positions[self.index[positions] <= end]
+        return positions
+
+
+def calendar_index(index):
+    """Calendar of an index, reusing the calendar of a recent equal index
+
+    :param index: pd.DatetimeIndex
+    :return: CalendarIndex
+    """
+    key = (len(index), index[0] if len(index) else None,
+           index[-1] if len(index) else None)
+    calendar = _calendars.get(key)
+    if calendar is None or not (calendar.index is index or
+                                calendar.index.equals(index)):
+        calendar = CalendarIndex(index)
+    _calendars.pop(key, None)
+    _calendars[key] = calendar
+    while len(_calendars) > calendar_cache_size_:
+        _calendars.popitem(last=False)
+    return calendar
@@ -1,10 +1,10 @@
 # coding=utf-8
 
-import datetime
 import re
 
 import sklearn.preprocessing
 
+import larkin.ts_proc.calendar_index
 import larkin.ts_proc.munge
 import larkin.weather.mongo
 import larkin.weather.wund
@@ -17,7 +17,8 @@ accuracy = model_config["sampling"]["accuracy"]
 nary_thresh = model_config["sampling"]["nary_thresh"]
 
 
-def get_covars(endog, weather_orig, forecast_orig, cov, gran, model_name):
+def get_covars(endog, weather_orig, forecast_orig, cov, gran, model_name,
+               munged=False):
     # get weather information
 
     if len(endog) == 0:
@@ -26,30 +27,44 @@ def get_covars(endog, weather_orig, forecast_orig, cov, gran, model_name):
                          " date up the stack, and make sure"
                          " you are getting the time series from the db."
                          )
-    weather_cond = larkin.weather.wund.history_munge(df=weather_orig,
-                                                     gran=gran)[cov]
-
-    forecast_cond = larkin.weather.wund.forecast_munge(
-        df=forecast_orig,
-        gran=gran,
-        weather_history_munged=weather_cond)[cov]
+    if 'wetbulb' in weather_orig.columns:
+        # already munged at ingest, see larkin.weather.mongo.get_munged_history
+        weather_cond = weather_orig[cov]
+    else:
+        weather_cond = larkin.weather.wund.history_munge(df=weather_orig,
+                                                         gran=gran)[cov]
+
+    if 'wetbulb' in forecast_orig.columns:
+        # already munged for the run, see larkin.predictions.context
+        forecast_cond = forecast_orig[cov]
+    else:
+        forecast_cond = larkin.weather.wund.forecast_munge(
+            df=forecast_orig,
+            gran=gran,
+            weather_history_munged=weather_cond)[cov]
 
     #########
     # processing for training portion
     #########
-    munge_func = munger(endog)
-    endog_munged = munge_func(endog)
+    if munged:
+        # see larkin.ts_proc.munge.munge_incremental
+        endog_munged = endog
+    else:
+        munge_func = munger(endog)
+        endog_munged = munge_func(endog)
     endog_filt = larkin.ts_proc.munge.filter_day_season(
         endog_munged,
         day=pd.Timestamp.utcnow().weekday(),
         month=pd.Timestamp.utcnow().month)
     # only include dates (as integers)that are both in features and
     # endog in training
-    # of model
-    dates = endog_filt.index.intersection(weather_cond.index)
-
-    endog_filt = endog_filt[dates]
-    present_features = weather_cond.loc[dates]
+    # of model. Looked up by position, so that the cost is in proportion
+    # to the selected dates
+    positions = weather_cond.index.get_indexer(endog_filt.index)
+    found = positions >= 0
+    endog_filt = endog_filt[found]
+    positions = positions[found]
+    present_features = weather_cond.iloc[positions]
 
     future_features = forecast_cond
     prediction_index = future_features.index
@@ -63,13 +78,15 @@ def get_covars(endog, weather_orig, forecast_orig, cov, gran, model_name):
         # need granularity as integer, to convert seconds to minutes
         gran_int = int(re.findall('\d+', gran)[0])
 
-        for item in [present_features, future_features]:
-            item['index'] = item['index'].apply(
-                lambda date:
-                datetime.timedelta(
-                    hours=date.hour,
-                    minutes=date.minute).total_seconds() / gran_int
-            )
+        # minutes since midnight of each date, from the calendar of the
+        # weather history, which every model and building shares
+        calendar = larkin.ts_proc.calendar_index.calendar_index(
+            weather_cond.index)
+        present_features['index'] = calendar.minute[positions] * 60. / \
+            gran_int
+        calendar = larkin.ts_proc.calendar_index.CalendarIndex(
+            prediction_index)
+        future_features['index'] = calendar.minute * 60. / gran_int
 
     scaler = sklearn.preprocessing.MinMaxScaler().fit(present_features)
     present_features_scaled = scaler.transform(present_features)
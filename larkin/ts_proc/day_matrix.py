@@ -0,0 +1,154 @@
+# coding=utf-8
+import numpy as np
+import pandas as pd
+
+import larkin.ts_proc.calendar_index
+from larkin.model_config import model_config
+
+gran_ = model_config["sampling"]["granularity"]
+
+
+class DayMatrix(object):
+    """Regular time series laid out as a (days, slots of day) matrix
+
+    Row i holds the values of dates[i], and column j the values at the j-th
+    slot of gran of the day. Slots without a value hold NaN. Days are those
+    of the timezone of the series, and every day between the first and last
+    date of the series has a row, so that slicing rows (or stepping through
+    them, e.g. by week) gives views of the matrix rather than copies.
+    """
+
+    def __init__(self, values, dates, gran=gran_):
+        """
+        :param values: numpy array
+            (len(dates), slots per day) matrix
+        :param dates: pd.DatetimeIndex
+            midnight of each row
+        :param gran: string
+            length of the slots of day
+        """
+        self.values = values
+        self.dates = dates
+        self.gran = gran
+
+    @classmethod
+    def from_series(cls, ts, gran=gran_, dtype='float32'):
+        """Lay out a munged series
+
+        :param ts: pd.Series
+            series with a DatetimeIndex on the slots of gran, e.g. the
+            output of larkin.ts_proc.munge.gap_resamp
+        :param gran: string
+        :param dtype: numpy dtype
+        :return: DayMatrix
+        """
+        step = pd.Timedelta(gran)
+        slots = int(pd.Timedelta(days=1) / step)
+        if not len(ts):
+            return cls(np.empty((0, slots), dtype=dtype),
+                       pd.DatetimeIndex([], tz=ts.index.tz), gran)
+
+        calendar = larkin.ts_proc.calendar_index.calendar_index(ts.index)
+        first = calendar.date[0]
+        # rounded, as days are 23 or 25 hours long at daylight saving changes
+        rows = np.round(np.asarray(
+                (calendar.date - first) / pd.Timedelta(days=1))).astype(int)
+        dates = pd.date_range(first, periods=rows[-1] + 1, freq='D')
+
+        values = np.full((len(dates), slots), np.nan, dtype=dtype)
+        values[rows, calendar.minute // int(step.total_seconds() // 60)] = \
+            ts.values
+        return cls(values, dates, gran)
+
+    def __len__(self):
+        return len(self.dates)
+
+    def __getitem__(self, key):
+        """Rows selected by key: a view for slices, a copy otherwise"""
+        return DayMatrix(self.values[key], self.dates[key], self.gran)
+
+    def slot(self, time):
+        """Column of a time of day
+
+        :param time: datetime.time
+        :return: int
+        """
+        step = pd.Timedelta(self.gran)
+        offset = pd.Timedelta(hours=time.hour, minutes=time.minute,
+                              seconds=time.second,
+                              microseconds=time.microsecond)
+        if offset % step != pd.Timedelta(0):
+            raise ValueError("{} is not at the start of a {} slot".format(
+                    time, self.gran))
+        return int(offset / step)
+
+    def column(self, time):
+        """Values at a time of day, one per day (a view)
+
+        :param time: datetime.time
+        :return: numpy array
+        """
+        return self.values[:, self.slot(time)]
+
+    def row(self, date):
+        """Values of a day (a view)
+
+        :param date: datetime-like
+            any time of the day
+        :return: numpy array
+        """
+        date = pd.Timestamp(date)
+        if date.tz is None and self.dates.tz is not None:
+            date = date.tz_localize(self.dates.tz)
+        return self.values[self.dates.get_loc(date.normalize())]
+
+    def time(self, row, slot):
+        """Timestamp of a cell
+
+        :return: pd.Timestamp
+        """
+        return self.dates[row] + slot * pd.Timedelta(self.gran)
+
+    def day_season(self, day, month):
+        """Days on a weekday, in the season of a month
+
+        See larkin.ts_proc.munge.filter_day_season. The weekday is selected
+        with a step through the rows, which is a view.
+
+        :param day: int
+            day of week, Monday being 0
+        :param month: int
+        :return: DayMatrix
+        """
+        if not len(self):
+            return self
+        weekly = self[(day - self.dates[0].weekday()) % 7::7]
+        season = larkin.ts_proc.calendar_index.season_table()
+        in_season = (season[np.asarray(weekly.dates.month)] ==
+                     season[month]) & (season[month] >= 0)
+        if in_season.all():
+            return weekly
+        return weekly[in_season]
+
+    def per_day(self, func=np.nanmean):
+        """Reduce each day to a single value
+
+        :param func: callable
+            numpy reduction taking an axis argument, e.g. np.nanmin
+        :return: pd.Series
+            indexed by dates
+        """
+        return pd.Series(func(self.values, axis=1), index=self.dates)
+
+    def to_series(self):
+        """The series the matrix was laid out from (less its NaN values)
+
+        :return: pd.Series
+        """
+        slots = self.values.shape[1]
+        index = self.dates.repeat(slots) + pd.to_timedelta(
+                np.tile(np.arange(slots), len(self)) *
+                pd.Timedelta(self.gran).total_seconds(), unit='s')
+        values = self.values.ravel()
+        present = ~np.isnan(values)
+        return pd.Series(values[present], index=index[present])
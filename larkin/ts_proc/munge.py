@@ -5,14 +5,19 @@ __author__ = 'David Karapetyan'
 
 import datetime
 
+import numpy as np
 import pandas as pd
 
+import larkin.ts_proc.calendar_index
+import larkin.ts_proc.munge_cache
 from larkin.model_config import model_config
 
 gap_threshold_ = model_config["sampling"]["gap_threshold"]
 accuracy_ = model_config["sampling"]["accuracy"]
 nary_thresh_ = model_config["sampling"]["nary_thresh"]
 gran_ = model_config["sampling"]["granularity"]
+use_cache_ = model_config["cache"]["enabled"]
+spike_filters_ = model_config["sampling"]["spike_filter"]
 
 
 def is_discrete(df, nary_thresh):
@@ -22,7 +27,8 @@ def is_discrete(df, nary_thresh):
         return False
 
 
-def gap_resamp(df, nary_thresh, gap_threshold, accuracy, gran):
+def gap_resamp(df, nary_thresh, gap_threshold, accuracy, gran,
+               discrete=None, check_gaps=True):
     """For cleaning incoming data, and extracting relevant fields
 
     :param df: pd.Dataframe
@@ -35,45 +41,93 @@ def gap_resamp(df, nary_thresh, gap_threshold, accuracy, gran):
     1min
     :param gran: Resampling granularity. For converting data to final
     resampling rate
+    :param discrete: bool. Whether to treat the data as discrete. Defaults to
+    None, in which case it is decided with is_discrete
+    :param check_gaps: bool. Whether to raise if too much of the data is
+    separated by gaps longer than gap_threshold. munge_chunks disables
+    this, and checks the series as a whole instead
 
     :return: pd.DataFrame. Original DataFrame, interpolated over and resampled,
      with the exception
     """
     # subset out relevant columns
 
-    longest_allowed_gap = datetime.timedelta(hours=gap_threshold)
+    longest_allowed_gap = np.timedelta64(
+            datetime.timedelta(hours=gap_threshold))
 
     # find dates with gaps less than threshold, and resample
-    # not doing this on the index directly because shift operator doesn't
-    # work on it as expected
-    bool_arr = (df.reset_index()['index'] - df.reset_index()['index'].shift()
-                ) <= longest_allowed_gap
-    bool_arr[0] = True  # shifting eliminated first element, so re-add it
+    steps = np.diff(df.index.values)
+    bool_arr = np.concatenate([[True], steps <= longest_allowed_gap])
     dates_less_thresh = df.index[bool_arr]
 
-    if (len(dates_less_thresh) / float(len(df.index))) < 0.5:
+    if check_gaps and \
+            (len(dates_less_thresh) / float(len(df.index))) < 0.5:
         raise ValueError("Investigate the data: it has too many gaps")
 
-    dates_le_resamp = pd.Series(
-            index=dates_less_thresh).resample(accuracy).index
-
     # resampling step, where we are careful to only fill NAs via interpolation
     # for gaps less than threshold. No filling for binary data, i.e.
     #  Process nary data different than continuous data
 
-    if is_discrete(df, nary_thresh):
+    if discrete is None:
+        discrete = is_discrete(df, nary_thresh)
+
+    if discrete:
         df_thresh_gran = df.resample(rule=gran).first().dropna()
 
     else:
-        df_thresh = df.resample(rule=accuracy).interpolate()[dates_le_resamp]
-        # resample at granularity, and interpolate to fill
-        # possible NAs (all of which
-        # will again have gaps less than threshold
-        df_thresh_gran = df_thresh.resample(rule=gran).first().interpolate()
+        df_thresh_gran = _interp_resamp(df, dates_less_thresh[-1], accuracy,
+                                        gran)
 
     return df_thresh_gran
 
 
+def _interp_resamp(ts, end, accuracy, gran):
+    """Resample straight from the readings of ts to gran
+
+    Gives the series that resampling ts at accuracy, interpolating
+    linearly, cutting it at end and taking the first value of each gran
+    period gives, without building the series at accuracy: the value of
+    a period is interpolated at its first accuracy step (or at the first
+    reading, in the period holding it).
+
+    :param ts: pd.Series
+        readings, sorted by time
+    :param end: pd.Timestamp
+        time of the last reading to resample up to
+    :param accuracy: string
+    :param gran: string
+        see gap_resamp
+
+    :return: pd.Series
+    """
+    acc = pd.Timedelta(accuracy)
+    start = ts.index[0].floor(accuracy)
+    last = int(np.floor((end - start) / acc))
+    bins = pd.date_range(start.floor(gran), (start + last * acc).floor(gran),
+                         freq=gran)
+    resampled = np.full(len(bins), np.nan)
+
+    # readings falling in the same accuracy step are averaged, as resampling
+    # at accuracy does
+    values = ts.values.astype('float64')
+    valid = ~np.isnan(values)
+    if not valid.any():
+        return pd.Series(resampled, index=bins, name=ts.name)
+    positions = np.floor(np.asarray((ts.index[valid] - start) / acc))
+    positions, inverse = np.unique(positions, return_inverse=True)
+    means = (np.bincount(inverse, weights=values[valid]) /
+             np.bincount(inverse))
+
+    # first step of each period holding a value, and last step of the period
+    first = np.maximum(np.ceil(np.asarray((bins - start) / acc)),
+                       positions[0])
+    final = np.minimum(np.ceil(np.asarray((bins + pd.Timedelta(gran) - start)
+                                          / acc)) - 1, last)
+    has_value = first <= final
+    resampled[has_value] = np.interp(first[has_value], positions, means)
+    return pd.Series(resampled, index=bins, name=ts.name)
+
+
 def ts_day_pos(ts, day, time, start, end, freq):
     """Returns slice of input time series
 
@@ -90,13 +144,11 @@ def ts_day_pos(ts, day, time, start, end, freq):
     :param freq: frequency alias
     :return: pandas.core.series.Series
     """
-    temp = ts[pd.date_range(start=start, end=end, freq=freq)]
-    temp = temp[temp.index.weekday == day]
-
-    if time is None:
-        return temp
-    else:
-        return temp.at_time(time)
+    calendar = larkin.ts_proc.calendar_index.calendar_index(ts.index)
+    temp = ts.iloc[calendar.day_time(day, time, start, end)]
+    # keep the points on the grid of date_range(start, end, freq)
+    return temp[(temp.index - start) % pd.Timedelta(freq) ==
+                pd.Timedelta(0)]
 
 
 def filter_three_std(ts):
@@ -107,22 +159,12 @@ def filter_three_std(ts):
 
 
 def filter_day_season(ts, day, month):
-    seasons = model_config["weather"]["seasons"]
-    month_range = (0, 0)
-
-    for value in seasons.values():
-        if value[0] % 12 < month <= value[1] % 12:
-            month_range = value
-
-    # filter by day and season
-    ts_filt = ts[((ts.index.weekday == day) &
-                  (ts.index.month > month_range[0] % 12) &
-                  (ts.index.month <= month_range[1] % 12)
-                  )]
-    return ts_filt
+    # filter by day and season, see larkin.ts_proc.calendar_index
+    calendar = larkin.ts_proc.calendar_index.calendar_index(ts.index)
+    return ts.iloc[calendar.day_season(day, month)]
 
 
-def electricity_spike_munge(ts):
+def _electricity_filter(ts):
     # temporary code--mongo guys to update db
     filtered = ts[~ts.index.duplicated(keep='first')].dropna()
     # take care of padding guys were doing on mongo, and 0 like values
@@ -132,12 +174,13 @@ def electricity_spike_munge(ts):
     # system testing up to 2012-10-26; cut data up to then
     filtered = filtered['2012-10-26 18:00:00':]
     filtered = filtered[filtered < 15000]
-    # filtered = filtered.groupby(
-    #         filtered.index.weekofyear).apply(
-    #         filter_three_std)
-    # filtered = filtered.reset_index(level=0, drop=True)
+    # spikes are dropped by spike_filter, see _clean
+    return filtered
+
+
+def electricity_spike_munge(ts):
     filtered = gap_resamp(
-            filtered, nary_thresh_, gap_threshold_, accuracy_,
+            _clean(ts, 'electric'), nary_thresh_, gap_threshold_, accuracy_,
             gran_)
 
     return filtered
@@ -148,7 +191,7 @@ def electricity_spike_munge(ts):
     # readings at a spike level--want to excise these
 
 
-def occupancy_spike_munge(ts):
+def _occupancy_filter(ts):
     # temporary code--mongo guys to update db
     filtered = ts[~ts.index.duplicated(keep='first')].dropna()
     # take care of padding guys were doing on mongo, and 0 like values
@@ -162,9 +205,12 @@ def occupancy_spike_munge(ts):
     #         filtered.index.date).apply(
     #         lambda df: df.drop_duplicates(keep=False))
     # filtered = filtered.reset_index(level=0, drop=True)
+    return filtered
 
+
+def occupancy_spike_munge(ts):
     filtered = gap_resamp(
-            filtered, nary_thresh_, gap_threshold_, accuracy_,
+            _clean(ts, 'occupancy'), nary_thresh_, gap_threshold_, accuracy_,
             gran_)
 
     return filtered
@@ -175,30 +221,441 @@ def occupancy_spike_munge(ts):
     # readings at a spike level--want to excise these
 
 
-def startup_munge(ts):
-    def basic_filt(x):
-        if x == "active":
-            return 1
-        elif x == "inactive":
-            return 0
-        else:
-            return x
+def _startup_filter(ts):
+    # map fan statuses to 1/0 in one pass, leaving any other value as is
+    values = ts.values
+    if values.dtype.kind not in 'USO':
+        return ts
+    active = values == "active"
+    inactive = values == "inactive"
+    if (active | inactive).all():
+        return pd.Series(active.astype('int64'), index=ts.index,
+                         name=ts.name)
+    mapped = values.astype(object)
+    mapped[active] = 1
+    mapped[inactive] = 0
+    return pd.Series(mapped, index=ts.index, name=ts.name)
+
 
-    ts_munged = ts.apply(basic_filt)
+def startup_munge(ts):
     ts_munged = gap_resamp(
-            ts_munged, nary_thresh_, gap_threshold_, accuracy_,
+            _startup_filter(ts), nary_thresh_, gap_threshold_, accuracy_,
             gran_)
     return ts_munged
 
 
+def _water_filter(ts):
+    return ts['2015-12-01':]
+
+
 def water_munge(ts):
-    filt = ts['2015-12-01':]
     ts_munged = gap_resamp(
-            filt, nary_thresh_, gap_threshold_, accuracy_,
+            _water_filter(ts), nary_thresh_, gap_threshold_, accuracy_,
             gran_)
     return ts_munged
 
 
+_filters = {'startup': _startup_filter,
+            'occupancy': _occupancy_filter,
+            'electric': _electricity_filter,
+            'water': _water_filter}
+
+
+def _spike_mask(ts, method='mad', window='7D', threshold=6, min_periods=1,
+                quantiles=(0.25, 0.75)):
+    # readings within threshold spreads of the readings of their trailing
+    # window. Readings whose window holds fewer than min_periods readings
+    # are kept
+    rolling = ts.rolling(window, min_periods=min_periods)
+    if method == 'mad':
+        # deviations are taken from the median of each reading's own
+        # window, which approximates the MAD without a per-window pass
+        center = rolling.median()
+        spread = (ts - center).abs().rolling(
+                window, min_periods=min_periods).median()
+        low, high = center, center
+    elif method == 'quantile':
+        low = rolling.quantile(quantiles[0])
+        high = rolling.quantile(quantiles[1])
+        spread = high - low
+    else:
+        raise ValueError("Unknown spike filter method {}".format(method))
+    # windows mostly holding a single value, like an occupancy count idle
+    # at night and on weekends, have no spread, which would drop every
+    # other reading. Their standard deviation is used instead
+    spread = spread.where(spread > 0, rolling.std())
+    return ~((ts < low - threshold * spread) |
+             (ts > high + threshold * spread)).values
+
+
+def spike_filter(ts, method='mad', window='7D', threshold=6, min_periods=1,
+                 quantiles=(0.25, 0.75)):
+    """Drop spikes: readings far out of the range of the readings before
+    them
+
+    Runs on pandas' rolling medians and quantiles, in O(n log(window))
+    time, and only looks back, so that new readings can be filtered as they
+    arrive given the readings of the last window (two windows for 'mad').
+
+    :param ts: pd.Series
+        readings, with a sorted DatetimeIndex
+    :param method: string
+        'mad', to drop readings more than threshold median absolute
+        deviations away from the median of their window, or 'quantile', to
+        drop readings more than threshold inter-quantile ranges below or
+        above the quantiles of their window. Windows with no spread fall
+        back to threshold standard deviations
+    :param window: string
+        length of the trailing windows, e.g. '7D'
+    :param threshold: float
+    :param min_periods: int
+        readings with fewer readings in their window are kept
+    :param quantiles: tuple
+        lower and upper quantiles of the 'quantile' method
+
+    :return: pd.Series
+    """
+    return ts[_spike_mask(ts, method, window, threshold, min_periods,
+                          quantiles)]
+
+
+def _spike_context(kind):
+    # span of the readings preceding new readings that the spike filter of
+    # a kind needs, or None if the kind isn't spike filtered
+    spec = spike_filters_.get(kind, {})
+    if not spec.get('enabled'):
+        return None
+    span = pd.Timedelta(spec.get('window', '7D'))
+    return 2 * span if spec.get('method', 'mad') == 'mad' else span
+
+
+def _clean(ts, kind, context=None):
+    """Filters of a kind, followed by its spike filter if enabled, see
+    model_config["sampling"]["spike_filter"]
+
+    :param ts: pd.Series
+        raw readings
+    :param kind: string
+        one of 'startup', 'occupancy', 'electric' or 'water'
+    :param context: pd.Series
+        raw readings just before ts (see _spike_context), filling the
+        windows of the first readings of ts
+
+    :return: pd.Series
+        filtered readings of ts
+    """
+    filtered = _filters[kind](ts)
+    spec = dict(spike_filters_.get(kind, {}))
+    if not spec.pop('enabled', False) or not len(filtered):
+        return filtered
+    if context is None or not len(context):
+        return spike_filter(filtered, **spec)
+    context = _filters[kind](context)
+    keep = _spike_mask(pd.concat([context, filtered]), **spec)
+    return filtered[keep[len(context):]]
+
+
+def munge_chunks(chunks, kind, nary_thresh=nary_thresh_,
+                 gap_threshold=gap_threshold_, accuracy=accuracy_,
+                 gran=gran_):
+    """Munge a time series delivered as consecutive chunks
+
+    Chunk-aware counterpart of munger, for use with the streaming readers
+    of larkin.ts_proc.utils (for example iter_devices_sum_ts_chunks), so that
+    only one chunk of raw readings is held in memory at a time. Periods that
+    the readings of later chunks can still change (those after the last
+    value reading of a chunk, or after its last reading following a gap
+    shorter than gap_threshold) are held back, and munged again with the
+    next chunk from the readings they depend on, so that the munged pieces
+    are exactly those of the full series. Whether the series is discrete is
+    decided on its first non-empty chunk.
+
+    :param chunks: iterable of pandas.Series
+        consecutive, non-overlapping pieces of a raw time series, in
+        chronological order
+    :param kind: string
+        one of 'startup', 'occupancy', 'electric' or 'water'
+    :param nary_thresh: int
+    :param gap_threshold: int
+    :param accuracy: string
+    :param gran: string
+        see gap_resamp
+
+    :return: generator of pandas.Series
+        munged pieces, which concatenate to the munged series. Raises
+        ValueError once the chunks are exhausted if the series as a whole
+        has too many gaps
+    """
+    longest_allowed_gap = np.timedelta64(
+            datetime.timedelta(hours=gap_threshold))
+    span = _spike_context(kind)
+    context = None
+    discrete = None
+    carry, resume, last_close, unsettled = None, None, None, None
+    last_emitted = None
+    close_count, total_count = 0, 0
+
+    for chunk in chunks:
+        raw = chunk
+        chunk = _clean(raw, kind, context)
+        if span is not None and len(raw):
+            # raw readings the spike filter of the next chunk looks back at
+            if context is not None:
+                raw = pd.concat([context, raw])
+            context = raw[raw.index > raw.index[-1] - span]
+        if carry is not None:
+            chunk = chunk[chunk.index > carry.index[-1]]
+        if not len(chunk):
+            continue
+
+        # gap statistics, counting the step across the chunk boundary
+        times = chunk.index.values
+        if carry is None:
+            close = np.concatenate([[True], np.diff(times) <=
+                                    longest_allowed_gap])
+        else:
+            close = np.diff(np.concatenate([carry.index.values[-1:],
+                                            times])) <= longest_allowed_gap
+        close_count += np.count_nonzero(close)
+        total_count += len(times)
+        if close.any():
+            last_close = chunk.index[close][-1]
+
+        if discrete is None:
+            discrete = is_discrete(chunk, nary_thresh)
+
+        # as munge_incremental does, periods from resume on are munged
+        # again with the readings carried over
+        window = chunk if carry is None else pd.concat([carry, chunk])
+        if discrete:
+            munged = window.resample(rule=gran).first().dropna()
+        else:
+            munged = _interp_resamp(window, last_close, accuracy, gran)
+        resume, carry = _munge_carry(window, munged, accuracy, gran)
+        if last_emitted is not None:
+            munged = munged[munged.index > last_emitted]
+        settled = munged[munged.index < resume]
+        unsettled = munged[munged.index >= resume]
+        if len(settled):
+            last_emitted = settled.index[-1]
+            yield settled
+
+    if unsettled is not None and len(unsettled):
+        yield unsettled
+
+    if total_count and close_count / float(total_count) < 0.5:
+        raise ValueError("Investigate the data: it has too many gaps")
+
+
+def _munge_carry(filtered, munged, accuracy, gran):
+    """Readings needed to munge again from the first unsettled period on
+
+    Periods up to the last one holding a value reading are settled: later
+    readings don't change them. The rest are munged again once new
+    readings arrive, starting from the last value reading before them.
+
+    :return: tuple
+        first unsettled period, and the readings to munge it from
+    """
+    valid = filtered.index[filtered.notnull().values]
+    if not len(valid) or not len(munged):
+        return filtered.index[0].floor(gran), filtered
+    resume = min(munged.index[-1], valid[-1].floor(gran))
+    cut = valid[max(valid.searchsorted(resume, side='right') - 1, 0)]
+    return resume, filtered[filtered.index >= cut.floor(accuracy)]
+
+
+def _period_counts(index, close, gran):
+    # number of readings, and of readings following a gap shorter than
+    # gap_threshold, in each period
+    return pd.DataFrame({'total': 1, 'close': close.astype(int)},
+                        index=index.floor(gran)).groupby(level=0).sum()
+
+
+def _munge_state(ts, kind, nary_thresh, gap_threshold, accuracy, gran):
+    # munge the whole of ts, and keep what is needed to extend it
+    filtered = _clean(ts, kind)
+    discrete = is_discrete(filtered, nary_thresh)
+    munged = gap_resamp(filtered, nary_thresh, gap_threshold, accuracy, gran,
+                        discrete=discrete)
+    close = np.concatenate([[True], np.diff(filtered.index.values) <=
+                            np.timedelta64(datetime.timedelta(
+                                    hours=gap_threshold))])
+    resume, carry = _munge_carry(filtered, munged, accuracy, gran)
+    return {'munged': munged, 'carry': carry, 'resume': resume,
+            'discrete': discrete, 'first_raw': ts.index[0],
+            'last_raw': ts.index[-1],
+            'last_close': filtered.index[close][-1],
+            'close_count': int(np.count_nonzero(close)),
+            'total_count': len(close),
+            'counts': _period_counts(filtered.index, close, gran)}
+
+
+def _trim_state(state, ts, kind, gap_threshold, accuracy, gran):
+    """State of ts, from the state of a series holding the same readings
+    and earlier ones
+
+    Filtering and munging only differ near the first reading of ts: the
+    spike filter windows of its first readings, and the periods up to its
+    first value reading past them, are filtered and munged again. The rest
+    of the munged series and of the gap counts is kept.
+
+    :return: dict, or None if the periods to munge again reach the ones
+        the state munges again when extended (e.g. if ts is short)
+    """
+    span = _spike_context(kind)
+    bound = ts.index[0].ceil(accuracy)
+    context = None
+    if span is not None:
+        bound = (ts.index[0] + span).ceil(accuracy)
+        context = ts.iloc[ts.index.searchsorted(bound - span, side='right'):
+                          ts.index.searchsorted(bound)]
+
+    # readings from bound on are filtered alike with or without the earlier
+    # readings. Periods from the first value reading past it on are munged
+    # alike. Look for that reading through growing stretches of ts
+    begin = ts.index.searchsorted(bound)
+    stop, size, valid = begin, 64, []
+    while not len(valid) and stop < len(ts):
+        stop = min(stop + size, len(ts))
+        size *= 2
+        filtered = _clean(ts.iloc[begin:stop], kind, context)
+        valid = filtered.index[filtered.notnull().values]
+    if not len(valid):
+        return None
+    keep_from = valid[0].floor(gran) + pd.Timedelta(gran)
+    if keep_from > state['resume'] or not len(state['carry']) or \
+            state['carry'].index[0] < bound:
+        return None
+
+    head = _clean(ts.iloc[:ts.index.searchsorted(keep_from)], kind)
+    close = np.concatenate([[True], np.diff(head.index.values) <=
+                            np.timedelta64(datetime.timedelta(
+                                    hours=gap_threshold))])
+    if state['discrete']:
+        munged = head.resample(rule=gran).first().dropna()
+    else:
+        munged = _interp_resamp(head, valid[0], accuracy, gran)
+    counts = state['counts']
+    kept = counts.iloc[counts.index.searchsorted(keep_from):]
+    head_counts = _period_counts(head.index, close, gran)
+
+    state = dict(state)
+    state['munged'] = pd.concat([
+        munged[munged.index < keep_from],
+        state['munged'].iloc[
+            state['munged'].index.searchsorted(keep_from):]])
+    state['counts'] = pd.concat([head_counts, kept])
+    state['close_count'] = int(head_counts['close'].sum() +
+                               kept['close'].sum())
+    state['total_count'] = int(head_counts['total'].sum() +
+                               kept['total'].sum())
+    state['first_raw'] = ts.index[0]
+    return state
+
+
+def munge_incremental(ts, building, series=None, nary_thresh=nary_thresh_,
+                      gap_threshold=gap_threshold_, accuracy=accuracy_,
+                      gran=gran_, use_cache=use_cache_):
+    """Munge a time series, munging only what changed since the last call
+
+    The munged series of each building and kind is persisted, see
+    larkin.ts_proc.munge_cache, together with the last readings it was
+    munged from. On each call, only the readings newer than the last call
+    are filtered, and the munged series is extended from its first period
+    that the new readings can change. Whether the series is discrete is
+    decided when it is first munged. The series is munged from scratch
+    when ts starts earlier than it was munged from. When it starts later,
+    e.g. as the lookback window moves forward, only its first periods are
+    munged again, see _trim_state.
+
+    :param ts: pandas.Series
+        raw time series, named after its kind (see munger), as returned by
+        the readers of larkin.ts_proc.utils
+    :param building: string
+        building identifier
+    :param series: string
+        distinguishes several series of the same building and kind, for
+        example fan names for the startup kind
+    :param nary_thresh: int
+    :param gap_threshold: int
+    :param accuracy: string
+    :param gran: string
+        see gap_resamp
+    :param use_cache: bool
+        whether to persist and reuse munged series. ts is munged from
+        scratch, as munger(ts)(ts) does, if False
+
+    :return: pandas.Series
+        the munged series, as munger(ts)(ts) would return it. Raises
+        ValueError if the series has too many gaps
+    """
+    kind = ts.name
+    if not use_cache:
+        return _munge_state(ts, kind, nary_thresh, gap_threshold, accuracy,
+                            gran)['munged']
+
+    params = [nary_thresh, gap_threshold, accuracy, gran,
+              spike_filters_.get(kind)]
+    state = larkin.ts_proc.munge_cache.load(building, kind, series, params)
+    if state is not None and ts.index[-1] < state['last_raw']:
+        # an earlier cut of the series, e.g. for a past prediction date
+        return _munge_state(ts, kind, nary_thresh, gap_threshold, accuracy,
+                            gran)['munged']
+    trimmed = state is not None and 'counts' in state and \
+        ts.index[0] > state['first_raw']
+    if trimmed:
+        state = _trim_state(state, ts, kind, gap_threshold, accuracy, gran)
+    if state is None or 'counts' not in state or \
+            ts.index[0] != state['first_raw']:
+        state = _munge_state(ts, kind, nary_thresh, gap_threshold, accuracy,
+                             gran)
+        larkin.ts_proc.munge_cache.save(building, kind, series, params,
+                                        state)
+        return state['munged']
+    if ts.index[-1] == state['last_raw'] and not trimmed:
+        return state['munged']
+
+    first_new = ts.index.searchsorted(state['last_raw'], side='right')
+    context, span = None, _spike_context(kind)
+    if span is not None:
+        context = ts.iloc[ts.index.searchsorted(state['last_raw'] - span,
+                                                side='right'):first_new]
+    new = _clean(ts.iloc[first_new:], kind, context)
+    state['last_raw'] = ts.index[-1]
+    if len(new):
+        carry = state['carry']
+        close = np.diff(np.concatenate([carry.index.values[-1:],
+                                        new.index.values])) <= \
+            np.timedelta64(datetime.timedelta(hours=gap_threshold))
+        state['close_count'] += int(np.count_nonzero(close))
+        state['total_count'] += len(close)
+        if close.any():
+            state['last_close'] = new.index[close][-1]
+        counts = state['counts']
+        new_counts = _period_counts(new.index, close, gran)
+        split = counts.index.searchsorted(new_counts.index[0])
+        state['counts'] = pd.concat([
+            counts.iloc[:split],
+            counts.iloc[split:].add(new_counts, fill_value=0).astype(int)])
+
+        window = pd.concat([carry, new])
+        if state['discrete']:
+            tail = window.resample(rule=gran).first().dropna()
+        else:
+            tail = _interp_resamp(window, state['last_close'], accuracy, gran)
+        munged = state['munged']
+        state['munged'] = pd.concat([munged[munged.index < state['resume']],
+                                     tail[tail.index >= state['resume']]])
+        state['resume'], state['carry'] = _munge_carry(
+                window, state['munged'], accuracy, gran)
+
+    larkin.ts_proc.munge_cache.save(building, kind, series, params, state)
+    if state['close_count'] / float(state['total_count']) < 0.5:
+        raise ValueError("Investigate the data: it has too many gaps")
+    return state['munged']
+
+
 def munger(ts):
     if ts.name == 'startup':
         return startup_munge
@@ -0,0 +1,52 @@
+# coding=utf-8
+import os
+
+import pandas as pd
+
+import larkin.ts_proc.cache_files
+from larkin.model_config import model_config
+
+cache_dir_ = os.path.join(model_config["cache"]["directory"], "munged")
+
+
+def _cache_file(building, kind, series, params):
+    """File holding the munge state of a single time series
+
+    :param building: string
+        building identifier
+    :param kind: string
+        one of 'startup', 'occupancy', 'electric' or 'water'
+    :param series: string
+        distinguishes several series of the same building and kind (for
+        example the fans of a startup prediction). May be None
+    :param params: list
+        munging parameters the series was munged with
+
+    :return: string
+    """
+    return larkin.ts_proc.cache_files.key_path(
+            os.path.join(cache_dir_, str(building)),
+            [building, kind, series, params], '.pkl')
+
+
+def load(building, kind, series=None, params=None):
+    """Load the munge state of a time series
+
+    :return: dict, see larkin.ts_proc.munge.munge_incremental, or None if
+        the series hasn't been munged yet
+    """
+    path = _cache_file(building, kind, series, params)
+    if not os.path.isfile(path):
+        return None
+    return pd.read_pickle(path)
+
+
+def save(building, kind, series, params, state):
+    """Persist the munge state of a time series
+
+    :param state: dict
+        munged series and what is needed to extend it
+    """
+    larkin.ts_proc.cache_files.write_file(
+            _cache_file(building, kind, series, params),
+            lambda tmp: pd.to_pickle(state, tmp))
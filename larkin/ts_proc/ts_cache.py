@@ -0,0 +1,199 @@
+# coding=utf-8
+import json
+import os
+
+import numpy as np
+
+import larkin.db.decode
+import larkin.ts_proc.cache_files
+from larkin.model_config import model_config
+
+cache_dir_ = os.path.join(model_config["cache"]["directory"], "ts")
+
+
+def _key_fields(building, device, systems, floor, quad):
+    # systems may be passed either as a single name or as an iterable of names
+    if hasattr(systems, '__iter__'):
+        systems = sorted(systems)
+    return [building, device, systems, floor, quad]
+
+
+def _cache_path(building, device, systems=None, floor=None, quad=None):
+    """Directory holding the cached readings of a single time series
+
+    :param building: string
+        building identifier
+    :param device: string
+        device name
+    :param systems: string or iterable
+        system name(s) used when querying the device
+    :param floor: string
+        floor identifier
+    :param quad: string
+        quadrant identifier
+
+    :return: string
+    """
+    return larkin.ts_proc.cache_files.key_path(
+            os.path.join(cache_dir_, str(building)),
+            _key_fields(building, device, systems, floor, quad))
+
+
+def _save(path, name, arr):
+    larkin.ts_proc.cache_files.write_file(
+            os.path.join(path, name + '.npy'),
+            lambda tmp: np.save(tmp, arr, allow_pickle=arr.dtype.kind == 'O'))
+
+
+def _meta(path):
+    # meta data of a cached series, or None if it has never been queried
+    meta_file = os.path.join(path, 'meta.json')
+    if not os.path.isfile(meta_file):
+        return None
+    with open(meta_file) as fp:
+        return json.load(fp)
+
+
+def load(building, device, systems=None, floor=None, quad=None):
+    """Load the cached readings of a time series
+
+    :return: tuple of numpy arrays
+        timestamps (datetime64[ns]) and corresponding values. Both are empty
+        if nothing has been cached yet
+    """
+    path = _cache_path(building, device, systems, floor, quad)
+    times_file = os.path.join(path, 'times.npy')
+    values_file = os.path.join(path, 'values.npy')
+    if not (os.path.isfile(times_file) and os.path.isfile(values_file)):
+        return (np.array([], dtype='datetime64[ns]'),
+                np.array([], dtype='float64'))
+
+    times = np.load(times_file, mmap_mode='r')
+    try:
+        values = np.load(values_file, mmap_mode='r')
+    except ValueError:
+        # object arrays can't be memory-mapped
+        values = np.load(values_file, allow_pickle=True)
+    return times, values
+
+
+def covers(building, device, systems=None, floor=None, quad=None, start=None):
+    """Whether the cached readings go back at least as far as start
+
+    A cache populated with a bounded pull only holds readings from the start
+    of that pull onwards, and can't serve requests reaching further back.
+
+    :param start: datetime.datetime
+        earliest reading time requested. None requests all available data
+    :return: bool
+    """
+    meta = _meta(_cache_path(building, device, systems, floor, quad))
+    if meta is None:
+        return False
+    cached_start = meta['start']
+    if cached_start is None:
+        return True
+    return start is not None and \
+        np.datetime64(cached_start) <= np.datetime64(start)
+
+
+def queried_mark(building, device, systems=None, floor=None, quad=None):
+    """Reading time up to which the database has been queried for a time
+    series
+
+    Recorded by update even when a query returned no readings for the
+    series, so that series without readings (e.g. devices a building doesn't
+    have) are not pulled from scratch again on every call.
+
+    :return: numpy.datetime64 or None
+        the latest reading of the series if it has any. None if the series
+        has never been queried, or if no query has returned any readings yet
+    """
+    meta = _meta(_cache_path(building, device, systems, floor, quad))
+    if meta is None or meta.get('queried') is None:
+        return None
+    return np.datetime64(meta['queried'])
+
+
+def high_water_mark(times):
+    """Latest timestamp present in the cache, or None if the cache is empty
+
+    :param times: numpy array of datetime64[ns]
+    :return: numpy.datetime64 or None
+    """
+    if len(times) == 0:
+        return None
+    return times.max()
+
+
+def update(building, device, systems, floor, quad, times, values,
+           new_ts_list, new_val_list, start=None, queried=None,
+           populate=None):
+    """Append readings newer than the cache high-water mark and persist
+
+    :param times: numpy array
+        cached timestamps, as returned by load()
+    :param values: numpy array
+        cached values, as returned by load()
+    :param new_ts_list: list or array
+        timestamps pulled from the database
+    :param new_val_list: list or array
+        values pulled from the database
+    :param start: datetime.datetime
+        lower bound of the pull that populated the series. Ignored when
+        appending to it
+    :param queried: numpy.datetime64
+        latest reading time the query returned across all the series it
+        pulled, recorded as the time the series has been queried up to if
+        the series has no readings, see queried_mark
+    :param populate: bool
+        whether the pull (re)populates the series from start, rather than
+        appending to it. Defaults to whether there are no cached readings
+
+    :return: tuple of numpy arrays
+        merged timestamps and values
+    """
+    new_times, new_values = larkin.db.decode.to_arrays(new_ts_list,
+                                                         new_val_list)
+
+    mark = high_water_mark(times)
+    if mark is not None:
+        newer = new_times > mark
+        new_times, new_values = new_times[newer], new_values[newer]
+
+    if populate is None:
+        populate = not len(times)
+    path = _cache_path(building, device, systems, floor, quad)
+    if len(new_times) and len(times):
+        merged_times = np.concatenate([times, new_times])
+        merged_values = larkin.db.decode.concat_values([values, new_values])
+    elif len(new_times):
+        merged_times, merged_values = new_times, new_values
+    else:
+        merged_times, merged_values = times, values
+    if len(new_times):
+        _save(path, 'times', merged_times)
+        _save(path, 'values', merged_values)
+    elif populate:
+        # the series is (re)populated with no readings: drop those of an
+        # earlier, narrower population
+        for name in ('times', 'values'):
+            stale = os.path.join(path, name + '.npy')
+            if os.path.isfile(stale):
+                os.remove(stale)
+
+    meta = None if populate else _meta(path)
+    if meta is None:
+        meta = {'key': _key_fields(building, device, systems, floor, quad),
+                'start': None if start is None else str(start)}
+    # a series with readings has been queried up to its latest one
+    marks = [high_water_mark(merged_times)]
+    if marks[0] is None:
+        marks = [mark for mark in (meta.get('queried'), queried)
+                 if mark is not None]
+    meta['queried'] = str(max(np.datetime64(mark) for mark in marks)) \
+        if marks else None
+    larkin.ts_proc.cache_files.write_bytes(os.path.join(path, 'meta.json'),
+                                           json.dumps(meta).encode('utf-8'))
+
+    return merged_times, merged_values
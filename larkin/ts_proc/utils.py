@@ -6,50 +6,183 @@
 # dview.block = True
 
 # with dview.sync_imports():
-import pymongo
+import datetime
 
 # from statsmodels.tsa.statespace.sarimax import SARIMAX
 # import seaborn as sns
+import numpy as np
 import pandas as pd
 # sns.set()
 import pytz
 
+import larkin.db.connection
+import larkin.db.decode
+import larkin.ts_proc.ts_cache
+from larkin.model_config import model_config
 
-def _construct_device_sum_dframe(ts_lists, value_lists):
+use_cache_ = model_config["cache"]["enabled"]
+use_pipeline_ = model_config["db"]["aggregation_pipeline"]
+lookback_ = model_config["lookback"]
+# fields pulled from each time series document
+device_projection_ = {'_id': 0, 'building': 1, 'device': 1,
+                      'readings.time': 1, 'readings.value': 1}
+# supply fans whose status is used for startup predictions, when a building
+# doesn't configure its own
+default_fans_ = (1, 2, 7, 8)
+
+
+def _naive_utc(date):
+    # readings are stored as naive UTC datetimes in the database
+    date = pd.Timestamp(date)
+    if date.tzinfo is not None:
+        date = date.tz_convert(pytz.utc).tz_localize(None)
+    return date.to_pydatetime()
+
+
+def _default_start(kind, end=None):
+    """Start of the default lookback window for a prediction kind
+
+    :param kind: string
+        prediction kind, as keyed in model_config["lookback"]
+    :param end: datetime.datetime
+        end of the window. Defaults to now
+
+    :return: datetime.datetime, or None if all available data should be used
+    """
+    days = lookback_.get(kind)
+    if days is None:
+        return None
+    if end is None:
+        end = pd.Timestamp.utcnow()
+    return _naive_utc(end) - datetime.timedelta(days=days)
+
+
+def _reading_time_bounds(after=None, start=None, end=None, before=None):
+    """Mongo condition on reading timestamps
+
+    :param after: datetime.datetime
+        exclusive lower bound
+    :param start: datetime.datetime
+        inclusive lower bound
+    :param end: datetime.datetime
+        inclusive upper bound
+    :param before: datetime.datetime
+        exclusive upper bound
+
+    :return: dict, empty if the readings are unbounded
+    """
+    bounds = {}
+    for operator, date in [('$gt', after), ('$gte', start), ('$lte', end),
+                           ('$lt', before)]:
+        if date is not None:
+            bounds[operator] = _naive_utc(date)
+    return bounds
+
+
+def _bounds_mask(times, bounds):
+    """Boolean mask of the timestamps that satisfy bounds
+
+    :param times: numpy array of datetime64[ns]
+    :param bounds: dict
+        condition on reading timestamps, see _reading_time_bounds
+    :return: numpy array of bool
     """
-    Construct a pandas DataFrame using the time series data on individual
+    mask = np.ones(len(times), dtype=bool)
+    if '$gt' in bounds:
+        mask &= times > np.datetime64(bounds['$gt'])
+    if '$gte' in bounds:
+        mask &= times >= np.datetime64(bounds['$gte'])
+    if '$lte' in bounds:
+        mask &= times <= np.datetime64(bounds['$lte'])
+    if '$lt' in bounds:
+        mask &= times < np.datetime64(bounds['$lt'])
+    return mask
+
+
+def _construct_device_sum_ts(ts_lists, value_lists):
+    """
+    Construct a pandas Series using the time series data on individual
     meter can compute the total instantaneous usage
 
-    :param ts_lists: list of lists
+    Readings of all meter groups are concatenated and sorted once. Missing
+    values are dropped, only the first reading of each group at a given
+    timestamp is kept, and groups are summed with numpy.
+
+    :param ts_lists: list of lists or arrays
         list of list of timestamps
-    :param value_lists: list of lists
+    :param value_lists: list of lists or arrays
         list of list of data corresponding to the timestamps list in the same
         ordinal position in ts_lists
 
-    :return: pandas DataFrame
+    :return: pandas Series
+        float64 total, indexed by sorted unique timestamp
     """
 
-    master_df = pd.DataFrame()
-
     # error checks
     if len(ts_lists) != len(value_lists):
         raise ValueError('array lengths must match')
     if not len(ts_lists):
-        return master_df
+        return pd.Series([], index=pd.DatetimeIndex([]), dtype='float64')
+
+    times = np.concatenate([np.asarray(ts_list, dtype='datetime64[ns]')
+                            for ts_list in ts_lists])
+    values = np.concatenate([np.asarray(value_list, dtype='float64')
+                             for value_list in value_lists])
+    if len(times) != len(values):
+        raise ValueError('array lengths must match')
+    groups = np.repeat(np.arange(len(ts_lists)),
+                       [len(ts_list) for ts_list in ts_lists])
+
+    present = ~np.isnan(values)
+    times, values, groups = times[present], values[present], groups[present]
+    if not len(times):
+        return pd.Series([], index=pd.DatetimeIndex([]), dtype='float64')
+
+    # lexsort is stable, so readings keep their original order within each
+    # (timestamp, group) pair
+    order = np.lexsort((groups, times))
+    times, values, groups = times[order], values[order], groups[order]
+
+    # first reading of each group at each timestamp
+    first = np.ones(len(times), dtype=bool)
+    first[1:] = (times[1:] != times[:-1]) | (groups[1:] != groups[:-1])
+    times, values = times[first], values[first]
+
+    # sum groups at each timestamp
+    starts = np.flatnonzero(np.concatenate([[True], times[1:] != times[:-1]]))
+
+    return pd.Series(np.add.reduceat(values, starts),
+                     index=pd.DatetimeIndex(times[starts]))
+
+
+def _electric_devices(meter_count):
+    devices, device_groups = [], {}
+    for meter_num in range(1, meter_count + 1):
+        meters_t = ["Elec-M%d" % meter_num,
+                    "Electric_Meter_%d^Avg_Rate" % meter_num]
+        for meter_t in meters_t:
+            device_groups[meter_t] = meter_num - 1
+        devices.extend(meters_t)
+    return devices, device_groups
+
+
+def _water_devices(meter_count):
+    devices, device_groups = ['LevelAToday', 'LevelCToday'], {}
+    for meter_num in range(1, meter_count + 1):
+        device_groups[devices[meter_num - 1]] = meter_num - 1
+    return devices, device_groups
 
-    # insert column data
-    for i, ts_list in enumerate(ts_lists):
-        master_df = master_df.join(pd.DataFrame(data=value_lists[i],
-                                                index=ts_list,
-                                                columns=[str(i + 1)]).dropna(),
-                                   how='outer')
 
-    return master_df.sum(axis=1).reset_index().drop_duplicates(
-            subset='index').set_index('index').sort_index()
+def _set_name(ts, name):
+    # ts is either a single series, or a building-indexed dictionary of them
+    for series in (ts.values() if isinstance(ts, dict) else [ts]):
+        series.name = name
+    return ts
 
 
 def get_electric_ts(host, port, database, username, password, source,
-                    collection_name, building, meter_count):
+                    collection_name, building, meter_count,
+                    use_cache=use_cache_, start=None, end=None):
     """ retrieves all available electric data from all meters and sums up
     to get total electric usage time series
 
@@ -67,31 +200,37 @@ def get_electric_ts(host, port, database, username, password, source,
         source database for authentication
     :param collection_name: string
         database collection name to query
-    :param building: string
-        database building_id identifier
+    :param building: string or iterable
+        database building_id identifier(s). Several buildings are fetched
+        with a single query
     :param meter_count: int
         number of distinct meters that need to be summed up
+    :param use_cache: bool
+        only pull readings newer than those in the local time series cache
+    :param start: datetime.datetime
+        earliest reading time to return. Defaults to the 'electric' lookback
+        in model_config
+    :param end: datetime.datetime
+        latest reading time to return. Defaults to all available data
 
-    :return: pandas Series
+    :return: pandas Series, or building-indexed dictionary of Series if
+    several buildings were passed
     """
-    devices, device_groups = [], {}
-    for meter_num in range(1, meter_count + 1):
-        meters_t = ["Elec-M%d" % meter_num,
-                    "Electric_Meter_%d^Avg_Rate" % meter_num]
-        for meter_t in meters_t:
-            device_groups[meter_t] = meter_num - 1
-        devices.extend(meters_t)
+    if start is None:
+        start = _default_start('electric', end)
+    devices, device_groups = _electric_devices(meter_count)
 
     ts = get_devices_sum_ts(host, port, database, username, password,
                             source, collection_name, building, devices,
                             'Electric_Utility',
-                            device_groups)
-    ts.name = 'electric'
-    return ts
+                            device_groups, use_cache=use_cache,
+                            start=start, end=end)
+    return _set_name(ts, 'electric')
 
 
 def get_water_ts(host, port, database, username, password, source,
-                 collection_name, building, meter_count):
+                 collection_name, building, meter_count, use_cache=use_cache_,
+                 start=None, end=None):
     """ retrieves all available water data from all meters and sums up
     to get total water usage time series
 
@@ -109,58 +248,141 @@ def get_water_ts(host, port, database, username, password, source,
         source database for authentication
     :param collection_name: string
         database collection name to query
-    :param building: string
-        database building_id identifier
+    :param building: string or iterable
+        database building_id identifier(s). Several buildings are fetched
+        with a single query
     :param meter_count: int
         number of distinct meters that need to be summed up
+    :param use_cache: bool
+        only pull readings newer than those in the local time series cache
+    :param start: datetime.datetime
+        earliest reading time to return. Defaults to the 'water' lookback
+        in model_config
+    :param end: datetime.datetime
+        latest reading time to return. Defaults to all available data
 
-    :return: pandas Series
+    :return: pandas Series, or building-indexed dictionary of Series if
+    several buildings were passed
     """
-    devices, device_groups = ['LevelAToday', 'LevelCToday'], {}
-    for meter_num in range(1, meter_count + 1):
-        device_groups[devices[meter_num - 1]] = meter_num - 1
+    if start is None:
+        start = _default_start('water', end)
+    devices, device_groups = _water_devices(meter_count)
 
     ts = get_devices_sum_ts(host, port, database, username, password,
                             source, collection_name, building, devices,
-                            'Water_Demand', device_groups)
-    ts.name = 'water'
-    return ts
+                            'Water_Demand', device_groups,
+                            use_cache=use_cache, start=start, end=end)
+    return _set_name(ts, 'water')
 
 
 def get_occupancy_ts(host, port, db_name, username, password, source,
                      collection_name,
-                     building):
+                     building, use_cache=use_cache_, start=None, end=None):
+    if start is None:
+        start = _default_start('occupancy', end)
     ts = get_parsed_ts_new_schema(host, port, db_name, username, password,
                                   source,
                                   collection_name,
                                   building, devices="Occupancy",
-                                  systems="Occupancy")
-    ts.name = "occupancy"
-    return ts
+                                  systems="Occupancy", use_cache=use_cache,
+                                  start=start, end=end)
+    return _set_name(ts, "occupancy")
+
+
+def _fan_devices(fans):
+    devices = ["S" + str(num) + "-SupplyFanStatus" for num in fans]
+    systems = ["S" + str(num) for num in fans]
+    return devices, systems
 
 
 def get_startup_ts(host, port, db_name, username, password, source,
                    collection_name,
-                   building):
-    dev_labels = (1, 2, 7, 8)
-    sys_labels = dev_labels
-    devices = ["S" + str(num) + "-SupplyFanStatus" for num in dev_labels]
-    systems = ["S" + str(num) for num in sys_labels]
+                   building, fans=None, use_cache=use_cache_, start=None,
+                   end=None):
+    """Supply fan status time series, fetched with a single query
+
+    :param building: string or iterable
+        database building_id identifier(s)
+    :param fans: iterable or dict
+        supply fan numbers, for example (1, 2, 7, 8) for fans S1, S2, S7 and
+        S8, or a building-indexed dictionary of them. Buildings without a fan
+        list use default_fans_
+    :param use_cache: bool
+        only pull readings newer than those in the local time series cache
+    :param start: datetime.datetime
+        earliest reading time to return. Defaults to the 'startup' lookback
+        in model_config
+    :param end: datetime.datetime
+        latest reading time to return. Defaults to all available data
+
+    :return: device-indexed dictionary of 'startup' Series, or a
+    building-indexed dictionary of them if several buildings were passed
+    """
+    if start is None:
+        start = _default_start('startup', end)
+    buildings = building if hasattr(building, '__iter__') else [building]
+    if not isinstance(fans, dict):
+        fans = {bldg: fans for bldg in buildings}
+    building_devices = {bldg: _fan_devices(fans.get(bldg) or default_fans_)
+                        for bldg in buildings}
+
+    # one query for the fans of every building
+    devices, systems = set(), set()
+    for bldg_devices, bldg_systems in building_devices.values():
+        devices.update(bldg_devices)
+        systems.update(bldg_systems)
+    fetch = get_buildings_device_ts_cached if use_cache \
+        else get_buildings_device_ts
+    building_data = fetch(host, port, db_name, username, password, source,
+                          collection_name, buildings, sorted(devices),
+                          sorted(systems), start=start, end=end)
+
     all_series = {}
-    for device, system in zip(devices, systems):
-        ts = get_parsed_ts_new_schema(
-                host, port, db_name, username, password,
-                source,
-                collection_name,
-                building, device, system)
-        ts.name = 'startup'
-        all_series.update({device: ts})
-    return all_series
+    for bldg in buildings:
+        all_series[bldg] = {}
+        for device in building_devices[bldg][0]:
+            ts = _parse_device_data(building_data[bldg], [device])
+            ts.name = 'startup'
+            all_series[bldg][device] = ts
+    if hasattr(building, '__iter__'):
+        return all_series
+    return all_series[building]
+
+
+def _sum_device_data(device_data, device_groups):
+    """Total usage time series from the device data of one building
+
+    :param device_data: dict
+        as returned by get_device_ts_new_schema
+    :param device_groups: dict
+        mapping to enable devices to be grouped together
+
+    :return: pandas Series
+    """
+    ts_lists, value_lists = [], []
+    for j in range(0, len(device_groups)):
+        ts_lists.append([])
+        value_lists.append([])
+
+    for device, data in device_data.iteritems():
+        group = device_groups[device]
+        ts_lists[group].append(np.asarray(data[0], dtype='datetime64[ns]'))
+        value_lists[group].append(np.asarray(data[1], dtype='float64'))
+
+    ts_lists = [np.concatenate(pieces) if len(pieces)
+                else np.array([], dtype='datetime64[ns]')
+                for pieces in ts_lists]
+    value_lists = [np.concatenate(pieces) if len(pieces)
+                   else np.array([], dtype='float64')
+                   for pieces in value_lists]
+
+    return _construct_device_sum_ts(ts_lists, value_lists).tz_localize(
+            pytz.utc)
 
 
 def get_devices_sum_ts(host, port, database, username, password, source,
                        collection_name, building, devices, systems,
-                       device_groups):
+                       device_groups, use_cache=False, start=None, end=None):
     """ retrieves all available electric data from all meters and sums up
     to get total electric usage time series
 
@@ -178,40 +400,66 @@ def get_devices_sum_ts(host, port, database, username, password, source,
         source database for authentication
     :param collection_name: string
         database collection name to query
-    :param building: string
-        database building_id identifier
+    :param building: string or iterable
+        database building_id identifier(s)
     :param devices: string or iterable
         device name(s) for identifying time series
     :param systems: string or iterable
         system name(s) for identifying time series
     :param device_groups: dict
         mapping to enable devices to be grouped together
+    :param use_cache: bool
+        only pull readings newer than those in the local time series cache
+    :param start: datetime.datetime
+        earliest reading time to return
+    :param end: datetime.datetime
+        latest reading time to return
 
-    :return: pandas Dataframe
+    :return: pandas Series, or building-indexed dictionary of Series if
+    several buildings were passed
     """
+    buildings = building if hasattr(building, '__iter__') else [building]
+    fetch = get_buildings_device_ts_cached if use_cache \
+        else get_buildings_device_ts
+    building_data = fetch(host, port, database, username, password, source,
+                          collection_name, buildings, devices, systems,
+                          start=start, end=end)
 
-    ts_lists, value_lists = [], []
-    for j in range(0, len(device_groups)):
-        ts_lists.append([])
-        value_lists.append([])
+    building_ts = {bldg: _sum_device_data(building_data[bldg], device_groups)
+                   for bldg in buildings}
+    if hasattr(building, '__iter__'):
+        return building_ts
+    return building_ts[building]
 
-    device_data = get_device_ts_new_schema(host, port, database, username,
-                                           password, source,
-                                           collection_name,
-                                           building, devices, systems)
 
-    for device, data in device_data.iteritems():
-        group = device_groups[device]
-        ts_lists[group].extend(data[0])
-        value_lists[group].extend(data[1])
+def _parse_device_data(device_data, devices):
+    """Single time series from the device data of one building
+
+    :param device_data: dict
+        as returned by get_device_ts_new_schema
+    :param devices: iterable
+        device names to concatenate
 
-    return _construct_device_sum_dframe(ts_lists, value_lists).tz_localize(
-            pytz.utc)[0]
+    :return: pandas Series
+    """
+    times = np.concatenate([np.asarray(device_data[device][0],
+                                       dtype='datetime64[ns]')
+                            for device in devices])
+    values = larkin.db.decode.concat_values(
+            [np.asarray(device_data[device][1]) for device in devices])
+
+    obs_df = pd.DataFrame({'obs': values}, index=times).dropna()
+
+    # drop missing values, set timestamp as the new index and sort by index
+    # some duplicates seen in SIF steam data
+    return obs_df.reset_index().drop_duplicates(subset='index').set_index(
+            'index').sort_index().tz_localize(pytz.utc)['obs']
 
 
 def get_parsed_ts_new_schema(host, port, db_name, username, password,
                              source, collection_name, building, devices,
-                             systems=None, floor=None, quad=None):
+                             systems=None, floor=None, quad=None,
+                             use_cache=False, start=None, end=None):
     """Fetch all available timeseries data from database
 
     :param host: string
@@ -228,8 +476,8 @@ def get_parsed_ts_new_schema(host, port, db_name, username, password,
         source database for authentication
     :param collection_name: string
         collection name to use
-    :param building: string
-        building identifier
+    :param building: string or iterable
+        building identifier(s)
     :param devices: string or iterable
         device name(s) for identifying time series
     :param systems: string or iterable
@@ -238,33 +486,84 @@ def get_parsed_ts_new_schema(host, port, db_name, username, password,
         floor identifier
     :param quad: string
         quadrant identifier
+    :param use_cache: bool
+        only pull readings newer than those in the local time series cache
+    :param start: datetime.datetime
+        earliest reading time to return
+    :param end: datetime.datetime
+        latest reading time to return
 
     :return: pandas DataFrame
-        occupancy time series data
+        occupancy time series data, or a building-indexed dictionary of them
+        if several buildings were passed
     """
 
-    device_data = get_device_ts_new_schema(host, port, db_name, username,
-                                           password, source, collection_name,
-                                           building, devices, systems,
-                                           floor=floor, quad=quad)
+    buildings = building if hasattr(building, '__iter__') else [building]
+    fetch = get_buildings_device_ts_cached if use_cache \
+        else get_buildings_device_ts
+    building_data = fetch(host, port, db_name, username, password, source,
+                          collection_name, buildings, devices, systems,
+                          floor=floor, quad=quad, start=start, end=end)
     if not hasattr(devices, '__iter__'):
         devices = [devices]
-    ts_list, val_list = [], []
-    for device in devices:
-        ts_list.extend(device_data[device][0])
-        val_list.extend(device_data[device][1])
 
-    obs_df = pd.DataFrame({'obs': val_list}, index=ts_list).dropna()
+    building_ts = {bldg: _parse_device_data(building_data[bldg], devices)
+                   for bldg in buildings}
+    if hasattr(building, '__iter__'):
+        return building_ts
+    return building_ts[building]
 
-    # drop missing values, set timestamp as the new index and sort by index
-    # some duplicates seen in SIF steam data
-    return obs_df.reset_index().drop_duplicates(subset='index').set_index(
-            'index').sort_index().tz_localize(pytz.utc)['obs']
+
+def _device_query(buildings, devices, systems=None, floor=None, quad=None,
+                  bounds=None):
+    """Mongo filter matching the time series documents of a device spec
+
+    :param buildings: list
+        building identifiers
+    :param devices: string or iterable
+        device name(s) for identifying time series
+    :param systems: string or iterable
+        system name(s) for identifying time series
+    :param floor: string
+        floor identifier
+    :param quad: string
+        quadrant identifier
+    :param bounds: dict
+        condition on reading timestamps, see _reading_time_bounds
+
+    :return: dict
+    """
+    query = {}
+    # there may be one or more buildings and devices to match
+    for field, value in [('building', list(buildings)), ('device', devices)]:
+        if hasattr(value, '__iter__'):
+            query[field] = value[0] if len(value) == 1 else {'$in': value}
+        else:
+            query[field] = value
+
+    # handle optional arguments
+    # systems is optional, for example for steam data
+    for field, value in {'system': systems, 'floor': floor,
+                         'quadrant': quad}.iteritems():
+        if value:
+            # there may be one or more systems names to match
+            if hasattr(value, '__iter__'):
+                query[field] = {'$in': value}
+            else:
+                query[field] = value
+
+    # push the time bounds into the query, so that only documents holding
+    # at least one reading within them are pulled
+    if bounds:
+        query['readings'] = {'$elemMatch': {'time': bounds}}
+
+    return query
 
 
 def get_device_ts_new_schema(host, port, database, username, password, source,
                              collection_name, building, devices, systems=None,
-                             floor=None, quad=None):
+                             floor=None, quad=None, after=None,
+                             start=None, end=None, pipeline=use_pipeline_):
     """
     Get all observation data with the given building, devices and systems
     combination from the database
@@ -293,50 +592,438 @@ def get_device_ts_new_schema(host, port, database, username, password, source,
         floor identifier
     :param quad: string
         quadrant identifier
+    :param after: datetime.datetime
+        if given, only readings strictly later than this UTC time are returned
+    :param start: datetime.datetime
+        earliest reading time to return
+    :param end: datetime.datetime
+        latest reading time to return
+    :param pipeline: bool
+        extract readings with a server side aggregation pipeline, see
+        _aggregate_device_readings
+
+    :return: device-indexed dictionary with an array of timestamps
+    followed by an array of values
+    """
+    return get_buildings_device_ts(host, port, database, username, password,
+                                   source, collection_name, [building],
+                                   devices, systems, floor=floor, quad=quad,
+                                   after=after, start=start, end=end,
+                                   pipeline=pipeline)[building]
+
+
+def get_buildings_device_ts(host, port, database, username, password, source,
+                            collection_name, buildings, devices, systems=None,
+                            floor=None, quad=None, after=None, start=None,
+                            end=None, before=None, pipeline=use_pipeline_):
+    """
+    Batched get_device_ts_new_schema: get the observation data of the same
+    devices and systems combination for several buildings with one query,
+    and split the results by building.
+
+    :param buildings: iterable
+        building identifiers
+    :param devices: string or iterable
+        device name(s) for identifying time series
+    :param systems: string or iterable
+        system name(s) for identifying time series
+    :param floor: string
+        floor identifier
+    :param quad: string
+        quadrant identifier
+    :param after: datetime.datetime
+        if given, only readings strictly later than this UTC time are returned
+    :param start: datetime.datetime
+        earliest reading time to return
+    :param end: datetime.datetime
+        latest reading time to return
+    :param before: datetime.datetime
+        if given, only readings strictly earlier than this UTC time are
+        returned
+    :param pipeline: bool
+        extract readings with a server side aggregation pipeline
+
+    :return: building-indexed dictionary of device data, as returned by
+    get_device_ts_new_schema
+    """
+    collection = larkin.db.connection.get_collection(
+            host, port, username, password, source, database,
+            collection_name)
+
+    device_list = devices if hasattr(devices, '__iter__') else [devices]
+    empty = [np.array([], dtype='datetime64[ns]'), np.array([])]
+    building_data = {building: {device: list(empty) for device in device_list}
+                     for building in buildings}
+
+    bounds = _reading_time_bounds(after, start, end, before)
+    query = _device_query(buildings, devices, systems, floor, quad, bounds)
+
+    if pipeline:
+        for building, device_data in _aggregate_device_readings(
+                collection, query, bounds).iteritems():
+            building_data[building].update(device_data)
+        return building_data
+
+    # decode each document's readings straight into columns, and concatenate
+    # them once per device at the end
+    pieces = {}
+    for doc in collection.find(query, device_projection_):
+
+        times, values = larkin.db.decode.readings_to_arrays(doc['readings'])
+        if bounds:
+            in_bounds = _bounds_mask(times, bounds)
+            times, values = times[in_bounds], values[in_bounds]
+
+        if len(times):
+            key = doc['building'], str(doc['device'])
+            pieces.setdefault(key, []).append((times, values))
+
+    for (building, device), arrays in pieces.iteritems():
+        building_data[building][device] = [
+            np.concatenate([piece[0] for piece in arrays]),
+            larkin.db.decode.concat_values([piece[1] for piece in arrays])]
+
+    return building_data
+
+
+def _aggregate_device_readings(collection, query, bounds=None):
+    """
+    Extract device readings matching query with an aggregation pipeline.
+
+    Readings are unwound and filtered for a timestamp and a value on the
+    server, so that only time and value fields are sent over the wire.
+    Readings are pushed back into one document per building, device and
+    calendar month, which keeps each result document well below the 16MB
+    BSON limit, and are decoded straight into numpy arrays and sorted on the
+    client.
+
+    :param collection: pymongo Collection
+        building time series collection
+    :param query: dict
+        document filter, as built by _device_query
+    :param bounds: dict
+        condition on reading timestamps, see _reading_time_bounds
+
+    :return: building-indexed dictionary of device-indexed dictionaries with
+    an array of timestamps followed by an array of values
+    """
+    time_filter = {'$ne': None}
+    if bounds:
+        time_filter.update(bounds)
+    reading_filter = {'readings.time': time_filter,
+                      'readings.value': {'$ne': None}}
+
+    pipeline = [
+        {'$match': query},
+        {'$project': {'_id': 0, 'building': 1, 'device': 1,
+                      'readings.time': 1, 'readings.value': 1}},
+        {'$unwind': '$readings'},
+        {'$match': reading_filter},
+        {'$group': {'_id': {'building': '$building',
+                            'device': '$device',
+                            'year': {'$year': '$readings.time'},
+                            'month': {'$month': '$readings.time'}},
+                    'times': {'$push': '$readings.time'},
+                    'values': {'$push': '$readings.value'}}},
+        {'$sort': {'_id.building': 1, '_id.device': 1, '_id.year': 1,
+                   '_id.month': 1}}
+    ]
+
+    chunks = {}
+    for doc in collection.aggregate(pipeline, allowDiskUse=True):
+        key = doc['_id']['building'], str(doc['_id']['device'])
+        chunks.setdefault(key, []).append(
+                larkin.db.decode.to_arrays(doc['times'], doc['values']))
+
+    building_data = {}
+    for (building, device), arrays in chunks.iteritems():
+        times = np.concatenate([chunk[0] for chunk in arrays])
+        values = np.concatenate([chunk[1] for chunk in arrays])
+        # $group does not guarantee the order of pushed readings
+        order = np.argsort(times, kind='mergesort')
+        building_data.setdefault(building, {})[device] = [times[order],
+                                                          values[order]]
+
+    return building_data
+
+
+def get_device_ts_cached(host, port, database, username, password, source,
+                         collection_name, building, devices, systems=None,
+                         floor=None, quad=None, start=None, end=None,
+                         pipeline=use_pipeline_):
+    """
+    Same as get_device_ts_new_schema, but backed by the local time series
+    cache. Only readings later than the cache high-water mark are pulled
+    from the database; these are appended to the cache and the merged
+    history is returned.
+
+    An empty cache is populated from start onwards. If a later call asks for
+    readings earlier than those cached, the cache is rebuilt.
+
+    Readings stored in the database with a timestamp earlier than the
+    high-water mark after it was recorded are not picked up. The mark of a
+    series without readings is the latest reading pulled along with it.
+    Delete the cache directory to force a full pull.
+
+    :param host: string
+        database server name or IP-address
+    :param port: int
+        database port number
+    :param database: string
+        name of the database on server
+    :param username: string
+        database username
+    :param password: string
+        database password
+    :param source: string
+        source database for authentication
+    :param collection_name: string
+        database collection name
+    :param building: string
+        building identifier
+    :param devices: string or iterable
+        device name(s) for identifying time series
+    :param systems: string or iterable
+        system name(s) for identifying time series
+    :param floor: string
+        floor identifier
+    :param quad: string
+        quadrant identifier
+    :param start: datetime.datetime
+        earliest reading time to return
+    :param end: datetime.datetime
+        latest reading time to return
+    :param pipeline: bool
+        extract readings with a server side aggregation pipeline
+
+    :return: device-indexed dictionary with an array of timestamps
+    followed by an array of values
+    """
+    return get_buildings_device_ts_cached(
+            host, port, database, username, password, source,
+            collection_name, [building], devices, systems, floor=floor,
+            quad=quad, start=start, end=end, pipeline=pipeline)[building]
+
+
+def get_buildings_device_ts_cached(host, port, database, username, password,
+                                   source, collection_name, buildings,
+                                   devices, systems=None, floor=None,
+                                   quad=None, start=None, end=None,
+                                   pipeline=use_pipeline_):
+    """
+    Batched get_device_ts_cached: new readings of all buildings are pulled
+    with a single query
+
+    :param buildings: iterable
+        building identifiers
 
-    :return: device-indexed dictionary with  a list of lists of timestamps
-    followed by a list of values
+    :return: building-indexed dictionary of device data, as returned by
+    get_device_ts_cached
     """
+    cache = larkin.ts_proc.ts_cache
+    device_list = devices if hasattr(devices, '__iter__') else [devices]
+    series_keys = [(building, device) for building in buildings
+                   for device in device_list]
+    if start is not None:
+        start = _naive_utc(start)
+
+    empty = (np.array([], dtype='datetime64[ns]'), np.array([]))
+    cached, marks = {}, {}
+    for building, device in series_keys:
+        mark = cache.queried_mark(building, device, systems, floor, quad)
+        if mark is not None and cache.covers(building, device, systems, floor,
+                                             quad, start):
+            cached[building, device] = cache.load(building, device, systems,
+                                                  floor, quad)
+            marks[building, device] = mark
+        else:
+            cached[building, device] = empty
+
+    # series queried before are pulled from the earliest time they have been
+    # queried up to, with a single query. Only the others are pulled from
+    # start. The upper bound is only applied to the returned readings, so
+    # that the cache stays contiguous
+    new_data = {building: {} for building in buildings}
+    for keys, bounds in [
+            ([key for key in series_keys if key in marks],
+             {'after': pd.Timestamp(min(marks.values())).to_pydatetime()
+              if marks else None}),
+            ([key for key in series_keys if key not in marks],
+             {'start': start})]:
+        if not keys:
+            continue
+        # the query covers every building and device of keys, but only the
+        # series of keys are taken from it
+        pulled = get_buildings_device_ts(
+                host, port, database, username, password, source,
+                collection_name, sorted(set(key[0] for key in keys)),
+                sorted(set(key[1] for key in keys)), systems, floor=floor,
+                quad=quad, pipeline=pipeline, **bounds)
+        for building, device in keys:
+            new_data[building][device] = pulled[building][device]
+
+    # what the queries returned up to, recorded even for the series they
+    # returned no readings of
+    latest = [new_data[building][device][0].max()
+              for building, device in series_keys
+              if len(new_data[building][device][0])]
+    queried = max(latest) if latest else None
+
+    building_data = {building: {} for building in buildings}
+    for building, device in series_keys:
+        times, values = cached[building, device]
+        new_ts_list, new_val_list = new_data[building][device]
+        times, values = cache.update(building, device, systems, floor, quad,
+                                     times, values, new_ts_list, new_val_list,
+                                     start=start, queried=queried,
+                                     populate=(building, device) not in marks)
+        if start is not None or end is not None:
+            keep = np.ones(len(times), dtype=bool)
+            if start is not None:
+                keep &= times >= np.datetime64(start)
+            if end is not None:
+                keep &= times <= np.datetime64(_naive_utc(end))
+            times, values = times[keep], values[keep]
+        building_data[building][device] = [times, values]
+
+    return building_data
+
+
+def _reading_time_range(collection, query):
+    """Earliest and latest reading time of the documents matching query
 
-    with pymongo.MongoClient(host, port) as conn:
+    :return: tuple of datetime.datetime, (None, None) if there are no readings
+    """
+    pipeline = [
+        {'$match': query},
+        {'$project': {'_id': 0, 'readings.time': 1}},
+        {'$unwind': '$readings'},
+        {'$group': {'_id': None,
+                    'first': {'$min': '$readings.time'},
+                    'last': {'$max': '$readings.time'}}}
+    ]
+    for doc in collection.aggregate(pipeline, allowDiskUse=True):
+        return doc['first'], doc['last']
+    return None, None
+
+
+def iter_device_data_chunks(host, port, database, username, password, source,
+                            collection_name, building, devices, systems=None,
+                            floor=None, quad=None, start=None, end=None,
+                            freq='MS', pipeline=use_pipeline_):
+    """
+    Generator over the device data of a building, one time window at a time
+
+    Only one window of readings is held in memory at once, so that peak
+    memory doesn't grow with the length of the history. Windows are
+    half-open, so every reading is yielded exactly once.
+
+    :param host: string
+        database server name or IP-address
+    :param port: int
+        database port number
+    :param database: string
+        name of the database on server
+    :param username: string
+        database username
+    :param password: string
+        database password
+    :param source: string
+        source database for authentication
+    :param collection_name: string
+        database collection name
+    :param building: string
+        building identifier
+    :param devices: string or iterable
+        device name(s) for identifying time series
+    :param systems: string or iterable
+        system name(s) for identifying time series
+    :param floor: string
+        floor identifier
+    :param quad: string
+        quadrant identifier
+    :param start: datetime.datetime
+        earliest reading time. Defaults to the earliest stored reading
+    :param end: datetime.datetime
+        latest reading time. Defaults to the latest stored reading
+    :param freq: frequency alias
+        window boundaries, for example 'MS' for one window per calendar month
+    :param pipeline: bool
+        extract readings with a server side aggregation pipeline
 
-        conn[database].authenticate(username, password, source=source)
-        collection = conn[database][collection_name]
+    :return: generator of device-indexed dictionaries, as returned by
+    get_device_ts_new_schema, in time order
+    """
+    if start is None or end is None:
+        collection = larkin.db.connection.get_collection(
+                host, port, username, password, source, database,
+                collection_name)
+        first, last = _reading_time_range(
+                collection, _device_query([building], devices, systems,
+                                          floor, quad))
+        if first is None:
+            return
+        start = first if start is None else start
+        end = last if end is None else end
 
-        device_data = {}
+    start, end = pd.Timestamp(_naive_utc(start)), pd.Timestamp(_naive_utc(end))
+    edges = [start] + [edge for edge in pd.date_range(start, end, freq=freq)
+                       if start < edge <= end]
 
-        query = {"building": building}
-        # there may be one or more devices to match
-        if hasattr(devices, '__iter__'):
-            query['device'] = {'$in': devices}
-            for device in devices:
-                device_data[device] = [[], []]
+    for i, window_start in enumerate(edges):
+        # the last window is closed, so that the latest reading is included
+        if i + 1 < len(edges):
+            window_end, window_before = None, edges[i + 1]
         else:
-            query['device'] = devices
-            device_data[devices] = [[], []]
-
-        # handle optional arguments
-        # systems is optional, for example for steam data
-        for field, value in {'system': systems, 'floor': floor,
-                             'quadrant': quad}.iteritems():
-            if value:
-                # there may be one or more systems names to match
-                if hasattr(value, '__iter__'):
-                    query[field] = {'$in': value}
-                else:
-                    query[field] = value
-
-        for doc in collection.find(query):
-
-            device = doc['device']
-            readings = doc['readings']
-            zipped = [(x['time'], x['value']) for x in readings
-                      if x['time'] is not None and 'value' in x]
-
-            if len(zipped):
-                ts_list_t, val_list_t = zip(*zipped)
-                device_str = str(device)
-                device_data[device_str][0].extend(ts_list_t)
-                device_data[device_str][1].extend(val_list_t)
-
-    return device_data
+            window_end, window_before = end, None
+        yield get_buildings_device_ts(
+                host, port, database, username, password, source,
+                collection_name, [building], devices, systems, floor=floor,
+                quad=quad, start=window_start, end=window_end,
+                before=window_before, pipeline=pipeline)[building]
+
+
+def iter_parsed_ts_chunks(host, port, db_name, username, password, source,
+                          collection_name, building, devices, systems=None,
+                          floor=None, quad=None, start=None, end=None,
+                          freq='MS'):
+    """
+    Chunked get_parsed_ts_new_schema: yields the time series of a building
+    one time window at a time. Empty windows are skipped.
+
+    See iter_device_data_chunks for the parameters.
+
+    :return: generator of pandas Series, in time order
+    """
+    device_list = devices if hasattr(devices, '__iter__') else [devices]
+    for device_data in iter_device_data_chunks(
+            host, port, db_name, username, password, source,
+            collection_name, building, devices, systems, floor=floor,
+            quad=quad, start=start, end=end, freq=freq):
+        ts = _parse_device_data(device_data, device_list)
+        if len(ts):
+            yield ts
+
+
+def iter_devices_sum_ts_chunks(host, port, database, username, password,
+                               source, collection_name, building, devices,
+                               systems, device_groups, start=None, end=None,
+                               freq='MS'):
+    """
+    Chunked get_devices_sum_ts: yields the summed time series of a building
+    one time window at a time. Empty windows are skipped.
+
+    See iter_device_data_chunks for the parameters.
+
+    :param device_groups: dict
+        mapping to enable devices to be grouped together
+
+    :return: generator of pandas Series, in time order
+    """
+    for device_data in iter_device_data_chunks(
+            host, port, database, username, password, source,
+            collection_name, building, devices, systems, start=start,
+            end=end, freq=freq):
+        ts = _sum_device_data(device_data, device_groups)
+        if len(ts):
+            yield ts
@@ -0,0 +1,49 @@
+# coding=utf-8
+import os
+
+import pandas as pd
+
+import larkin.ts_proc.cache_files
+from larkin.model_config import model_config
+
+cache_dir_ = os.path.join(model_config["cache"]["directory"], "weather")
+
+
+def _cache_file(host, port, db_name, collection_name):
+    """File holding the decoded weather history of a collection
+
+    :param host: string
+        database server name or IP-address
+    :param port: int
+        database port number
+    :param db_name: string
+        name of the database on server
+    :param collection_name: string
+        weather history collection
+
+    :return: string
+    """
+    return larkin.ts_proc.cache_files.key_path(
+            cache_dir_, [host, port, db_name, collection_name], '.pkl')
+
+
+def load(host, port, db_name, collection_name):
+    """Load the cached weather history of a collection
+
+    :return: pandas DataFrame, or None if nothing has been cached yet
+    """
+    path = _cache_file(host, port, db_name, collection_name)
+    if not os.path.isfile(path):
+        return None
+    return pd.read_pickle(path)
+
+
+def save(host, port, db_name, collection_name, whist):
+    """Persist the decoded weather history of a collection
+
+    :param whist: pandas DataFrame
+        as returned by larkin.weather.mongo.get_history
+    """
+    larkin.ts_proc.cache_files.write_file(
+            _cache_file(host, port, db_name, collection_name),
+            whist.to_pickle)
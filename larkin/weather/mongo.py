@@ -1,20 +1,66 @@
 # coding=utf-8
+import collections
+import hashlib
+import logging
+
+import bson
+import numpy as np
 import pandas as pd
 import pymongo
 import pytz
-from bson.objectid import ObjectId
 from dateutil.relativedelta import relativedelta
-from joblib import Parallel, delayed
 
+import larkin.db.connection
+import larkin.db.decode
+import larkin.weather.history_cache
 import larkin.weather.wund
+import larkin.weather.wund_cache
+from larkin.model_config import model_config
 from larkin.user_config import user_config
 
+logger = logging.getLogger("root")
 refresh_rate = user_config["building_dbs"]["wund_cred"]["refresh_rate"]
-def _forecast_push(df, host, port, source, username, password,
-                   db_name, collection_name):
+# least recently used forecasts of get_forecast, keyed by location, bucket
+# and granularity
+forecast_cache_size_ = 16
+_forecast_cache = collections.OrderedDict()
+_no_forecast_msg_ = ("An appropriate forecast for the passed date does not"
+                     " exist in the database. Please pass another date, and"
+                     " check to make sure the database is functioning"
+                     " correctly.")
+# bounds on a single bulk_write of daily history documents
+max_batch_ops_ = 500
+max_batch_bytes_ = 8 * 1024 * 1024
+history_projection_ = {'_id': 0, 'readings': 1}
+use_cache_ = model_config["cache"]["enabled"]
+# granularities weather history is munged and stored at
+munged_grans_ = model_config["weather"]["munged_granularities"]
+
+
+def _naive_utc(date):
+    date = pd.Timestamp(date)
+    if date.tz is not None:
+        date = date.tz_convert('UTC').tz_localize(None)
+    return date.to_pydatetime()
+
+
+def _forecast_query(date):
+    """Mongo filter matching the forecasts pulled around date
+
+    Forecasts are dated by their first forecast hour, which is the first full
+    hour after they were pulled.
+
+    :param date: pd.Timestamp
+    :return: dict
     """
-    Get all observation data with the given building, device and system
-    combination from the database
+    date_lb = date - pd.Timedelta(refresh_rate)
+    date_ub = date + pd.Timedelta(refresh_rate) + pd.Timedelta(hours=1)
+    return {"date": {"$gte": _naive_utc(date_lb), "$lte": _naive_utc(date_ub)}}
+
+
+def _forecast_push(df, host, port, source, username, password,
+                   db_name, collection_name, grans=None):
+    """Push a forecast pulled from weather underground
 
     :param df: pd.DataFrame
         Dataframe to push to mongo_cred
@@ -24,68 +70,294 @@ def _forecast_push(df, host, port, source, username, password,
         name of the database on server
     :param collection_name: string
         collection name to use
+    :param grans: iterable
+        granularities to also store the forecast munged at, see
+        larkin.weather.wund.forecast_frame. Nothing munged is stored if None
 
     :return: None
     """
 
-    with pymongo.MongoClient(host=host, port=port) as conn:
-        conn[db_name].authenticate(username, password, source=source)
-        collection = conn[db_name][collection_name]
+    collection = larkin.db.connection.get_collection(
+            host, port, username, password, source, db_name, collection_name)
 
-        df.index.name = 'time'
-        # wund forecasts update hourly, so these labels will be unique
-        first_date_in_ts = df.index[0]
-        readings = df.reset_index().to_dict("records")
+    df.index.name = 'time'
+    # wund forecasts update hourly, so these labels will be unique
+    first_date_in_ts = df.index[0]
+    readings = df.reset_index().to_dict("records")
 
-        # don't need to check for existence of document--guaranteed not to exist
-        # for each run of model, due to 'date = pd.Timestamp.utcnow()'
-        collection.insert({
-            "weather_host": "Weather Underground",
-            "date": first_date_in_ts,
-            "readings": readings,
-            "units": "us"
-        })
+    munged = {}
+    for gran in grans or []:
+        frame = larkin.weather.wund.forecast_frame(df, gran)
+        frame.index.name = 'time'
+        munged[gran] = frame.reset_index().to_dict("records")
+
+    # don't need to check for existence of document--guaranteed not to exist
+    # for each run of model, due to 'date = pd.Timestamp.utcnow()'
+    collection.insert({
+        "weather_host": "Weather Underground",
+        "date": first_date_in_ts,
+        "readings": readings,
+        "munged": munged,
+        "units": "us"
+    })
+
+
+def _upsert_days(collection, df, key=None, fields=None):
+    """Upsert the readings of df as one document per UTC day
+
+    Rows are split into days in a single pass over the sorted index. Days
+    whose readings are unchanged since they were stored (according to the
+    checksum kept with each document) are skipped, and the rest are written
+    with unordered bulk_write calls of bounded size.
+
+    :param collection: pymongo.collection.Collection
+    :param df: pd.DataFrame
+        readings, with a UTC DatetimeIndex
+    :param key: dict
+        fields identifying the documents besides their date
+    :param fields: dict
+        extra fields to set on each document
+
+    :return: dict
+        number of 'documents' and 'bytes' (of readings, BSON encoded)
+        written
+    """
+    key = key or {}
+    fields = fields or {}
+    written = {'documents': 0, 'bytes': 0}
+    if not len(df):
+        return written
+
+    df = df.sort_index()
+    df.index.name = 'time'
+    records = df.reset_index().to_dict("records")
+    days = np.asarray(df.index.date)
+    bounds = np.concatenate(
+            [[0], np.flatnonzero(days[1:] != days[:-1]) + 1, [len(days)]])
+    daytimes = [pd.Timestamp(days[i]).to_pydatetime() for i in bounds[:-1]]
+
+    stored = dict(
+            (doc['date'], doc.get('checksum')) for doc in collection.find(
+                    dict(key, date={'$in': daytimes}),
+                    {'_id': 0, 'date': 1, 'checksum': 1}))
+
+    batch, batch_bytes = [], 0
+    for daytime, first, last in zip(daytimes, bounds[:-1], bounds[1:]):
+        readings = records[first:last]
+        encoded = bson.BSON.encode({'readings': readings})
+        checksum = hashlib.sha1(encoded).hexdigest()
+        if stored.get(daytime) == checksum:
+            continue
+
+        document = dict(fields, date=daytime, readings=readings,
+                        checksum=checksum, **key)
+        batch.append(pymongo.UpdateOne(dict(key, date=daytime),
+                                       {'$set': document}, upsert=True))
+        batch_bytes += len(encoded)
+        written['documents'] += 1
+        written['bytes'] += len(encoded)
+        if len(batch) >= max_batch_ops_ or batch_bytes >= max_batch_bytes_:
+            collection.bulk_write(batch, ordered=False)
+            batch, batch_bytes = [], 0
+    if len(batch):
+        collection.bulk_write(batch, ordered=False)
+
+    logger.info("Wrote {documents} day document(s), {bytes} bytes of readings,"
+                " to {collection}.".format(collection=collection.full_name,
+                                           **written))
+    return written
 
 
 def _mongo_history_push(df, host, port, source, db_name, username, password,
                         collection_name):
-    with pymongo.MongoClient(host=host, port=port) as conn:
-        conn[db_name].authenticate(username, password, source=source)
-        collection = conn[db_name][collection_name]
-        df.index.name = 'time'
-        # don't have to check if collection exists, due to upsert below
-        # this helper function is only pushing dates that don't exist in the db,
-        # due to checking in calling function. Hence, using upsert should not
-        # cost additional computation power vs just an insert
-        bulk = collection.initialize_unordered_bulk_op()
-        for date in pd.Series(df.index.date).unique():
-            readings = df.loc[
-                       date:date + relativedelta(days=1)].reset_index().to_dict(
-                "records")
-            daytime = pd.Timestamp(date)
-            bulk.find({"date": daytime}).upsert().update(
-                {
-                    "$set": {
-                        "weather_host": "Weather Underground",
-                        "date": daytime,
-                        "readings": readings,
-                        "units": "us"
-                    }
-                })
-        bulk.execute()
+    """Upsert weather history, one document per day
+
+    Only days that are new or changed since they were stored are written.
+
+    :return: dict, see _upsert_days
+    """
+    collection = larkin.db.connection.get_collection(
+            host, port, username, password, source, db_name, collection_name)
+    return _upsert_days(collection, df,
+                        fields={"weather_host": "Weather Underground",
+                                "units": "us"})
+
+
+def _munged_history_push(df, gran, host, port, source, db_name, username,
+                         password, collection_name):
+    """Upsert munged weather history, one document per day and granularity
+
+    :param df: pd.DataFrame
+        output of larkin.weather.wund.history_munge
+    :param gran: string
+        resampling granularity df was munged at
+    :return: dict, see _upsert_days
+    """
+    collection = larkin.db.connection.get_collection(
+            host, port, username, password, source, db_name, collection_name)
+    return _upsert_days(collection, df, key={"granularity": gran},
+                        fields={"weather_host": "Weather Underground",
+                                "units": "us"})
+
+
+def munged_history_update(grans, host, port, source, username, password,
+                          db_name, collection_name, history_collection_name):
+    """Munge newly archived weather history, and store it at each granularity
+
+    Only the days from the last stored munged day onwards are munged again,
+    with one extra day of raw history for the backfills of history_munge to
+    draw on. Everything is munged when nothing is stored yet for a
+    granularity.
+
+    :param grans: iterable
+        resampling granularities to store
+    :param collection_name: string
+        collection holding munged history
+    :param history_collection_name: string
+        raw history collection, in the same database
+    """
+    collection = larkin.db.connection.get_collection(
+            host, port, username, password, source, db_name, collection_name)
+    for gran in grans:
+        latest = collection.find_one({"granularity": gran}, {"date": 1},
+                                     sort=[("date", pymongo.DESCENDING)])
+        since = None
+        if latest is not None:
+            since = pd.Timestamp(latest["date"]).tz_localize('UTC')
+
+        raw = get_history(host=host, port=port, source=source,
+                          db_name=db_name, username=username,
+                          password=password,
+                          collection_name=history_collection_name,
+                          start=None if since is None
+                          else since - relativedelta(days=1),
+                          use_cache=False)
+        if len(raw) == 0:
+            continue
+
+        munged = larkin.weather.wund.history_munge(df=raw, gran=gran)
+        if since is not None:
+            munged = munged[since:]
+        if len(munged):
+            _munged_history_push(munged, gran, host=host, port=port,
+                                 source=source, db_name=db_name,
+                                 username=username, password=password,
+                                 collection_name=collection_name)
+
+
+def _history_committer(stored, host, port, source, username, password,
+                       db_name, collection_name):
+    """Callbacks pushing consecutive batches of pulled history days
+
+    Documents hold a UTC day, which straddles two local days, so the last
+    UTC day of each batch is held back until the next batch completes it.
+
+    :param stored: pd.DataFrame
+        stored history the first batch overlaps
+    :return: tuple of callables
+        commit, taking a list of daily history_pull frames, and flush, to
+        push the held back day once all batches are committed
+    """
+    held_back = [stored]
+
+    def push(df):
+        _mongo_history_push(df, host=host, port=port, source=source,
+                            username=username, password=password,
+                            db_name=db_name, collection_name=collection_name)
+
+    def commit(frames):
+        archive = pd.concat(held_back + frames)
+        archive.index.name = None
+        # check for duplicate entries from weather underground, and delete
+        # all except one. Unfortunately, drop_duplicates works only for column
+        # entries, not timestamp row indices, so...
+        archive = archive.reset_index().drop_duplicates('index').set_index(
+            'index')
+        last_day = pd.Timestamp(archive.index[-1].date(), tz='UTC')
+        held_back[:] = [archive[archive.index >= last_day]]
+        # push to mongo_cred. Mongo upsert checks if dates already exist,
+        # and if they don't, new items are pushed
+        push(archive[archive.index < last_day])
+
+    def flush():
+        if len(held_back[0]):
+            push(held_back[0])
+            held_back[:] = [pd.DataFrame()]
+
+    return commit, flush
+
+
+def history_replay(city, state, host, port, source, username, password,
+                   db_name, collection_name, munged_collection_name=None,
+                   grans=munged_grans_,
+                   commit_days=larkin.weather.wund.wund_cfg_["commit_days"]):
+    """Rebuild the weather history archive from the local response cache
+
+    Every day cached by larkin.weather.wund.history_pull for city and state
+    is pushed again, without any request to weather underground, except for
+    days whose response was fetched before the day was over (see
+    larkin.weather.wund_cache.load).
+
+    :param city: string
+    :param state: string
+    :param munged_collection_name: string
+        Collection to also store munged history in, see
+        munged_history_update. Not stored if None
+    :param grans: iterable
+        Resampling granularities of the munged history
+    :param commit_days: int
+        number of days pushed at a time
+    :return: int. Number of days replayed
+    """
+    dates = larkin.weather.wund_cache.cached_dates(city, state)
+    commit, flush = _history_committer(
+            pd.DataFrame(), host=host, port=port, source=source,
+            username=username, password=password, db_name=db_name,
+            collection_name=collection_name)
+    replayed, pending = 0, []
+    try:
+        for date in dates:
+            parsed_json = larkin.weather.wund_cache.load(city, state, date)
+            # days not fetched final may be partial, and are left to
+            # history_update
+            if parsed_json is None:
+                continue
+            pending.append(larkin.weather.wund.history_frame(parsed_json))
+            if len(pending) >= commit_days:
+                commit(pending)
+                replayed, pending = replayed + len(pending), []
+        if len(pending):
+            commit(pending)
+            replayed += len(pending)
+    finally:
+        flush()
+
+    if munged_collection_name is not None and replayed:
+        munged_history_update(grans, host=host, port=port,
+                              source=source, username=username,
+                              password=password, db_name=db_name,
+                              collection_name=munged_collection_name,
+                              history_collection_name=collection_name)
+    return replayed
 
 
 def forecast_update(city, state, wund_url, host, port, source, username,
-                    password, db_name, collection_name):
+                    password, db_name, collection_name, grans=munged_grans_):
+    """Pull the current forecast and store it, also munged at grans
+
+    :param grans: iterable
+        granularities to store the munged forecast at, see get_forecast
+    """
     data = larkin.weather.wund.forecast_pull(city=city, state=state,
                                              wund_url=wund_url)
     _forecast_push(data, host=host, port=port, source=source,
                    username=username, password=password, db_name=db_name,
-                   collection_name=collection_name)
+                   collection_name=collection_name, grans=grans)
 
 
 def history_update(city, state, tz, wund_url, parallel, host, port, source,
-                   username, password, db_name, collection_name, cap):
+                   username, password, db_name, collection_name, cap,
+                   munged_collection_name=None, grans=munged_grans_):
     """Pull archived weather information
 
     Weather information is pulled from weather underground from end of
@@ -104,17 +376,19 @@ def history_update(city, state, tz, wund_url, parallel, host, port, source,
     restrictions
     :param parallel: Boolean.
     Whether to process in parallel
-    Resampling granularity
-    Whether or not to munge wunderground pulled data
+    :param munged_collection_name: string
+    Collection to also store munged history in, see munged_history_update.
+    Not stored if None
+    :param grans: iterable
+    Resampling granularities of the munged history
     :return: dataframe
     Weather underground history data, indexed with granularity gran
     """
 
-    weather_data = get_history(host=host, port=port, source=source,
-                               db_name=db_name, username=username,
-                               password=password,
-                               collection_name=collection_name,
-                               )
+    latest = get_latest_history_time(host=host, port=port, source=source,
+                                     db_name=db_name, username=username,
+                                     password=password,
+                                     collection_name=collection_name)
 
     # start is beginning of day for last entry in weather_data
     # we toss out any times already existing between start and end of
@@ -130,14 +404,21 @@ def history_update(city, state, tz, wund_url, parallel, host, port, source,
     # end time is same for both conditions, but start changes
     # depending on whether db is populated or not
     end = pd.Timestamp.utcnow().tz_convert(tz_obj).date()
-    if len(weather_data) == 0:
+    if latest is None:
         start = pd.Timestamp.utcnow().tz_convert(tz_obj).date()\
                 - relativedelta(years=4)
         weather_data = pd.DataFrame()
     else:
+        start = latest.date()
+        # only the stored days the update overlaps are read back
+        weather_data = get_history(host=host, port=port, source=source,
+                                   db_name=db_name, username=username,
+                                   password=password,
+                                   collection_name=collection_name,
+                                   start=pd.Timestamp(start, tz='UTC'),
+                                   use_cache=False)
         if not isinstance(weather_data, pd.DataFrame):
             raise ValueError("History pull as dataframe failed")
-        start = weather_data.index[-1].date()
 
     # if start == end:
     #     logging.warn(
@@ -147,48 +428,96 @@ def history_update(city, state, tz, wund_url, parallel, host, port, source,
     interval = pd.date_range(start, end)
     wdata_days_comp = weather_data[:start]
 
-    if parallel:
-        frames = Parallel(n_jobs=-1)(
-            delayed(larkin.weather.wund.history_pull)(
-                city=city, state=state,
-                wund_url=wund_url,
-                date=date)
-            for date in interval[:cap])
-    else:
-        frames = [larkin.weather.wund.history_pull(
-            city=city, state=state,
-            wund_url=wund_url, date=date)
-                  for date in interval[:cap]]
+    # days are stored as they are pulled, so that an interrupted backfill
+    # keeps its progress
+    commit, flush = _history_committer(
+            wdata_days_comp, host=host, port=port, source=source,
+            username=username, password=password, db_name=db_name,
+            collection_name=collection_name)
+
+    try:
+        larkin.weather.wund.history_backfill(
+                city=city, state=state, wund_url=wund_url,
+                dates=interval[:cap], commit=commit,
+                max_workers=larkin.weather.wund.wund_cfg_["max_workers"]
+                if parallel else 1)
+    finally:
+        flush()
+
+    if munged_collection_name is not None:
+        munged_history_update(grans, host=host, port=port,
+                              source=source, username=username,
+                              password=password, db_name=db_name,
+                              collection_name=munged_collection_name,
+                              history_collection_name=collection_name)
+
+
+def _history_query(start=None, end=None):
+    """Mongo filter matching the daily history documents covering a range
+
+    :param start: pd.Timestamp
+    :param end: pd.Timestamp
+    :return: dict
+    """
+    bounds = {}
+    # documents are keyed by the (naive UTC) day of their readings
+    for operator, date in [('$gte', start), ('$lte', end)]:
+        if date is not None:
+            date = pd.Timestamp(date)
+            if date.tzinfo is not None:
+                date = date.tz_convert('UTC').tz_localize(None)
+            bounds[operator] = date.normalize().to_pydatetime()
+    return {'date': bounds} if bounds else {}
 
-    weather_update = pd.concat(frames)
-    archive = pd.concat([wdata_days_comp, weather_update])
 
-    if isinstance(weather_update, pd.DataFrame) \
-            and isinstance(archive, pd.DataFrame):
+def get_latest_history_time(host, port, source, db_name, username, password,
+                            collection_name):
+    """Time of the latest stored weather history reading
 
-        # check for duplicate entries from weather underground, and delete
-        # all except one. Unfortunately, drop_duplicates works only for column
-        # entries, not timestamp row indices, so...
-        archive = archive.reset_index().drop_duplicates('index').set_index(
-            'index')
-        # push to mongo_cred. Mongo upsert checks if dates already exist,
-        # and if they don't, new items are pushed
-        _mongo_history_push(archive,
-                            host=host,
-                            port=port,
-                            source=source,
-                            username=username,
-                            password=password,
-                            db_name=db_name,
-                            collection_name=collection_name
-                            )
+    Only the latest daily document is read, through the date index.
+
+    :return: pd.Timestamp in UTC, or None if no history is stored
+    """
+    collection = larkin.db.connection.get_collection(
+            host, port, username, password, source, db_name, collection_name)
+    latest = collection.find_one({}, {'_id': 0, 'readings.time': 1},
+                                 sort=[("date", pymongo.DESCENDING)])
+    if latest is None or not len(latest['readings']):
+        return None
+    return pd.Timestamp(max(reading['time'] for reading in
+                            latest['readings'])).tz_localize('UTC')
+
+
+def _cached_history(collection, host, port, db_name, collection_name):
+    # the cache is refreshed from the start of its latest day, since the
+    # latest stored day may have been completed since it was cached
+    cached = larkin.weather.history_cache.load(host, port, db_name,
+                                               collection_name)
+    if cached is None or len(cached) == 0:
+        cached, last_day = pd.DataFrame(), None
     else:
-        raise ValueError("Parallel concatenation of dataframes failed")
+        last_day = cached.index[-1].normalize()
+
+    fresh = larkin.db.decode.readings_to_frame(
+            collection.find(_history_query(start=last_day),
+                            history_projection_))
+    if len(fresh) == 0:
+        return cached
+    fresh = fresh.tz_localize('UTC')
+
+    if last_day is not None:
+        stale = cached[last_day:]
+        if stale.shape == fresh.shape and stale.equals(fresh):
+            return cached
+        fresh = pd.concat([cached[cached.index < last_day], fresh])
+    larkin.weather.history_cache.save(host, port, db_name, collection_name,
+                                      fresh)
+    return fresh
 
 
 def get_history(host, port, source, db_name, username, password,
-                collection_name):
-    """
+                collection_name, start=None, end=None, use_cache=use_cache_):
+    """Decoded weather history
 
     :param host:
     :param port:
@@ -197,62 +526,129 @@ def get_history(host, port, source, db_name, username, password,
     :param username:
     :param password:
     :param collection_name:
+    :param start: pd.Timestamp
+        earliest reading time to return. Defaults to all available data
+    :param end: pd.Timestamp
+        latest reading time to return. Defaults to all available data
+    :param use_cache: bool
+        keep the decoded history in a local cache, and only read the days
+        stored since it was last refreshed
     :return: DataFrame
     """
-    whist = []
-    with pymongo.MongoClient(host=host, port=port) as conn:
-        conn[db_name].authenticate(username, password, source=source)
-        collection = conn[db_name][collection_name]
-        for data in collection.find():
-            reading = data['readings']
-            whist.append(reading)
+    collection = larkin.db.connection.get_collection(
+            host, port, username, password, source, db_name, collection_name)
+
+    if use_cache:
+        whist = _cached_history(collection, host, port, db_name,
+                                collection_name)
+    else:
+        whist = larkin.db.decode.readings_to_frame(
+                collection.find(_history_query(start, end),
+                                history_projection_))
+        if len(whist):
+            # key step--must localize to UTC uniformly across suite
+            whist = whist.tz_localize('UTC')
 
     if len(whist) == 0:
-        return whist
+        return []
     else:
-        # convert list of lists of dictionaries to list of dictionaries
-        whist = [j for i in whist for j in i]
-        whist = pd.DataFrame(whist)
-        whist.set_index('time', inplace=True)
-        whist = whist.sort_index()
+        return whist[start:end]
+
+
+def get_munged_history(host, port, source, db_name, username, password,
+                       collection_name, gran, history_collection_name=None):
+    """Weather history as munged and stored at ingest time
+
+    :param collection_name: string
+        collection holding munged history, see munged_history_update
+    :param gran: string
+        resampling granularity
+    :param history_collection_name: string
+        raw history collection, in the same database. If given, and nothing
+        has been munged at gran yet, the raw history is read and munged
+        instead
+    :return: DataFrame, in the format of larkin.weather.wund.history_munge
+    """
+    collection = larkin.db.connection.get_collection(
+            host, port, username, password, source, db_name, collection_name)
+    whist = larkin.db.decode.readings_to_frame(
+            collection.find({"granularity": gran}, history_projection_))
 
-        # key step--must localize to UTC uniformly across suite
+    if len(whist) == 0:
+        if history_collection_name is None:
+            return []
+        return larkin.weather.wund.history_munge(
+                df=get_history(host=host, port=port, source=source,
+                               db_name=db_name, username=username,
+                               password=password,
+                               collection_name=history_collection_name),
+                gran=gran)
+    else:
         whist = whist.tz_localize('UTC')
         return whist
 
 
+def _forecast_frame(document, gran):
+    """Decode a forecast document, munged at gran if gran isn't None"""
+    if gran is None:
+        wfore = pd.DataFrame(document['readings'])
+    else:
+        wfore = pd.DataFrame(document.get('munged', {}).get(gran, []))
+        if len(wfore) == 0:
+            # pushed without munging at gran
+            return larkin.weather.wund.forecast_frame(
+                    _forecast_frame(document, None), gran)
+    if len(wfore) == 0:
+        raise ValueError(_no_forecast_msg_)
+    wfore.set_index('time', inplace=True)
+    wfore = wfore.sort_index()
+    wfore = wfore.tz_localize('UTC')
+    return wfore
+
+
 def get_forecast(host, port, source, db_name, username, password,
-                 collection_name, date):
+                 collection_name, date, gran=None, use_cache=True):
+    """Forecast pulled around date
+
+    Forecasts are looked up by their indexed date, and kept in an
+    in-process cache keyed by the refresh_rate bucket of date, so every
+    building and kind of a run shares a single read.
+
+    :param date: pd.Timestamp
+        prediction date
+    :param gran: string
+        return the forecast munged at gran (see
+        larkin.weather.wund.forecast_frame) instead of the raw pull
+    :param use_cache: bool
+        whether to use the in-process cache
+
+    :return: pd.DataFrame
+    """
     # forecasts are always pushed after time that whole suite starts running
     # so implementation below is correct, and will result in us
     # being able to capture forecast and archive data used by operator in past
     # when in debug mode in present
-
-    date_lb = date - pd.Timedelta(refresh_rate)
-    date_ub = date + pd.Timedelta(refresh_rate)
-    with pymongo.MongoClient(host=host, port=port) as conn:
-        conn[db_name].authenticate(username, password, source=source)
-        collection = conn[db_name][collection_name]
-
-        for data in collection.find({
-            "_id":
-                {
-                    "$gte": ObjectId.from_datetime(
-                        date_lb),
-                    "$lte": ObjectId.from_datetime(
-                        date_ub)
-                }
-        }).sort(
-            "_id", pymongo.ASCENDING):
-            reading = data['readings']
-            wfore = pd.DataFrame(reading)
-            if len(wfore) == 0:
-                raise ValueError("An appropriate forecast for the passed"
-                                 "date does not exist in the database. Please"
-                                 "pass another date, and check to make sure"
-                                 "the database is functioning correctly.")
-            else:
-                wfore.set_index('time', inplace=True)
-                wfore = wfore.sort_index()
-                wfore = wfore.tz_localize('UTC')
-                return wfore
+    bucket = pd.Timestamp(_naive_utc(date)).floor(pd.Timedelta(refresh_rate))
+    key = (host, port, db_name, collection_name, bucket, gran)
+    if use_cache and key in _forecast_cache:
+        _forecast_cache[key] = _forecast_cache.pop(key)
+        return _forecast_cache[key].copy()
+
+    collection = larkin.db.connection.get_collection(
+            host, port, username, password, source, db_name, collection_name)
+
+    projection = {'_id': 0, 'readings': 1}
+    if gran is not None:
+        projection = {'_id': 0, 'readings': 1, 'munged.' + gran: 1}
+    document = collection.find_one(_forecast_query(date), projection,
+                                   sort=[("date", pymongo.ASCENDING)])
+    if document is None:
+        raise ValueError(_no_forecast_msg_)
+    wfore = _forecast_frame(document, gran)
+
+    if use_cache:
+        _forecast_cache[key] = wfore
+        while len(_forecast_cache) > forecast_cache_size_:
+            _forecast_cache.popitem(last=False)
+        wfore = wfore.copy()
+    return wfore
\ No newline at end of file
@@ -1,5 +1,6 @@
 # coding=utf-8
 # import pandas as pd
+import argparse
 import logging
 import logging.config
 
@@ -30,6 +31,8 @@ def main():
         db_name=dbs["weather_history_loc"][
             "db_name"],
         collection_name=dbs["weather_history_loc"][
+            "collection_name"],
+        munged_collection_name=dbs["weather_history_munged_loc"][
             "collection_name"]
     )
 
@@ -50,5 +53,35 @@ def main():
     logger.info("Finished weather DB update successfully.")
 
 
+def replay():
+    logger.info("Rebuilding weather history DB from the local cache:")
+    dbs = user_config["building_dbs"]
+    days = larkin.weather.mongo.history_replay(
+        city=dbs["wund_cred"]["city"],
+        state=dbs["wund_cred"]["state"],
+        host=dbs["mongo_cred"]["host"],
+        port=dbs["mongo_cred"]["port"],
+        source=dbs["mongo_cred"]["source"],
+        username=dbs["mongo_cred"][
+            "username"],
+        password=dbs["mongo_cred"]["password"],
+        db_name=dbs["weather_history_loc"][
+            "db_name"],
+        collection_name=dbs["weather_history_loc"][
+            "collection_name"],
+        munged_collection_name=dbs["weather_history_munged_loc"][
+            "collection_name"]
+    )
+    logger.info("Replayed {} cached days successfully.".format(days))
+
+
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Weather DB update.")
+    parser.add_argument("--replay", action='store_true',
+                        help="Rebuild the weather history DB from the local"
+                             " cache of weather underground responses,"
+                             " without pulling anything.")
+    if parser.parse_args().replay:
+        replay()
+    else:
+        main()
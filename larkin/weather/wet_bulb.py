@@ -8,6 +8,13 @@ __author__ = 'ashishgagneja'
 
 import math
 
+import numpy as np
+
+# the scalar search always converges within a few dozen steps; this only
+# guards against pathological inputs
+max_iter_ = 1000
+tolerance_ = 0.05
+
 
 def compute_bulb(temp, dewpt, pressure):
     """
@@ -39,6 +46,72 @@ def compute_bulb(temp, dewpt, pressure):
 
 
 
+def compute_bulb_array(temp, dewpt, pressure):
+    """
+    compute wet bulb temperatures in Celsius, for whole arrays at once
+
+    Runs the same search as compute_bulb on every element in lockstep: each
+    step evaluates the vapor pressure of all unconverged guesses at once, and
+    elements drop out of the search as soon as they are within tolerance, so
+    results match compute_bulb.
+
+    :param temp: array-like
+        temperatures in Fahrenheit
+    :param dewpt: array-like
+        dew point temperatures in Fahrenheit
+    :param pressure: array-like
+        pressures in Hg inches
+
+    :return: numpy array of float
+        NaN where any input is missing, or where the search didn't converge
+    """
+    temp_c = _convert_to_c(np.asarray(temp, dtype='float64'))
+    dewpt_c = _convert_to_c(np.asarray(dewpt, dtype='float64'))
+    pressure_mb = _convert_to_pressure_nmb(
+            np.asarray(pressure, dtype='float64'))
+    temp_c, dewpt_c, pressure_mb = np.broadcast_arrays(temp_c, dewpt_c,
+                                                       pressure_mb)
+
+    with np.errstate(invalid='ignore'):
+        es = 6.112 * np.exp((17.67 * temp_c) / (temp_c + 243.5))
+        rh = 100 * (np.exp(17.625 * dewpt_c / (243.04 + dewpt_c)) /
+                    np.exp(17.625 * temp_c / (243.04 + temp_c)))
+    e2 = es * (rh / 100.0)
+
+    wetbulb = np.zeros(temp_c.shape)
+    increase = np.full(temp_c.shape, 10.0)
+    prev_sign = np.ones(temp_c.shape)
+    valid = np.isfinite(temp_c) & np.isfinite(e2) & np.isfinite(pressure_mb)
+    wetbulb[~valid] = np.nan
+
+    # flat indices of the elements still being searched
+    shape = temp_c.shape
+    active = np.flatnonzero(valid)
+    wetbulb, increase, prev_sign = (wetbulb.ravel(), increase.ravel(),
+                                    prev_sign.ravel())
+    temp_c, press_mb, e2 = (temp_c.ravel(), pressure_mb.ravel(), e2.ravel())
+    for _ in range(max_iter_):
+        if not len(active):
+            break
+        guess = wetbulb[active]
+        ew_guess = 6.112 * np.exp(17.67 * guess / (guess + 243.5))
+        e_guess = ew_guess - press_mb[active] * (
+            temp_c[active] - guess) * 0.00066 * (1 + (0.00115 * guess))
+        e_diff = e2[active] - e_guess
+
+        # shrink the step by 10 every time the search overshoots
+        cursign = np.where(e_diff < 0, -1.0, 1.0)
+        flipped = cursign != prev_sign[active]
+        increase[active[flipped]] /= 10
+        prev_sign[active] = cursign
+
+        active = active[np.abs(e_diff) > tolerance_]
+        wetbulb[active] += increase[active] * prev_sign[active]
+    wetbulb[active] = np.nan
+
+    return wetbulb.reshape(shape)
+
+
 def compute_bulb_helper(args):
     """
     same as compute_bulb() except takes all its parameters as a list
@@ -3,7 +3,11 @@ import codecs
 import json
 import logging
 import re
-from urllib2 import urlopen
+import socket
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+from urllib2 import URLError, urlopen
 
 import numpy as np
 import pandas as pd
@@ -11,11 +15,22 @@ import pytz
 from pandas.tseries.offsets import timedelta
 
 import larkin.weather.wet_bulb
+import larkin.weather.wund_cache
 from larkin.model_config import model_config
+from larkin.user_config import user_config
 
 __author__ = "David Karapetyan"
 
+logger = logging.getLogger("root")
 stringcols = ['conds', 'wdire']
+# forecast fields holding {'english': ..., 'metric': ...} pairs
+english_cols_ = ['windchill', 'wspd', 'temp', 'qpf', 'snow', 'mslp',
+                 'heatindex', 'dewpoint', 'feelslike']
+wund_cfg_ = user_config["building_dbs"]["wund_cred"]
+use_cache_ = model_config["cache"]["enabled"]
+# failures worth retrying: network errors, and error or truncated responses
+# (quota errors come back as json without a 'history' key)
+retry_errors_ = (URLError, socket.error, ValueError, KeyError)
 
 
 def _dtype_conv(df=pd.DataFrame(),
@@ -38,34 +53,42 @@ def _dtype_conv(df=pd.DataFrame(),
     # fill done different for text vs float columns
     floatcols = df.columns[df.columns.isin(stringcols) == False]
     # convert each column label to appropriate dtype. Convert sentinels
-    # (negative numbers) to nan
+    # (negative numbers) to nan. Each column is converted in one pass, with
+    # masks rather than per-element lambdas
     for stringcol in stringcols:
         if stringcol in df.columns:
-            df[stringcol] = df[stringcol].apply(
-                lambda x: str(x) if x != 'N/A' else np.nan)
+            missing = (df[stringcol] == 'N/A').values
+            converted = np.array(df[stringcol].astype(str), dtype=object)
+            converted[missing] = np.nan
+            df[stringcol] = converted
     for floatcol in floatcols:
         if floatcol in df.columns:
-            df[floatcol] = df[floatcol].apply(
-                lambda x: float(x) if x != 'N/A' and float(
-                    x) > -999 else np.nan)
+            values = df[floatcol].values
+            if values.dtype.kind not in 'biuf':
+                values = np.array(values, dtype=object)
+                values[values == 'N/A'] = np.nan
+            # float() is applied to each entry by the object to float cast,
+            # so parsing (and errors on garbage) is unchanged. None entries
+            # (nulls in the json) are cast to nan, where float(None) used
+            # to raise
+            values = values.astype('float64')
+            with np.errstate(invalid='ignore'):
+                values[~(values > -999)] = np.nan
+            df[floatcol] = values
 
     # map conditions to uniformly spaced, unique integer values for processing
     # in models, with basic error checking.
     # conds reflects historical conditions, so bottom
     # code will make forecast conds be identical to history conds
     if 'conds' in df.columns:
-        df['conds'] = df['conds'].apply(
-            lambda x: conds_mapping[x] if x in conds_mapping.keys()
-            else np.nan)
+        df['conds'] = df['conds'].map(conds_mapping)
     if 'wdire' in df.columns:
-        df['wdire'] = df['wdire'].apply(
-            lambda x: wdire_mapping[x] if x in wdire_mapping.keys()
-            else np.nan)
+        df['wdire'] = df['wdire'].map(wdire_mapping)
         df[['conds', 'wdire']] = df[['conds', 'wdire']].fillna(method="bfill")
     return df
 
 
-def history_pull(city, state, wund_url, date):
+def history_pull(city, state, wund_url, date, use_cache=use_cache_):
     """Weather information is pulled from weather underground at specified
     day
 
@@ -77,10 +100,24 @@ def history_pull(city, state, wund_url, date):
     Weather underground account url (with key)
     :param state: string
     State to pull data for
+    :param use_cache: bool
+    Keep raw responses in the local cache of larkin.weather.wund_cache, and
+    don't go to the network for cached days that are over
     :return: dataframe
     Weather parameters, indexed by hour
     """
+    parsed_json = None
+    if use_cache:
+        parsed_json = larkin.weather.wund_cache.load(city, state, date)
 
+    if parsed_json is None:
+        parsed_json = _history_request(city, state, wund_url, date, use_cache)
+
+    return history_frame(parsed_json)
+
+
+def _history_request(city, state, wund_url, date, use_cache):
+    # request the history of a day, and cache the response if use_cache
     date_path = 'history_%s%s%s' % (date.strftime('%Y'),
                                     date.strftime('%m'),
                                     date.strftime('%d'))
@@ -90,10 +127,24 @@ def history_pull(city, state, wund_url, date):
     url = wund_url + \
           "%s/q/%s.json" % (date_path, city_path)
 
-    reader = codecs.getreader('utf-8')
-    f = urlopen(url)
-    parsed_json = json.load(reader(f))
+    f = urlopen(url, timeout=wund_cfg_["timeout"])
+    raw = f.read()
     f.close()
+    parsed_json = json.loads(raw.decode('utf-8'))
+    # error responses (for example over quota) aren't cached
+    if use_cache and 'history' in parsed_json:
+        larkin.weather.wund_cache.store(city, state, date, raw)
+    return parsed_json
+
+
+def history_frame(parsed_json):
+    """Dataframe of a weather underground history response
+
+    :param parsed_json: dict
+    Parsed response of the history API
+    :return: dataframe
+    Weather parameters, indexed by hour
+    """
     observations = parsed_json['history']['observations']
     # convert to dataframes for easy presentation and manipulation
 
@@ -107,6 +158,111 @@ def history_pull(city, state, wund_url, date):
     return df
 
 
+class RateLimiter(object):
+    """Spaces out requests to stay under a requests-per-minute limit
+
+    Thread-safe: requests from all threads sharing a limiter are spaced out
+    together.
+    """
+
+    def __init__(self, requests_per_minute):
+        """
+        :param requests_per_minute: float
+            maximum request rate. None or 0 disables limiting
+        """
+        self.interval = 60.0 / requests_per_minute if requests_per_minute \
+            else 0.0
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """Block until the next request is allowed"""
+        with self._lock:
+            now = time.time()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def history_backfill(city, state, wund_url, dates, commit,
+                     max_workers=wund_cfg_["max_workers"],
+                     requests_per_minute=wund_cfg_["requests_per_minute"],
+                     retries=wund_cfg_["retries"],
+                     backoff=wund_cfg_["backoff"],
+                     commit_days=wund_cfg_["commit_days"],
+                     use_cache=use_cache_):
+    """Pull the history of many days concurrently, within the API rate limit
+
+    Days are pulled by a pool of threads, since the work is network bound.
+    Failed pulls are retried with exponential backoff. Pulled days are passed
+    to commit in date order, every commit_days days, so that progress made
+    before a failure is kept; the days pulled before a failing day are
+    committed before its error is raised.
+
+    :param city: string
+    :param state: string
+    :param wund_url: string
+        Weather underground account url (with key). Any server answering
+        the history API, for example a local stub, can be used
+    :param dates: iterable of datetime objects
+        days to pull
+    :param commit: callable
+        called with a list of consecutive daily history_pull frames
+    :param max_workers: int
+        maximum number of concurrent requests
+    :param requests_per_minute: float
+        maximum request rate, including retries
+    :param retries: int
+        number of retries of a failed pull
+    :param backoff: float
+        seconds to wait before the first retry, doubled on each retry
+    :param commit_days: int
+        number of days per commit
+    :param use_cache: bool
+        see history_pull. Days served from the cache don't count towards
+        the rate limit
+
+    :return: int. Number of days pulled and committed
+    """
+    limiter = RateLimiter(requests_per_minute)
+
+    def pull(date):
+        if use_cache:
+            parsed_json = larkin.weather.wund_cache.load(city, state, date)
+            if parsed_json is not None:
+                return history_frame(parsed_json)
+        for attempt in range(retries + 1):
+            limiter.wait()
+            try:
+                return history_frame(_history_request(
+                        city, state, wund_url, date, use_cache))
+            except retry_errors_ as err:
+                if attempt == retries:
+                    raise
+                delay = backoff * 2 ** attempt
+                logger.warn("History pull for {} failed ({}). Retrying in"
+                            " {}s.".format(date, err, delay))
+                time.sleep(delay)
+
+    pool = ThreadPool(max(1, max_workers))
+    pending, committed = [], 0
+    try:
+        # imap yields in date order, whatever order the pulls finish in
+        for frame in pool.imap(pull, dates):
+            pending.append(frame)
+            if len(pending) >= commit_days:
+                batch, pending = pending, []
+                commit(batch)
+                committed += len(batch)
+    finally:
+        pool.terminate()
+        if len(pending):
+            commit(pending)
+            committed += len(pending)
+    return committed
+
+
 def history_munge(df, gran):
     """For munging history pull from weather underground
 
@@ -140,12 +296,10 @@ def history_munge(df, gran):
     df_new = df_new.fillna(method="bfill")
 
     # add wetbulb temperature
-    df_new['wetbulb'] = df_new.apply(
-        lambda x: larkin.weather.wet_bulb.compute_bulb(
-            temp=x['temp'],
-            dewpt=x['dewpt'],
-            pressure=x['pressure']),
-        axis=1)
+    df_new['wetbulb'] = larkin.weather.wet_bulb.compute_bulb_array(
+        temp=df_new['temp'],
+        dewpt=df_new['dewpt'],
+        pressure=df_new['pressure'])
 
     return df_new
 
@@ -179,30 +333,38 @@ def forecast_pull(city, state, wund_url):
     return df
 
 
-def forecast_munge(df, gran, weather_history_munged=None):
-    """For munging forecast pull from weather underground
+def _nested_field(column, field):
+    """Values of field in a column of dicts, in one pass
+
+    :param column: pd.Series
+    :param field: string
+    :return: list
+    """
+    return [value[field] for value in column.values]
+
+
+def forecast_frame(df, gran):
+    """Munge a forecast pull from weather underground, on its own
+
+    The munged forecast starts at the first forecast hour, see
+    forecast_continue for continuing the munged weather history.
 
     :param df: dataframe
     Weather underground forecast pull
-    :param gran: int
+    :param gran: string
     Resampling granularity
     :return: dataframe
     """
-    # toss out metric system in favor of english system
+    # toss out metric system in favor of english system. Each nested field
+    # is pulled out of its column in a single pass
     df_new = df.copy()
-    for column in ['windchill', 'wspd', 'temp', 'qpf', 'snow', 'mslp',
-                   'heatindex', 'dewpoint', 'feelslike']:
-        df_new[column] = df_new[column].apply(
-            lambda x: x['english']
-        )
-
-        # add columns from forecast data to match weather underground past
-        # data pull
+    for column in english_cols_:
+        df_new[column] = _nested_field(df[column], 'english')
 
-        df_new['wdird'] = df_new['wdir'].apply(
-            lambda x: x['degrees'])
-        df_new['wdire'] = df_new['wdir'].apply(
-            lambda x: x['dir'])
+    # add columns from forecast data to match weather underground past
+    # data pull
+    df_new['wdird'] = _nested_field(df['wdir'], 'degrees')
+    df_new['wdire'] = _nested_field(df['wdir'], 'dir')
 
     # rename to have name mappings of identical entries in historical and
     # forecast dataframes be the same
@@ -225,41 +387,62 @@ def forecast_munge(df, gran, weather_history_munged=None):
     df_new = df_new.resample(gran).last()
     df_new = df_new.fillna(method="bfill")
 
+    # add wetbulb temperature. Rows filled in by forecast_continue are copies
+    # of the first forecast row, so their wetbulb is the same
+    df_new['wetbulb'] = larkin.weather.wet_bulb.compute_bulb_array(
+        temp=df_new['temp'],
+        dewpt=df_new['dewpt'],
+        pressure=df_new['pressure'])
+
+    return df_new
+
+
+def forecast_continue(df, gran, weather_history_munged=None):
+    """Fill the time gap between munged weather history and forecast
+
+    :param df: dataframe
+    Forecast, as munged by forecast_frame
+    :param gran: string
+    Resampling granularity
+    :param weather_history_munged: dataframe
+    Weather history munged at gran
+    :return: dataframe
+    """
     ###due to resampling and only hourly collection of forecasts by wund,
     # there may be a time gap between weather history and forecast condition
     # bottom fixes this
 
-    forecast_new = pd.Series()
     if weather_history_munged is None:
         logging.warn("You may have a timegap between realtime timeseries"
                      "and predictions. Provide the munged weather history"
                      "dataframe to avoid this")
-    else:
-
-        end_history = weather_history_munged.tail(1).index[0]
-        begin_forecast = df_new.head(1).index[0]
-        time_gap = begin_forecast - end_history
-        gran_int = int(re.search(r'\d+', gran).group())
-        normal_gap = timedelta(minutes=gran_int)
-
-        if time_gap != normal_gap:
-            forecast_new = pd.Series(
-                index=pd.date_range(
-                    start=end_history + normal_gap,
-                    end=begin_forecast - normal_gap,
-                    freq=gran))
-            forecast_new = forecast_new.append(df_new)
-            # fill new na's introduced at top
-            forecast_new = forecast_new.fillna(method="bfill")
-
-        else:
-            forecast_new = df_new
+        return df
 
-    # add wetbulb temperature
-    forecast_new['wetbulb'] = forecast_new.apply(
-        lambda x: larkin.weather.wet_bulb.compute_bulb(
-            temp=x['temp'],
-            dewpt=x['dewpt'],
-            pressure=x['pressure']), axis=1)
+    end_history = weather_history_munged.tail(1).index[0]
+    begin_forecast = df.head(1).index[0]
+    time_gap = begin_forecast - end_history
+    gran_int = int(re.search(r'\d+', gran).group())
+    normal_gap = timedelta(minutes=gran_int)
+
+    if time_gap == normal_gap:
+        return df
+
+    gap = pd.date_range(start=end_history + normal_gap,
+                        end=begin_forecast - normal_gap, freq=gran)
+    # fill new na's introduced at top
+    return df.reindex(gap.union(df.index)).fillna(method="bfill")
+
+
+def forecast_munge(df, gran, weather_history_munged=None):
+    """For munging forecast pull from weather underground
 
-    return forecast_new
+    :param df: dataframe
+    Weather underground forecast pull
+    :param gran: int
+    Resampling granularity
+    :param weather_history_munged: dataframe
+    Weather history munged at gran, which the forecast continues
+    :return: dataframe
+    """
+    return forecast_continue(forecast_frame(df, gran), gran,
+                             weather_history_munged)
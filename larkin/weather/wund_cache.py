@@ -0,0 +1,125 @@
+# coding=utf-8
+import datetime
+import hashlib
+import json
+import os
+
+import larkin.ts_proc.cache_files
+from larkin.model_config import model_config
+
+cache_dir_ = os.path.join(model_config["cache"]["directory"], "wund")
+# a day's history is final once the day is over in every timezone, and
+# weather underground has had time to publish late observations
+finalized_lag_days_ = 2
+# format of the fetch times recorded in refs
+fetched_format_ = '%Y%m%dT%H%M%S'
+
+
+def _ref_path(city, state, date):
+    """File naming the cached response of a city, state and day
+
+    :param city: string
+    :param state: string
+    :param date: datetime object
+    :return: string
+    """
+    return os.path.join(cache_dir_, 'refs', state, city,
+                        date.strftime('%Y%m%d'))
+
+
+def _object_path(digest):
+    return os.path.join(cache_dir_, 'objects', digest[:2], digest + '.json')
+
+
+def _read_ref(city, state, date):
+    # digest of the cached response of a day, and when it was fetched (None
+    # for refs written before fetch times were recorded)
+    ref = _ref_path(city, state, date)
+    if not os.path.isfile(ref):
+        return None, None
+    with open(ref, 'rb') as fp:
+        fields = fp.read().decode('ascii').split()
+    fetched = None
+    if len(fields) > 1:
+        fetched = datetime.datetime.strptime(fields[1], fetched_format_)
+    return fields[0], fetched
+
+
+def is_finalized(date, today=None):
+    """Whether the history of a day can no longer change
+
+    :param date: datetime object
+    :param today: datetime.date
+        defaults to the current UTC date
+    :return: bool
+    """
+    if today is None:
+        today = datetime.datetime.utcnow().date()
+    return (today - date.date()).days >= finalized_lag_days_
+
+
+def store(city, state, date, raw, fetched=None):
+    """Cache a raw history response
+
+    Responses are stored under the sha1 of their content, and a per-day
+    reference points at the latest response for the day, along with when it
+    was fetched. The response it replaces is removed: responses hold their
+    date and location, so no other day refers to it.
+
+    :param raw: bytes
+        response body, as returned by the history API
+    :param fetched: datetime.datetime
+        UTC time the response was fetched. Defaults to now
+    :return: string. sha1 digest of raw
+    """
+    if fetched is None:
+        fetched = datetime.datetime.utcnow()
+    digest = hashlib.sha1(raw).hexdigest()
+    previous, _ = _read_ref(city, state, date)
+    if not os.path.isfile(_object_path(digest)):
+        larkin.ts_proc.cache_files.write_bytes(_object_path(digest), raw)
+    ref = '{} {}'.format(digest, fetched.strftime(fetched_format_))
+    larkin.ts_proc.cache_files.write_bytes(_ref_path(city, state, date),
+                                           ref.encode('ascii'))
+    if previous is not None and previous != digest and \
+            os.path.isfile(_object_path(previous)):
+        os.remove(_object_path(previous))
+    return digest
+
+
+def load(city, state, date, finalized_only=True):
+    """Parsed cached history response of a day
+
+    :param finalized_only: bool
+        only return responses fetched once the day could no longer change.
+        Responses fetched earlier (e.g. while the day was under way) may be
+        partial
+    :return: dict, or None if the day isn't cached (or not finalized)
+    """
+    digest, fetched = _read_ref(city, state, date)
+    if digest is None:
+        return None
+    if finalized_only and (fetched is None or
+                           not is_finalized(date, fetched.date())):
+        return None
+    if not os.path.isfile(_object_path(digest)):
+        return None
+    with open(_object_path(digest), 'rb') as fp:
+        raw = fp.read()
+    # the content address doubles as an integrity check
+    if hashlib.sha1(raw).hexdigest() != digest:
+        return None
+    return json.loads(raw.decode('utf-8'))
+
+
+def cached_dates(city, state):
+    """Days with a cached history response, in date order
+
+    :return: list of datetime.datetime
+    """
+    directory = os.path.join(cache_dir_, 'refs', state, city)
+    if not os.path.isdir(directory):
+        return []
+    return sorted(datetime.datetime.strptime(name, '%Y%m%d')
+                  for name in os.listdir(directory)
+                  if not name.endswith('.tmp'))